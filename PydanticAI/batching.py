@@ -0,0 +1,45 @@
+"""
+Bounded fan-out for the batch endpoints, shared by the PydanticAI samples.
+
+At most `concurrency` items are processed at once, and each result is handed
+back as soon as it is ready, so a long batch starts answering right away.
+"""
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Iterable, TypeVar
+
+ItemT = TypeVar("ItemT")
+ResultT = TypeVar("ResultT")
+
+
+async def map_as_completed(
+    items: Iterable[ItemT], handle: Callable[[ItemT], Awaitable[ResultT]], concurrency: int
+) -> AsyncIterator[ResultT]:
+    """
+    Runs `handle` on every item, at most `concurrency` at a time, and yields the results in completion order.
+    `handle` should turn expected failures into results: an exception ends the stream with that exception.
+    Closing the generator early (the client went away) cancels the work still running.
+    """
+    items = list(items)
+    # (error, result) pairs, so a failing worker cannot leave the stream waiting forever
+    results: asyncio.Queue[tuple[Exception | None, ResultT | None]] = asyncio.Queue()
+    pending = iter(items)
+
+    async def worker():
+        # All workers share one iterator, so each item is taken exactly once
+        for item in pending:
+            try:
+                results.put_nowait((None, await handle(item)))
+            except Exception as e:
+                results.put_nowait((e, None))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(items)))]
+    try:
+        for _ in range(len(items)):
+            error, result = await results.get()
+            if error is not None:
+                raise error
+            yield result
+    finally:
+        for task in workers:
+            task.cancel()
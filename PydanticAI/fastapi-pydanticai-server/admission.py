@@ -0,0 +1,169 @@
+"""
+Admission control in front of the agent runs.
+
+Under a traffic spike we would rather answer some requests fast with a
+429 / 503 than accept everything and let every request get slow.
+1. `UserRateLimiter`: a token bucket per user_id (429 when empty)
+2. `AdmissionController`: a global limit on concurrent agent runs with a
+   bounded wait queue (503 when the queue is full or the wait is too long)
+
+Both raise `AdmissionRejected`, which carries a Retry-After hint in seconds.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> dict[str, str]:
+        # Retry-After must be a whole number of seconds
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBucket:
+    """ `rate` tokens per second, holding at most `capacity` tokens """
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def try_acquire(self, now: float) -> float:
+        """ Takes one token. Returns 0 on success, otherwise the seconds until a token is available """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class UserRateLimiter:
+    """ One token bucket per user. Only the `max_users` most recently seen users are tracked """
+
+    def __init__(self, rate: float, burst: int, max_users: int = 100_000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self._clock = clock
+        self._buckets: OrderedDict[int, TokenBucket] = OrderedDict()
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, user_id: int) -> None:
+        if not self.enabled:
+            return
+
+        now = self._clock()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst, now)
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(user_id)
+
+        wait = bucket.try_acquire(now)
+        if wait > 0:
+            self.rejected += 1
+            raise AdmissionRejected(429, f"Rate limit exceeded for user {user_id}", retry_after=wait)
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "tracked_users": len(self._buckets),
+            "rejected": self.rejected,
+        }
+
+
+class AdmissionController:
+    """
+    At most `max_concurrent` agent runs at a time, at most `max_queue`
+    requests waiting for a slot, and no request waits longer than `queue_timeout`.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.max_queue_depth_seen = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+        self._wait_times: deque[float] = deque(maxlen=1024)  # Recent waits, for percentiles
+        self._avg_run_seconds = 1.0  # Moving average of run time, used for Retry-After
+
+    def _retry_after(self) -> float:
+        # Roughly how long until the current queue drains
+        return self._avg_run_seconds * (self.queue_depth + 1) / self.max_concurrent
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """ Holds one of the concurrent-run slots for the duration of the block """
+        if self._semaphore.locked() and self.queue_depth >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected(503, "Server is busy, wait queue is full", self._retry_after())
+
+        self.queue_depth += 1
+        self.max_queue_depth_seen = max(self.max_queue_depth_seen, self.queue_depth)
+        waited_from = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            raise AdmissionRejected(503, "Server is busy, timed out waiting for a slot", self._retry_after())
+        finally:
+            self.queue_depth -= 1
+        self._wait_times.append(time.perf_counter() - waited_from)
+
+        self.admitted += 1
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            self._avg_run_seconds = 0.9 * self._avg_run_seconds + 0.1 * (time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        waits = sorted(self._wait_times)
+
+        def percentile(p: float) -> float:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2) if waits else 0.0
+
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth_seen": self.max_queue_depth_seen,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_ms_p50": percentile(0.50),
+            "wait_ms_p99": percentile(0.99),
+            "wait_ms_max": round(waits[-1] * 1000, 2) if waits else 0.0,
+        }
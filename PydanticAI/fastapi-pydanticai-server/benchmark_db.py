@@ -0,0 +1,102 @@
+"""
+Benchmark: per-request connections vs the pooled `Database`.
+
+Fires N concurrent `/ask` requests at the app (in-process, no network) with
+a stub model, so the only real work is the database access.
+It also counts how many SQLite connections were opened during each run.
+
+Run: python benchmark_db.py --requests 500
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import aiosqlite
+import httpx
+from pydantic_ai.models.test import TestModel
+
+import main
+from admission import AdmissionController, UserRateLimiter
+from database import Database, SELECT_HISTORY_PAGE, NO_CURSOR
+
+
+class PerRequestDatabase:
+    """ The old behaviour: a brand new connection for every lookup """
+
+    def __init__(self, path: str, history_limit: int = 20):
+        self.path = path
+        self.history_limit = history_limit
+
+    async def get_user_history(self, user_id: int, limit: int | None = None) -> list[str]:
+        async with aiosqlite.connect(self.path) as conn:
+            async with conn.execute(SELECT_HISTORY_PAGE, (user_id, NO_CURSOR, limit or self.history_limit)) as cursor:
+                rows = await cursor.fetchall()
+        return [message for _, message in reversed(rows)]
+
+
+connections_opened = 0
+_original_connect = aiosqlite.connect
+
+def counting_connect(*args, **kwargs):
+    global connections_opened
+    connections_opened += 1
+    return _original_connect(*args, **kwargs)
+
+
+async def seed(path: str, users: int, per_user: int) -> None:
+    db = await Database(path, pool_size=1).open(seed_demo_data=False)
+    rows = [(user_id, f"Interaction {i} of user {user_id}") for user_id in range(users) for i in range(per_user)]
+    await db.add_interactions(rows)
+    await db.close()
+
+
+async def run_requests(label: str, db, requests: int, users: int) -> None:
+    global connections_opened
+
+    main.app.dependency_overrides[main.get_db] = lambda: db
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        connections_opened = 0
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.post("/ask", json={"user_id": i % users, "question": f"Question {i}"})
+            for i in range(requests)
+        ])
+        elapsed = time.perf_counter() - start
+
+    failed = sum(1 for r in responses if r.status_code != 200)
+    print(f"{label:<12} {requests / elapsed:>10.1f} req/s  {elapsed * 1000:>9.1f} ms total  "
+          f"{connections_opened:>5} connections opened  {failed} failed")
+
+
+async def main_async(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        await seed(path, args.users, args.history)
+
+        aiosqlite.connect = counting_connect
+
+        # Measure the data layer only: no caching or admission limits, a stub model
+        main.response_cache = None
+        main.rate_limiter = UserRateLimiter(rate=0, burst=0)
+        main.admission = AdmissionController(max_concurrent=args.requests, max_queue=args.requests, queue_timeout=60)
+        with main.agent.override(model=TestModel()):
+            await run_requests("per-request", PerRequestDatabase(path), args.requests, args.users)
+
+            pooled = await Database(path, pool_size=args.pool_size).open(seed_demo_data=False)
+            try:
+                await run_requests("pooled", pooled, args.requests, args.users)
+            finally:
+                await pooled.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="Concurrent /ask requests per run")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--history", type=int, default=200, help="Interactions stored per user")
+    parser.add_argument("--pool-size", type=int, default=10)
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,82 @@
+"""
+Benchmark: prefetched history vs the get_user_history tool.
+
+Uses a FunctionModel stand-in that sleeps like a real model call.
+When the get_user_history tool is offered and has not been called yet it
+calls it (like Gemini usually does), otherwise it answers straight away.
+
+Run: python benchmark_prefetch.py --requests 50 --model-latency 0.2
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+from pydantic_ai.messages import ModelMessage, ModelResponse, ToolCallPart, ToolReturnPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+import main
+from admission import AdmissionController, UserRateLimiter
+from database import Database
+
+
+def make_stand_in_model(latency: float) -> FunctionModel:
+    async def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        await asyncio.sleep(latency)
+
+        history_called = any(
+            isinstance(part, ToolReturnPart) and part.tool_name == "get_user_history"
+            for message in messages for part in message.parts
+        )
+        tool_names = {tool.name for tool in info.function_tools}
+        if "get_user_history" in tool_names and not history_called:
+            return ModelResponse(parts=[ToolCallPart("get_user_history", {})])
+
+        answer = {"answer": "The current interest rate is 5%.", "confidence_score": 0.9, "requires_followup": False}
+        return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, answer)])
+
+    return FunctionModel(respond)
+
+
+async def run_mode(mode: str, client: httpx.AsyncClient, requests: int) -> None:
+    main.HISTORY_MODE = mode
+    latencies, model_calls = [], []
+
+    async def one(i: int) -> None:
+        start = time.perf_counter()
+        response = await client.post("/ask", json={"user_id": 1, "question": f"Question {i}"})
+        latencies.append(time.perf_counter() - start)
+        model_calls.append(int(response.headers["X-Model-Calls"]))
+
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    print(f"{mode:<9} model calls/request: {statistics.mean(model_calls):.2f}  "
+          f"latency p50: {statistics.median(latencies) * 1000:.0f} ms  "
+          f"max: {max(latencies) * 1000:.0f} ms")
+
+
+async def main_async(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        main.app.state.db = await Database(os.path.join(tmp, "bench.db")).open()
+        # Every request must reach the model, none may be throttled
+        main.response_cache = None
+        main.rate_limiter = UserRateLimiter(rate=0, burst=0)
+        main.admission = AdmissionController(max_concurrent=args.requests, max_queue=args.requests, queue_timeout=60)
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            with main.agent.override(model=make_stand_in_model(args.model_latency)):
+                for mode in ("tool", "prefetch"):
+                    await run_mode(mode, client, args.requests)
+
+        await main.app.state.db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--model-latency", type=float, default=0.2, help="Seconds per simulated model call")
+    asyncio.run(main_async(parser.parse_args()))
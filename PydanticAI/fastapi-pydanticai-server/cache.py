@@ -0,0 +1,131 @@
+"""
+An in-process response cache for the `/ask` endpoint.
+
+Retrying clients often send the exact same question a few seconds apart.
+Instead of running the agent again we:
+1. Serve a recent answer from an LRU cache (entries expire after a TTL)
+2. Coalesce concurrent identical requests onto ONE in-flight agent run (single-flight)
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+def normalize_question(question: str) -> str:
+    """ Case and whitespace insensitive form of the question """
+    return " ".join(question.lower().split())
+
+
+def history_fingerprint(history: list[str]) -> str:
+    """ A short stable hash of the user's history, so new history invalidates old answers """
+    digest = hashlib.sha256()
+    for item in history:
+        digest.update(item.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()[:16]
+
+
+def make_cache_key(user_id: int, question: str, history: list[str]) -> tuple:
+    return (user_id, normalize_question(question), history_fingerprint(history))
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache with single-flight de-duplication.
+
+    Only successful results are stored. If the shared run fails, every
+    waiter receives the same exception and the next request tries again.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+        self.stats = CacheStats()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.stats.expirations += 1
+            return None
+
+        # Mark as most recently used
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (self._clock() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the cached value for `key`, joins an identical run that is
+        already in progress, or starts a new one with `compute()`.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.stats.hits += 1
+            return value
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.stats.coalesced += 1
+        else:
+            self.stats.misses += 1
+            task = asyncio.create_task(self._run(key, compute))
+            # Mark the exception as retrieved even if every caller went away
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._in_flight[key] = task
+
+        # shield() so a disconnecting caller does not cancel the run other callers are waiting on
+        return await asyncio.shield(task)
+
+    async def _run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await compute()
+            self.put(key, value)
+            return value
+        finally:
+            self._in_flight.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def snapshot(self) -> dict:
+        """ Counters used to size the cache """
+        lookups = self.stats.hits + self.stats.misses + self.stats.coalesced
+        return {
+            **asdict(self.stats),
+            "entries": len(self._entries),
+            "in_flight": len(self._in_flight),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hit_ratio": round((self.stats.hits + self.stats.coalesced) / lookups, 4) if lookups else 0.0,
+        }
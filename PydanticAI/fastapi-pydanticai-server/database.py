@@ -0,0 +1,121 @@
+"""
+The data layer behind `AppDependencies.db`.
+
+A small async SQLite store with a bounded connection pool.
+- All connections are opened ONCE (in the FastAPI lifespan), never per request
+- Queries are constant SQL strings, so each connection's statement cache
+  keeps them prepared after the first use
+- History reads are paginated, so a huge history is never loaded whole
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import aiosqlite
+
+DB_FILE = "banking.db"
+
+# Seed data for the demo users used in the README examples
+DEMO_USER_IDS = (1, 101)
+DEMO_HISTORY = ["User asked about the interest rates", "User checked the balance"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS interactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_interactions_user ON interactions (user_id, id);
+"""
+
+# Prepared queries (kept in each connection's statement cache)
+SELECT_HISTORY_PAGE = (
+    "SELECT id, message FROM interactions "
+    "WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?"
+)
+INSERT_INTERACTION = "INSERT INTO interactions (user_id, message) VALUES (?, ?)"
+COUNT_INTERACTIONS = "SELECT COUNT(*) FROM interactions"
+
+# Larger than any rowid, used as the "before" cursor of the first page
+NO_CURSOR = 2 ** 63 - 1
+
+
+class Database:
+    """ An async SQLite database with a fixed-size connection pool """
+
+    def __init__(self, path: str = DB_FILE, pool_size: int = 10, history_limit: int = 20):
+        self.path = path
+        self.pool_size = pool_size
+        # Default number of interactions returned per user
+        self.history_limit = history_limit
+        self._pool: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue(maxsize=pool_size)
+        self._connections: list[aiosqlite.Connection] = []
+
+    async def open(self, seed_demo_data: bool = True) -> "Database":
+        """ Opens every pooled connection and creates the schema """
+        for _ in range(self.pool_size):
+            conn = await aiosqlite.connect(self.path, cached_statements=64)
+            await conn.execute("PRAGMA journal_mode=WAL")
+            await conn.execute("PRAGMA synchronous=NORMAL")
+            self._connections.append(conn)
+            self._pool.put_nowait(conn)
+
+        async with self.connection() as conn:
+            await conn.executescript(SCHEMA)
+            if seed_demo_data:
+                async with conn.execute(COUNT_INTERACTIONS) as cursor:
+                    (count,) = await cursor.fetchone()
+                if count == 0:
+                    await conn.executemany(
+                        INSERT_INTERACTION,
+                        [(user_id, message) for user_id in DEMO_USER_IDS for message in DEMO_HISTORY],
+                    )
+                    await conn.commit()
+        return self
+
+    async def close(self) -> None:
+        for conn in self._connections:
+            await conn.close()
+        self._connections.clear()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """ Borrows a connection from the pool (waits if all are busy) """
+        conn = await self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put_nowait(conn)
+
+    async def get_user_history_page(
+        self, user_id: int, limit: int | None = None, before_id: int | None = None
+    ) -> tuple[list[str], int | None]:
+        """
+        Returns one page of the user's history (oldest first) and the cursor
+        to pass as `before_id` for the previous page, or None if there is none.
+        """
+        limit = limit or self.history_limit
+        async with self.connection() as conn:
+            async with conn.execute(
+                SELECT_HISTORY_PAGE, (user_id, before_id or NO_CURSOR, limit + 1)
+            ) as cursor:
+                rows = await cursor.fetchall()
+
+        # We asked for one extra row to know if an older page exists
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = rows[-1][0] if has_more else None
+        return [message for _, message in reversed(rows)], next_cursor
+
+    async def get_user_history(self, user_id: int, limit: int | None = None) -> list[str]:
+        """ The user's most recent interactions, oldest first """
+        history, _ = await self.get_user_history_page(user_id, limit=limit)
+        return history
+
+    async def add_interactions(self, rows: list[tuple[int, str]]) -> None:
+        """ Bulk insert of (user_id, message) rows """
+        async with self.connection() as conn:
+            await conn.executemany(INSERT_INTERACTION, rows)
+            await conn.commit()
@@ -0,0 +1,106 @@
+"""
+Load test: admission control under overload.
+
+The stand-in model behaves like a real upstream with limited capacity:
+each call takes `--model-latency` seconds and at most `--upstream-capacity`
+calls are served at once (the rest queue up inside the "provider").
+
+We fire `--requests` concurrent /ask calls (distinct users, so the per-user
+rate limit does not kick in) twice:
+- "unlimited": every request is admitted and waits inside the upstream
+- "admission": MAX_CONCURRENT_RUNS / MAX_QUEUED_RUNS style limits
+With admission control the accepted requests keep a bounded latency and the
+rest are turned away quickly with 503 + Retry-After.
+
+Run: python load_test.py --requests 300
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+from pydantic_ai.messages import ModelMessage, ModelResponse, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+import main
+from admission import AdmissionController, UserRateLimiter
+from database import Database
+
+
+def make_slow_model(latency: float, capacity: int) -> FunctionModel:
+    upstream = asyncio.Semaphore(capacity)
+
+    async def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        async with upstream:
+            await asyncio.sleep(latency)
+        answer = {"answer": "The current interest rate is 5%.", "confidence_score": 0.9, "requires_followup": False}
+        return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, answer)])
+
+    return FunctionModel(respond)
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] * 1000 if values else 0.0
+
+
+async def run(label: str, client: httpx.AsyncClient, requests: int) -> None:
+    results: list[tuple[int, float, str | None]] = []
+
+    async def one(i: int) -> None:
+        start = time.perf_counter()
+        response = await client.post("/ask", json={"user_id": i, "question": f"Question {i}"})
+        results.append((response.status_code, time.perf_counter() - start, response.headers.get("Retry-After")))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    elapsed = time.perf_counter() - start
+
+    statuses = Counter(status for status, _, _ in results)
+    ok = [latency for status, latency, _ in results if status == 200]
+    rejected = [latency for status, latency, _ in results if status in (429, 503)]
+    print(f"\n== {label} ({elapsed:.1f}s) ==")
+    print(f"status codes:      {dict(statuses)}")
+    print(f"200 latency (ms):  p50 {percentile(ok, 0.5):.0f}  p99 {percentile(ok, 0.99):.0f}")
+    if rejected:
+        retry_after = sorted({value for status, _, value in results if value})
+        print(f"reject latency:    p50 {percentile(rejected, 0.5):.0f} ms  (Retry-After values: {retry_after})")
+    admission = main.admission.snapshot()
+    print(f"queue depth max:   {admission['max_queue_depth_seen']}  "
+          f"wait p50/p99: {admission['wait_ms_p50']:.0f}/{admission['wait_ms_p99']:.0f} ms")
+
+
+async def main_async(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        main.app.state.db = await Database(os.path.join(tmp, "load.db")).open()
+        main.response_cache = None
+        main.rate_limiter = UserRateLimiter(rate=0, burst=0)
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=None) as client:
+            with main.agent.override(model=make_slow_model(args.model_latency, args.upstream_capacity)):
+                main.admission = AdmissionController(max_concurrent=10**6, max_queue=10**6, queue_timeout=3600)
+                await run("unlimited", client, args.requests)
+
+            with main.agent.override(model=make_slow_model(args.model_latency, args.upstream_capacity)):
+                main.admission = AdmissionController(
+                    max_concurrent=args.upstream_capacity, max_queue=args.max_queue, queue_timeout=args.queue_timeout
+                )
+                await run("admission", client, args.requests)
+
+        await main.app.state.db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--model-latency", type=float, default=0.2, help="Seconds per simulated model call")
+    parser.add_argument("--upstream-capacity", type=int, default=10, help="Model calls served at once")
+    parser.add_argument("--max-queue", type=int, default=20)
+    parser.add_argument("--queue-timeout", type=float, default=2.0)
+    asyncio.run(main_async(parser.parse_args()))
@@ -3,16 +3,62 @@ We are building a web endpoint that takes a user's query,
 runs the agent (with database access), and returns a structured response.
 """
 
-from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel, Field
+import os
+import sys
+import json
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from pydantic_ai import Agent, RunContext
+from pydantic_ai.tools import ToolDefinition
 from dataclasses import dataclass
+from typing import AsyncIterator
 import uvicorn
 from dotenv import load_dotenv
 
+from admission import AdmissionController, AdmissionRejected, UserRateLimiter
+from cache import ResponseCache, make_cache_key
+from database import Database
+
+# The batch fan-out is shared with the other PydanticAI samples, one folder up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from batching import map_as_completed
+
 # Load Env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Response cache settings (set CACHE_ENABLED=false to always run the agent)
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+
+# Database settings
+DB_FILE = os.getenv("DB_FILE", "banking.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", "20"))  # Max interactions loaded per user
+
+# How the agent gets the user's history:
+# - "prefetch": the server loads it up front and puts it in the system prompt (one model call)
+# - "tool": the model calls the get_user_history tool (an extra model round-trip)
+HISTORY_MODE = os.getenv("HISTORY_MODE", "prefetch")
+
+# Admission control settings
+MAX_CONCURRENT_RUNS = int(os.getenv("MAX_CONCURRENT_RUNS", "32"))  # Agent runs in flight at once
+MAX_QUEUED_RUNS = int(os.getenv("MAX_QUEUED_RUNS", "64"))  # Requests allowed to wait for a slot
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("QUEUE_TIMEOUT_SECONDS", "10"))
+USER_RATE_PER_SECOND = float(os.getenv("USER_RATE_PER_SECOND", "1"))  # 0 disables per-user limits
+USER_BURST = int(os.getenv("USER_BURST", "5"))
+
+# Batch endpoint settings
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # Queries of one batch run at once
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
 # --- 1. Define the shared data models (The Contract) ---
 # Used by both FastAPI (to validate HTTP) and the Agent (to structure output)
 
@@ -28,18 +74,14 @@ class AgentResponse(BaseModel):
 
 
 # --- 2. Define Dependencies (The Context) ---
+# `Database` (database.py) is an async SQLite store with a connection pool
 
-class Database:
-    """ A mock database """
-    async def get_user_history(self, user_id:int) -> list[str]:
-        # Simulate a DB lookup
-        return ["User asked about the interest rates", "User checked the balance"]
-
-    
 @dataclass
 class AppDependencies:
     db: Database
     user_id: int
+    # Set when the history was prefetched by the server; None means "use the tool"
+    history: list[str] | None = None
 
 
 # --- 3. Configure the PydanticAI Agent ---
@@ -51,7 +93,22 @@ agent = Agent(
     system_prompt="You are a helpful banking assistant. Use user history to personalize answers."
 )
 
-@agent.tool
+@agent.system_prompt
+def inject_user_history(ctx: RunContext[AppDependencies]) -> str:
+    """ Puts the prefetched history straight into the prompt, so no tool call is needed """
+    if ctx.deps.history is None:
+        return ""
+    return f"Previous interactions: {': '.join(ctx.deps.history) or 'none'}"
+
+
+async def only_without_prefetched_history(
+    ctx: RunContext[AppDependencies], tool_def: ToolDefinition
+) -> ToolDefinition | None:
+    # Hide the tool when the history is already in the prompt
+    return tool_def if ctx.deps.history is None else None
+
+
+@agent.tool(prepare=only_without_prefetched_history)
 async def get_user_history(ctx: RunContext[AppDependencies]) -> list[str]:
     """ Retrieves the user's previous interaction history """
     history = await ctx.deps.db.get_user_history(ctx.deps.user_id)
@@ -60,16 +117,97 @@ async def get_user_history(ctx: RunContext[AppDependencies]) -> list[str]:
 
 # --- 4. Create the FastAPI app ---
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the connection pool ONCE at startup and share it between requests
+    app.state.db = await Database(DB_FILE, pool_size=DB_POOL_SIZE, history_limit=HISTORY_LIMIT).open()
+    yield
+    await app.state.db.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# One cache per process, shared by all requests
+response_cache = ResponseCache(max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS) if CACHE_ENABLED else None
+
+# Admission control: per-user token buckets + a global limit on concurrent agent runs
+rate_limiter = UserRateLimiter(rate=USER_RATE_PER_SECOND, burst=USER_BURST)
+admission = AdmissionController(
+    max_concurrent=MAX_CONCURRENT_RUNS, max_queue=MAX_QUEUED_RUNS, queue_timeout=QUEUE_TIMEOUT_SECONDS
+)
+
+# Model calls made on behalf of /ask (cache hits count as requests with zero calls)
+model_call_stats = {"requests": 0, "model_calls": 0}
+
+# A FastAPI dependency that hands out the pooled database opened in the lifespan
+async def get_db(request: Request) -> Database:
+    return request.app.state.db
+
+async def load_history(db: Database, user_id: int) -> list[str] | None:
+    """ Prefetches the history. On failure returns None so the agent falls back to the tool """
+    try:
+        return await db.get_user_history(user_id)
+    except Exception as e:
+        logger.warning("History prefetch failed for user %s, falling back to the tool: %s", user_id, e)
+        return None
+
+
+async def answer_query(
+    query: UserQuery, db: Database, rate_limited: bool = False
+) -> tuple[AgentResponse, int]:
+    """
+    Answers one query (cache -> rate limit -> admission -> agent).
+    Returns the answer and the number of model calls this request made.
+    Raises AdmissionRejected when the user is over their rate limit
+    (only checked with `rate_limited`) or the server is overloaded.
+    """
+
+    # Start loading the history right away; it is only awaited when actually needed
+    needs_history = HISTORY_MODE == "prefetch" or response_cache is not None
+    history_task = asyncio.create_task(load_history(db, query.user_id)) if needs_history else None
+
+    model_calls = 0
+
+    async def run_agent() -> AgentResponse:
+        nonlocal model_calls
+        # Only requests that actually run the agent use up the user's budget (cache hits are free)
+        if rate_limited:
+            rate_limiter.check(query.user_id)
+        # Wait for a free slot (without the cache, the history keeps loading meanwhile), or fail fast with 503
+        async with admission.slot():
+            history = await history_task if HISTORY_MODE == "prefetch" else None
+
+            # Initialize the specific context for this single run
+            run_deps = AppDependencies(user_id=query.user_id, db=db, history=history)
+            result = await agent.run(query.question, deps=run_deps)
+        model_calls = result.usage().requests
+        # Return strictly typed data directly
+        return result.output
+
+    try:
+        # The cache key includes the history, so with the cache on it is loaded before the lookup
+        history = await history_task if response_cache is not None else None
+        if history is None:
+            output = await run_agent()
+        else:
+            # Same user + same question + same history => same answer.
+            # Identical requests arriving together share one agent run.
+            cache_key = make_cache_key(query.user_id, query.question, history)
+            output = await response_cache.get_or_compute(cache_key, run_agent)
+    finally:
+        # Rejected before the history was needed (e.g. 429): stop loading it
+        if history_task is not None:
+            history_task.cancel()
+
+    # Only the request that actually ran the agent reports model calls
+    model_call_stats["requests"] += 1
+    model_call_stats["model_calls"] += model_calls
+    return output, model_calls
 
-# A FastAPI dependency to initialize our DB connection
-# In real app, this would come from a database connection pool
-async def get_db() -> Database:
-    return Database()
 
 @app.post("/ask", response_model=AgentResponse)
 async def ask_agent(
     query: UserQuery,
+    response: Response,
     db: Database = Depends(get_db)
 ):
     """ 
@@ -80,20 +218,109 @@ async def ask_agent(
     4. Validates the Agent's output (AgentResponse)
     """
 
-    # Initialize the specific context for this single run
-    run_deps = AppDependencies(user_id=query.user_id, db=db)
-
     try:
-        # Run the agent
-        result = await agent.run(query.question, deps=run_deps)
-        
-        # Return strictly typed data directly
-        return result.data
+        output, model_calls = await answer_query(query, db, rate_limited=True)
+
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers)
 
     except Exception as e:
         # PydanticAI handles retries internally, but if it fails ultimately, we raise an HTTP error
         raise HTTPException(status_code=500, detail=str(e))
 
+    response.headers["X-Model-Calls"] = str(model_calls)
+    return output
+
+
+# --- 5. Batch endpoint (NDJSON results streamed in completion order) ---
+
+def parse_batch(body: bytes, content_type: str) -> list[UserQuery | str]:
+    """
+    Accepts a JSON array or NDJSON (one query per line).
+    Items that fail validation are kept as error messages so they become error lines.
+    """
+    if content_type.startswith(NDJSON_MEDIA_TYPE):
+        raw_items = [line for line in body.decode("utf-8").splitlines() if line.strip()]
+    else:
+        raw_items = json.loads(body)
+        if not isinstance(raw_items, list):
+            raise ValueError("Expected a JSON array of queries")
+
+    items: list[UserQuery | str] = []
+    for raw in raw_items:
+        try:
+            if isinstance(raw, str):
+                items.append(UserQuery.model_validate_json(raw))
+            else:
+                items.append(UserQuery.model_validate(raw))
+        except ValidationError as e:
+            items.append(f"Invalid query: {e.errors(include_url=False, include_input=False)}")
+    return items
+
+
+async def answer_batch_item(index: int, item: UserQuery | str, db: Database) -> str:
+    """ One NDJSON result line. Failures become error lines instead of aborting the batch """
+    line: dict = {"index": index}
+    try:
+        if isinstance(item, str):
+            raise ValueError(item)
+        output, model_calls = await answer_query(item, db)
+        line.update(status="ok", response=output.model_dump(mode="json"), model_calls=model_calls)
+    except AdmissionRejected as e:
+        line.update(status="error", status_code=e.status_code, error=e.detail, retry_after=e.headers["Retry-After"])
+    except Exception as e:
+        line.update(status="error", error=str(e))
+    return json.dumps(line) + "\n"
+
+
+def stream_batch(items: list[UserQuery | str], db: Database) -> AsyncIterator[str]:
+    """
+    Runs the batch with at most BATCH_CONCURRENCY items in flight
+    and yields each result as soon as it finishes.
+    If the client goes away, the remaining work is cancelled.
+    """
+    return map_as_completed(enumerate(items), lambda pair: answer_batch_item(*pair, db), BATCH_CONCURRENCY)
+
+
+@app.post("/ask-batch")
+async def ask_batch(request: Request, db: Database = Depends(get_db)):
+    """
+    Body: a JSON array of UserQuery objects, or NDJSON (Content-Type: application/x-ndjson).
+    Response: NDJSON, one line per query in completion order, tagged with its input "index".
+    """
+    try:
+        items = parse_batch(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:  # Also covers json.JSONDecodeError
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large, the limit is {MAX_BATCH_SIZE} queries")
+
+    return StreamingResponse(stream_batch(items, db), media_type=NDJSON_MEDIA_TYPE)
+
+
+# --- 6. Metrics ---
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """ Hit / miss / coalesced counters, used to size the cache """
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.snapshot()}
+
+
+@app.get("/metrics")
+async def metrics():
+    """ Model calls per /ask request and admission control (queue depth, wait times, rejections) """
+    requests = model_call_stats["requests"]
+    return {
+        "history_mode": HISTORY_MODE,
+        **model_call_stats,
+        "model_calls_per_request": round(model_call_stats["model_calls"] / requests, 3) if requests else 0.0,
+        "admission": admission.snapshot(),
+        "rate_limit": rate_limiter.snapshot(),
+    }
+
 if __name__ == "__main__":
     """
     To run: uvicorn main:app --reload
@@ -0,0 +1,108 @@
+"""
+Tests for the response cache on the /ask path, with a stub model (no API calls).
+
+Run: python -m pytest test_cache.py
+"""
+
+import asyncio
+import os
+
+import pytest
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+# main.py builds the Gemini agent at import time; the tests replace its model
+os.environ.setdefault("GOOGLE_API_KEY", "offline")
+
+import main
+from admission import AdmissionRejected, UserRateLimiter
+from cache import ResponseCache
+
+
+class StubDatabase:
+    """ Same history for every user """
+
+    async def get_user_history(self, user_id: int) -> list[str]:
+        return ["Asked about interest rates"]
+
+
+def stub_model(calls: list, fail: bool = False) -> FunctionModel:
+    """ Records each model call; the delay keeps concurrent requests overlapping """
+
+    async def respond(messages, info: AgentInfo) -> ModelResponse:
+        calls.append(messages)
+        await asyncio.sleep(0.05)
+        if fail:
+            raise RuntimeError("model unavailable")
+        answer = {"answer": "The interest rate is 5%", "confidence_score": 0.9, "requires_followup": False}
+        return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, answer)])
+
+    return FunctionModel(respond)
+
+
+@pytest.fixture
+def cache(monkeypatch) -> ResponseCache:
+    response_cache = ResponseCache(max_entries=16, ttl_seconds=60)
+    monkeypatch.setattr(main, "response_cache", response_cache)
+    return response_cache
+
+
+async def ask_concurrently(question: str, times: int) -> list:
+    query = main.UserQuery(user_id=1, question=question)
+    return await asyncio.gather(
+        *(main.answer_query(query, StubDatabase()) for _ in range(times)), return_exceptions=True
+    )
+
+
+def test_concurrent_identical_queries_share_one_model_call(cache):
+    calls = []
+    with main.agent.override(model=stub_model(calls)):
+        results = asyncio.run(ask_concurrently("What is the interest rate?", 5))
+        # Case and whitespace do not matter; the answer is now cached
+        again = asyncio.run(ask_concurrently("  what is the INTEREST rate? ", 1))
+
+    assert len(calls) == 1
+    assert [output.answer for output, _ in results] == ["The interest rate is 5%"] * 5
+    # Only the request that ran the agent reports the model call
+    assert sorted(model_calls for _, model_calls in results) == [0, 0, 0, 0, 1]
+    assert again[0][1] == 0
+    assert (cache.stats.misses, cache.stats.coalesced, cache.stats.hits) == (1, 4, 1)
+
+
+def test_failed_call_is_not_cached(cache):
+    calls = []
+    with main.agent.override(model=stub_model(calls, fail=True)):
+        results = asyncio.run(ask_concurrently("What is the interest rate?", 3))
+
+    # One shared run, and every waiter gets its error
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(cache) == 0
+
+    # The next request runs the model again instead of replaying the failure
+    with main.agent.override(model=stub_model(calls)):
+        output, model_calls = asyncio.run(ask_concurrently("What is the interest rate?", 1))[0]
+    assert len(calls) == 2
+    assert model_calls == 1
+    assert output.answer == "The interest rate is 5%"
+    assert len(cache) == 1
+
+
+def test_cache_hits_do_not_use_the_rate_limit(cache, monkeypatch):
+    monkeypatch.setattr(main, "rate_limiter", UserRateLimiter(rate=0.001, burst=1))
+    query = main.UserQuery(user_id=1, question="What is the interest rate?")
+
+    async def ask(question: str):
+        return await main.answer_query(query.model_copy(update={"question": question}), StubDatabase(), rate_limited=True)
+
+    calls = []
+    with main.agent.override(model=stub_model(calls)):
+        asyncio.run(ask("What is the interest rate?"))
+        # The one token is spent, but the same question is answered from the cache
+        output, model_calls = asyncio.run(ask("What is the interest rate?"))
+        assert model_calls == 0
+        with pytest.raises(AdmissionRejected) as rejected:
+            asyncio.run(ask("What is my balance?"))
+
+    assert rejected.value.status_code == 429
+    assert len(calls) == 1
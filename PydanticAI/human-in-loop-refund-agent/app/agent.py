@@ -1,29 +1,41 @@
+from dataclasses import dataclass
 from typing import Union
 from pydantic_ai import Agent, RunContext
-from app.models import ApprovalRequest, TransferSuccess
+from app.models import ApprovalRequest, TransferSuccess, transfers
 
 # a fake bank API
 async def process_bank_transfer(amount: float):
     print(f"Bank API: Processing transfer of ${amount}")
     return True
 
+SYSTEM_PROMPT = (
+    "You are a refund processor. "
+    "If refund > $50, you cannot process it yourself. You must return an ApprovalRequest with the reason. "
+    "If refund < $50, you can approve it. Call the final_transfer tool and return TransferSuccess."
+)
+
+@dataclass
+class RefundDeps:
+    # The refund this run pays, as recorded in the transfer ledger (run:<run_id>, job:<job_id>...)
+    transfer_key: str
+
 # The Agent can return EITHER a request for help OR a succes
 refund_agent = Agent(
     model='gemini-2.5-flash',
+    deps_type=RefundDeps,
     # We use a Union so the Agent can choose what to return
     output_type=Union[ApprovalRequest, TransferSuccess], 
-    system_prompt=(
-        "You are a refund processor. "
-        "If refund > $50, you cannot process it yourself. You must return an ApprovalRequest with the reason. "
-        "If refund < $50, you can approve it. Call the final_transfer tool and return TransferSuccess."
-    )
+    system_prompt=SYSTEM_PROMPT
 )
 
 @refund_agent.tool
-async def final_transfer(ctx: RunContext, amount: float) -> str:
+async def final_transfer(ctx: RunContext[RefundDeps], amount: float) -> str:
     """
     Process the transfer. 
     Only call this tool if the refund amount is < $50, OR if you have received explicit approval from a manager.
     """
-    await process_bank_transfer(amount)
+    # A retried run, or a second tool call, must not pay again
+    earlier = await transfers.transfer_once(ctx.deps.transfer_key, amount, process_bank_transfer)
+    if earlier is not None:
+        return f"A transfer of ${earlier['amount']} was already made for this refund ({earlier['status']}). Do not transfer again."
     return "Transfer processed successfully"
\ No newline at end of file
@@ -0,0 +1,51 @@
+"""
+Audit trail of refund decisions: who (pre-router or agent) decided what, and why.
+
+Request handlers use `arecord`, which does the insert in a worker thread,
+so the event loop never waits on the disk.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS refund_audit (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    route TEXT NOT NULL,      -- auto_approve / escalate / agent
+    amount REAL NOT NULL,
+    user_reason TEXT NOT NULL,
+    status TEXT NOT NULL,     -- the status returned to the client
+    job_id TEXT,
+    detail TEXT NOT NULL,     -- why this route was taken
+    latency_ms REAL NOT NULL
+);
+"""
+
+
+class AuditLog:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def record(self, route: str, amount: float, user_reason: str, status: str, detail: str,
+               latency_ms: float, job_id: str | None = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO refund_audit (created_at, route, amount, user_reason, status, job_id, detail, latency_ms) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), route, amount, user_reason, status, job_id, detail, latency_ms),
+            )
+
+    async def arecord(self, route: str, amount: float, user_reason: str, status: str, detail: str,
+                      latency_ms: float, job_id: str | None = None) -> None:
+        await asyncio.to_thread(self.record, route, amount, user_reason, status, detail, latency_ms, job_id)
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,170 @@
+"""
+Idempotency keys for the refund endpoints.
+
+A client that retries with the same `Idempotency-Key` gets the stored
+response of the first call instead of a new agent run (and a second
+transfer). Completed responses are kept in SQLite for `ttl` seconds.
+A duplicate that arrives while the first call is still running attaches
+to it and gets the same response; a different request with the same key is
+rejected, whether the first call is stored or still running.
+
+`coalesce` is the in-flight half alone, with no stored response: used to
+make sure a paused job is resumed at most once, even without a key.
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope TEXT NOT NULL,          -- the endpoint
+    key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,    -- hash of the request the key was first used with
+    status_code INTEGER NOT NULL,
+    response TEXT NOT NULL,       -- JSON body
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_expires_at ON idempotency_keys (expires_at);
+"""
+
+Handler = Callable[[], Awaitable[tuple[int, dict]]]
+
+
+class IdempotencyKeyMismatch(Exception):
+    """ The key was already used for a different request """
+
+
+def fingerprint(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, path: str, ttl: float = 24 * 3600, purge_interval: float = 60):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        # The running call, and the fingerprint of its request (None for `coalesce`)
+        self._in_flight: dict[tuple[str, str], tuple[asyncio.Task, Optional[str]]] = {}
+        self._last_purge = time.monotonic()
+
+        # Metrics
+        self.executed = 0
+        self.replayed = 0  # Served from a stored response
+        self.attached = 0  # Joined a call still in flight
+        self.mismatches = 0
+
+    async def run(self, scope: str, key: str, request_fingerprint: str, handler: Handler) -> tuple[int, dict, bool]:
+        """ (status code, body, whether it is a duplicate) """
+
+        async def replay_or_execute() -> tuple[int, dict, bool]:
+            # Loaded once this call is registered as in flight: an earlier call with the key
+            # is then either the one we joined, or done and stored (it saves before leaving)
+            stored = await self.aload(scope, key)
+            if stored is not None:
+                stored_fingerprint, status_code, body = stored
+                if stored_fingerprint != request_fingerprint:
+                    self.mismatches += 1
+                    raise IdempotencyKeyMismatch(f"Idempotency-Key {key!r} was already used for a different request")
+                self.replayed += 1
+                return status_code, body, True
+
+            self.executed += 1
+            status_code, body = await handler()
+            # Only successful responses are kept: a failed call can be retried with the same key
+            if status_code < 500:
+                await self.asave(scope, key, request_fingerprint, status_code, body)
+            return status_code, body, False
+
+        return await self._join_or_start((scope, key), replay_or_execute, request_fingerprint)
+
+    async def coalesce(self, scope: str, key: str, handler: Handler) -> tuple[int, dict, bool]:
+        """ Concurrent calls with the same key share one execution; nothing is stored """
+
+        async def execute() -> tuple[int, dict, bool]:
+            self.executed += 1
+            status_code, body = await handler()
+            return status_code, body, False
+
+        return await self._join_or_start((scope, key), execute)
+
+    async def _join_or_start(
+        self,
+        in_flight_key: tuple[str, str],
+        start: Callable[[], Awaitable[tuple[int, dict, bool]]],
+        request_fingerprint: Optional[str] = None,
+    ) -> tuple[int, dict, bool]:
+        in_flight = self._in_flight.get(in_flight_key)
+        if in_flight is not None:
+            task, running_fingerprint = in_flight
+            if running_fingerprint != request_fingerprint:
+                self.mismatches += 1
+                raise IdempotencyKeyMismatch(
+                    f"Idempotency-Key {in_flight_key[1]!r} is in use by a different request still in flight"
+                )
+            self.attached += 1
+            status_code, body, _ = await asyncio.shield(task)
+            return status_code, body, True
+
+        task = asyncio.create_task(start())
+        self._in_flight[in_flight_key] = (task, request_fingerprint)
+        task.add_done_callback(lambda _: self._in_flight.pop(in_flight_key, None))
+        # Shielded: the first client going away must not cancel the call the others are waiting for
+        return await asyncio.shield(task)
+
+    def _load(self, scope: str, key: str) -> Optional[tuple[str, int, dict]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, status_code, response FROM idempotency_keys "
+                "WHERE scope = ? AND key = ? AND expires_at > ?",
+                (scope, key, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        stored_fingerprint, status_code, response = row
+        return stored_fingerprint, status_code, json.loads(response)
+
+    async def aload(self, scope: str, key: str) -> Optional[tuple[str, int, dict]]:
+        return await asyncio.to_thread(self._load, scope, key)
+
+    def _save(self, scope: str, key: str, request_fingerprint: str, status_code: int, body: dict) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (scope, key, fingerprint, status_code, response, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (scope, key, request_fingerprint, status_code, json.dumps(body), now + self.ttl),
+            )
+            if time.monotonic() - self._last_purge >= self.purge_interval:
+                self._last_purge = time.monotonic()
+                self._conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+
+    async def asave(self, scope: str, key: str, request_fingerprint: str, status_code: int, body: dict) -> None:
+        await asyncio.to_thread(self._save, scope, key, request_fingerprint, status_code, body)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            (stored,) = self._conn.execute(
+                "SELECT COUNT(*) FROM idempotency_keys WHERE expires_at > ?", (time.time(),)
+            ).fetchone()
+        return {
+            "stored_responses": stored,
+            "in_flight": len(self._in_flight),
+            "ttl_seconds": self.ttl,
+            "executed": self.executed,
+            "duplicates_replayed": self.replayed,
+            "duplicates_attached": self.attached,
+            "key_mismatches": self.mismatches,
+        }
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,281 @@
+"""
+Asynchronous refund runs: a durable queue and a pool of async workers.
+
+`/request-refund?mode=async` only enqueues the run and answers 202 with a
+`run_id`. Workers claim runs from a SQLite table, so queued work survives a
+restart. A claimed run is invisible to other workers for `visibility_timeout`
+seconds (extended by a heartbeat while it is being processed); if the worker
+crashes, the run becomes visible again and is retried, up to `max_attempts`.
+A run that failed or was cut short is only run again if `retryable(run_id)`
+says so (e.g. not once its bank transfer has started): otherwise it is FAILED.
+
+Status changes are pushed to in-process subscribers, which `/refund-runs/{run_id}/events`
+streams as SSE.
+
+The SQLite calls block, so async code runs them in a worker thread (the `a*`
+methods, and the worker pool). Whatever touches asyncio objects from there
+(subscriber queues, the work-available event) is handed to the event loop.
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS refund_runs (
+    run_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,    -- JSON arguments of the run
+    status TEXT NOT NULL,     -- QUEUED / RUNNING / DONE / FAILED
+    attempts INTEGER NOT NULL DEFAULT 0,
+    visible_at REAL NOT NULL, -- a worker may claim the run from then on
+    result TEXT,              -- JSON response, once DONE
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_refund_runs_claim ON refund_runs (status, visible_at);
+"""
+
+# QUEUED runs, and RUNNING runs whose worker stopped renewing them
+CLAIM_RUN = """
+UPDATE refund_runs SET status = 'RUNNING', attempts = attempts + 1, visible_at = ?, updated_at = ?
+WHERE run_id = (
+    SELECT run_id FROM refund_runs
+    WHERE status IN ('QUEUED', 'RUNNING') AND visible_at <= ?
+    ORDER BY created_at LIMIT 1
+)
+RETURNING run_id, payload, attempts
+"""
+
+TERMINAL_STATUSES = ("DONE", "FAILED")
+
+
+class RunQueue:
+    """ The SQLite-backed queue of refund runs """
+
+    def __init__(self, path: str, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._subscribers: dict[str, list[asyncio.Queue]] = defaultdict(list)
+        self._work_available = asyncio.Event()
+        # The loop the subscribers and the workers run on, once one of them showed up
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def enqueue(self, payload: dict) -> str:
+        run_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO refund_runs (run_id, payload, status, visible_at, created_at, updated_at) "
+                "VALUES (?, ?, 'QUEUED', ?, ?, ?)",
+                (run_id, json.dumps(payload), now, now, now),
+            )
+        self._on_loop(self._work_available.set)
+        return run_id
+
+    async def aenqueue(self, payload: dict) -> str:
+        return await asyncio.to_thread(self.enqueue, payload)
+
+    def claim(self, visibility_timeout: float) -> Optional[tuple[str, dict, int]]:
+        """ (run_id, payload, attempt number) of the oldest claimable run, or None """
+        while True:
+            now = time.time()
+            with self._lock, self._conn:
+                row = self._conn.execute(CLAIM_RUN, (now + visibility_timeout, now, now)).fetchone()
+            if row is None:
+                return None
+            run_id, payload, attempts = row
+            if attempts <= self.max_attempts:
+                self._publish(run_id)
+                return run_id, json.loads(payload), attempts
+            # Crashed too many times: give up on it and look for the next one
+            self._finish(run_id, "FAILED", error=f"Gave up after {self.max_attempts} attempts")
+
+    def extend(self, run_id: str, visibility_timeout: float) -> None:
+        """ Heartbeat: the worker is still on it """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE refund_runs SET visible_at = ? WHERE run_id = ? AND status = 'RUNNING'",
+                (time.time() + visibility_timeout, run_id),
+            )
+
+    def fail(self, run_id: str, error: str) -> None:
+        self._finish(run_id, "FAILED", error=error)
+
+    def complete(self, run_id: str, result: Any) -> None:
+        self._finish(run_id, "DONE", result=json.dumps(result))
+
+    def retry_or_fail(self, run_id: str, attempts: int, error: str, backoff: float) -> None:
+        if attempts >= self.max_attempts:
+            self._finish(run_id, "FAILED", error=error)
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE refund_runs SET status = 'QUEUED', visible_at = ?, error = ?, updated_at = ? WHERE run_id = ?",
+                (now + backoff * attempts, error, now, run_id),
+            )
+        self._publish(run_id)
+
+    def _finish(self, run_id: str, status: str, result: str | None = None, error: str | None = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE refund_runs SET status = ?, result = ?, error = ?, updated_at = ? WHERE run_id = ?",
+                (status, result, error, time.time(), run_id),
+            )
+        self._publish(run_id)
+
+    def get(self, run_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, attempts, result, error, created_at, updated_at FROM refund_runs WHERE run_id = ?",
+                (run_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        status, attempts, result, error, created_at, updated_at = row
+        return {
+            "run_id": run_id,
+            "status": status,
+            "attempts": attempts,
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    async def aget(self, run_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.get, run_id)
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM refund_runs GROUP BY status").fetchall()
+        return dict(rows)
+
+    # --- Status subscriptions (SSE) ---
+    def subscribe(self, run_id: str) -> asyncio.Queue:
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers[run_id].append(queue)
+        return queue
+
+    def unsubscribe(self, run_id: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(run_id)
+        if subscribers and queue in subscribers:
+            subscribers.remove(queue)
+            if not subscribers:
+                del self._subscribers[run_id]
+
+    def _publish(self, run_id: str) -> None:
+        """ Called from worker threads: reads the status here, delivers it on the loop """
+        if run_id not in self._subscribers:
+            return
+        self._on_loop(self._deliver, run_id, self.get(run_id))
+
+    def _deliver(self, run_id: str, status: Optional[dict]) -> None:
+        for queue in self._subscribers.get(run_id, ()):
+            queue.put_nowait(status)
+
+    def _on_loop(self, callback: Callable[..., Any], *args: Any) -> None:
+        """ Runs `callback` on the event loop: asyncio queues and events are not thread-safe """
+        loop = self._loop
+        if loop is None:
+            # Nothing is waiting on the loop yet
+            callback(*args)
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            callback(*args)
+        elif not loop.is_closed():
+            loop.call_soon_threadsafe(callback, *args)
+
+    async def wait_for_work(self, timeout: float) -> None:
+        self._loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(self._work_available.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._work_available.clear()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class WorkerPool:
+    """ `workers` async workers taking runs off the queue and passing their run_id and payload to `handler` """
+
+    def __init__(self, queue: RunQueue, handler: Callable[[str, dict], Awaitable[Any]], workers: int = 4,
+                 visibility_timeout: float = 120, poll_interval: float = 1.0, retry_backoff: float = 5.0,
+                 retryable: Optional[Callable[[str], bool]] = None):
+        self.queue = queue
+        self.handler = handler
+        # Whether a run that already started may run again (blocking: called in a worker thread)
+        self.retryable = retryable
+        self.workers = workers
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.retry_backoff = retry_backoff
+        self._tasks: list[asyncio.Task] = []
+        self.busy = 0
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        # Runs cut short here are RUNNING in the table and are picked up again after a restart
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self) -> None:
+        while True:
+            claimed = await asyncio.to_thread(self.queue.claim, self.visibility_timeout)
+            if claimed is None:
+                await self.queue.wait_for_work(self.poll_interval)
+                continue
+
+            run_id, payload, attempts = claimed
+            # A retry, or a run cut short by a crash or a restart: it may have got past the point of no return
+            if attempts > 1 and not await self._may_retry(run_id):
+                await asyncio.to_thread(self.queue.fail, run_id, "Interrupted after its side effects started, not retried")
+                continue
+
+            heartbeat = asyncio.create_task(self._heartbeat(run_id))
+            self.busy += 1
+            try:
+                result = await self.handler(run_id, payload)
+            except Exception as e:
+                if await self._may_retry(run_id):
+                    await asyncio.to_thread(self.queue.retry_or_fail, run_id, attempts, str(e), self.retry_backoff)
+                else:
+                    await asyncio.to_thread(self.queue.fail, run_id, f"{e} (not retried: its side effects started)")
+            else:
+                await asyncio.to_thread(self.queue.complete, run_id, result)
+            finally:
+                self.busy -= 1
+                heartbeat.cancel()
+
+    async def _may_retry(self, run_id: str) -> bool:
+        return self.retryable is None or await asyncio.to_thread(self.retryable, run_id)
+
+    async def _heartbeat(self, run_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 3)
+            await asyncio.to_thread(self.queue.extend, run_id, self.visibility_timeout)
+
+    def snapshot(self) -> dict:
+        return {"workers": self.workers, "busy": self.busy, "runs": self.queue.counts()}
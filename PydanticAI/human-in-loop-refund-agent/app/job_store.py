@@ -0,0 +1,221 @@
+"""
+Storage for paused refund jobs (the agent's message history, waiting for a manager).
+
+`JobStore` serializes each history with pydantic-ai's `ModelMessagesTypeAdapter`,
+compresses it and hands the bytes to a backend:
+- `MemoryBackend`: a dict, lost on restart (the original tutorial behaviour)
+- `SQLiteBackend`: a file on disk, survives restarts, looked up by primary key
+
+In front of the backend sits a small LRU of hot jobs (already deserialized),
+so memory stays bounded by `hot_jobs` however many approvals are pending.
+Jobs not reviewed within `ttl` seconds expire and are deleted.
+
+Async handlers use the `a*` methods (`asave_job`, `aget_job`, `adelete_job`),
+which run the same calls in a worker thread, so the event loop never waits on
+disk I/O or (de)serialization.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import List, Optional
+
+from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    history BLOB NOT NULL, -- zlib-compressed JSON of the message history
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_expires_at ON jobs (expires_at);
+"""
+
+
+class MemoryBackend:
+    """ Compressed histories in a dict. Nothing survives a restart """
+
+    def __init__(self):
+        self._jobs: dict[str, tuple[bytes, float]] = {}
+
+    def put(self, job_id: str, blob: bytes, expires_at: float) -> None:
+        self._jobs[job_id] = (blob, expires_at)
+
+    def get(self, job_id: str) -> Optional[tuple[bytes, float]]:
+        return self._jobs.get(job_id)
+
+    def delete(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+
+    def purge_expired(self, now: float) -> int:
+        expired = [job_id for job_id, (_, expires_at) in self._jobs.items() if expires_at <= now]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+    def count(self) -> int:
+        return len(self._jobs)
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteBackend:
+    """ Compressed histories in a SQLite file, keyed by job_id """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def put(self, job_id: str, blob: bytes, expires_at: float) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, history, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (job_id, blob, time.time(), expires_at),
+            )
+
+    def get(self, job_id: str) -> Optional[tuple[bytes, float]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT history, expires_at FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+
+    def delete(self, job_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def purge_expired(self, now: float) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,)).rowcount
+
+    def count(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()
+        return count
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class JobStore:
+    def __init__(self, backend=None, hot_jobs: int = 1000, ttl: float = 72 * 3600, purge_interval: float = 60):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.hot_jobs = hot_jobs
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._hot: OrderedDict[str, tuple[List[ModelMessage], float]] = OrderedDict()
+        self._last_purge = time.monotonic()
+        # The async methods call in from worker threads
+        self._lock = threading.RLock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    @staticmethod
+    def deserialize(blob: bytes) -> List[ModelMessage]:
+        return ModelMessagesTypeAdapter.validate_json(zlib.decompress(blob))
+
+    def save_job(self, job_id: str, messages: List[ModelMessage]):
+        raw = ModelMessagesTypeAdapter.dump_json(messages)
+        blob = zlib.compress(raw)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self.backend.put(job_id, blob, expires_at)
+            self.raw_bytes += len(raw)
+            self.stored_bytes += len(blob)
+
+            self._remember(job_id, messages, expires_at)
+            self._purge_if_due()
+
+    def get_job(self, job_id: str) -> Optional[List[ModelMessage]]:
+        with self._lock:
+            hot = self._hot.get(job_id)
+            if hot is not None:
+                messages, expires_at = hot
+                if expires_at > time.time():
+                    self._hot.move_to_end(job_id)
+                    self.hits += 1
+                    return messages
+                self._expire(job_id)
+                return None
+
+            self.misses += 1
+            row = self.backend.get(job_id)
+            if row is None:
+                return None
+            blob, expires_at = row
+            if expires_at <= time.time():
+                self._expire(job_id)
+                return None
+
+            messages = self.deserialize(blob)
+            self._remember(job_id, messages, expires_at)
+            return messages
+
+    def delete_job(self, job_id: str):
+        """ The manager has decided: the job no longer needs its history """
+        with self._lock:
+            self._hot.pop(job_id, None)
+            self.backend.delete(job_id)
+
+    async def asave_job(self, job_id: str, messages: List[ModelMessage]):
+        await asyncio.to_thread(self.save_job, job_id, messages)
+
+    async def aget_job(self, job_id: str) -> Optional[List[ModelMessage]]:
+        return await asyncio.to_thread(self.get_job, job_id)
+
+    async def adelete_job(self, job_id: str):
+        await asyncio.to_thread(self.delete_job, job_id)
+
+    def _remember(self, job_id: str, messages: List[ModelMessage], expires_at: float):
+        self._hot[job_id] = (messages, expires_at)
+        self._hot.move_to_end(job_id)
+        while len(self._hot) > self.hot_jobs:
+            # Still in the backend, just no longer kept deserialized in memory
+            self._hot.popitem(last=False)
+            self.evictions += 1
+
+    def _expire(self, job_id: str):
+        self.expired += 1
+        self.delete_job(job_id)
+
+    def _purge_if_due(self):
+        if time.monotonic() - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = time.monotonic()
+        now = time.time()
+        for job_id in [job_id for job_id, (_, expires_at) in self._hot.items() if expires_at <= now]:
+            del self._hot[job_id]
+        self.expired += self.backend.purge_expired(now)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            hot_jobs = len(self._hot)
+        return {
+            "backend": type(self.backend).__name__,
+            "stored_jobs": self.backend.count(),
+            "hot_jobs": hot_jobs,
+            "max_hot_jobs": self.hot_jobs,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "compression_ratio": round(self.raw_bytes / self.stored_bytes, 2) if self.stored_bytes else None,
+        }
+
+    def close(self):
+        self.backend.close()
@@ -15,26 +15,89 @@ import os
 
 # Add project root to sys.path to allow 'from app.models' to work when running script directly
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The batch fan-out is shared with the other PydanticAI samples, two folders up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
+import asyncio
+import json
+import time
 import uuid
 import uvicorn
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Literal, Optional
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 
 # Load environment variables (e.g. GEMINI_API_KEY) BEFORE importing modules that use them
 load_dotenv()
 
 # Import from our refactored modules
-from app.models import db, ApprovalRequest, TransferSuccess, ManagerDecision
-from app.agent import refund_agent
+from app.models import (
+    audit_log, db, idempotency, run_queue, transfers, ApprovalRequest, BatchReview, TransferSuccess, ManagerDecision,
+)
+from batching import map_as_completed
+from app.idempotency import Handler, IdempotencyKeyMismatch, fingerprint
+from app.job_queue import TERMINAL_STATUSES, WorkerPool
+from app.agent import SYSTEM_PROMPT, RefundDeps, process_bank_transfer, refund_agent
+from app.pre_router import DEFAULT_AMBIGUOUS_KEYWORDS, RouteDecision, RouteStats, escalation_history, pre_route
 
 api_key = os.getenv('GOOGLE_API_KEY')
 if not api_key:
     raise ValueError("GOOGLE_API_KEY is missing in .env file")
 
+# Pre-router: clear-cut refunds are decided by rules, without a model call (see app/pre_router.py)
+PRE_ROUTER_ENABLED = os.getenv("PRE_ROUTER_ENABLED", "true").lower() == "true"
+AUTO_APPROVE_LIMIT = float(os.getenv("AUTO_APPROVE_LIMIT", "50"))
+# Comma-separated; a reason containing one of them always goes to the agent
+AMBIGUOUS_KEYWORDS = tuple(
+    keyword.strip().lower()
+    for keyword in os.getenv("AMBIGUOUS_KEYWORDS", ",".join(DEFAULT_AMBIGUOUS_KEYWORDS)).split(",")
+    if keyword.strip()
+)
+
+route_stats = RouteStats()
+
+# Batch review: how many stored histories are resumed at once
+REVIEW_CONCURRENCY = int(os.getenv("REVIEW_CONCURRENCY", "8"))
+MAX_REVIEW_BATCH = int(os.getenv("MAX_REVIEW_BATCH", "500"))
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Async mode: /request-refund answers 202 right away and a worker pool runs the refund
+REFUND_MODE = os.getenv("REFUND_MODE", "sync")  # Default for requests that don't pass ?mode=
+REFUND_WORKERS = int(os.getenv("REFUND_WORKERS", "4"))
+RUN_VISIBILITY_TIMEOUT_SECONDS = float(os.getenv("RUN_VISIBILITY_TIMEOUT_SECONDS", "120"))
+SSE_KEEPALIVE_SECONDS = 15
+
+
+async def run_queued_refund(run_id: str, payload: dict) -> dict:
+    # Keyed by run, so a retry of the same run never transfers again
+    response = await process_refund(payload["user_reason"], payload["amount"], transfer_key=f"run:{run_id}")
+    return jsonable_encoder(response)
+
+
+def run_may_retry(run_id: str) -> bool:
+    """ A run whose transfer has started (whatever its outcome) is never run again """
+    return transfers.get(f"run:{run_id}") is None
 
-app = FastAPI()
+
+worker_pool = WorkerPool(
+    run_queue, run_queued_refund, workers=REFUND_WORKERS, visibility_timeout=RUN_VISIBILITY_TIMEOUT_SECONDS,
+    retryable=run_may_retry,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Also picks up the runs left queued (or cut short) by the previous process
+    worker_pool.start()
+    yield
+    await worker_pool.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,10 +108,84 @@ app.add_middleware(
 )
 
 @app.post("/request-refund")
-async def request_refund(user_reason: str, amount: float):
-    # 1. Run the agent
+async def request_refund(
+    user_reason: str,
+    amount: float,
+    mode: Literal["sync", "async"] = REFUND_MODE,
+    idempotency_key: Optional[str] = Header(None),
+):
+    async def start() -> tuple[int, dict]:
+        if mode == "async":
+            # Don't hold the connection for the agent run: a worker picks it up from the queue
+            run_id = await run_queue.aenqueue({"user_reason": user_reason, "amount": amount})
+            return 202, {
+                "status": "QUEUED",
+                "run_id": run_id,
+                "status_url": f"/refund-runs/{run_id}",
+                "events_url": f"/refund-runs/{run_id}/events",
+            }
+        return 200, jsonable_encoder(await process_refund(user_reason, amount))
+
+    return await idempotent("request-refund", idempotency_key, fingerprint(user_reason, amount, mode), start)
+
+
+async def idempotent(scope: str, key: Optional[str], request_fingerprint: str, handler: Handler) -> JSONResponse:
+    """
+    Without a key: just runs the handler.
+    With one: a retry gets the first response (Idempotent-Replayed: true) instead of a new run.
+    """
+    if key is None:
+        status_code, body = await handler()
+        return JSONResponse(status_code=status_code, content=body)
+    if not key or len(key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be 1 to 255 characters")
+
+    try:
+        status_code, body, duplicate = await idempotency.run(scope, key, request_fingerprint, handler)
+    except IdempotencyKeyMismatch as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    headers = {"Idempotent-Replayed": "true"} if duplicate else None
+    return JSONResponse(status_code=status_code, content=body, headers=headers)
+
+
+async def process_refund(user_reason: str, amount: float, transfer_key: Optional[str] = None) -> dict:
+    started = time.perf_counter()
+    # The ledger key of this refund's transfer (see app/transfers.py)
+    transfer_key = transfer_key or f"refund:{uuid.uuid4()}"
     prompt = f"User wants refund of ${amount} for reason: {user_reason}"
-    result = await refund_agent.run(prompt)
+
+    # 0. Clear-cut cases skip the model
+    if PRE_ROUTER_ENABLED:
+        decision = pre_route(user_reason, amount, limit=AUTO_APPROVE_LIMIT, ambiguous_keywords=AMBIGUOUS_KEYWORDS)
+    else:
+        decision = RouteDecision("agent", "pre-router disabled")
+
+    if decision.route == "auto_approve":
+        earlier = await transfers.transfer_once(transfer_key, amount, process_bank_transfer)
+        if earlier is not None and earlier["status"] != "DONE":
+            raise RuntimeError(f"Transfer {transfer_key} is {earlier['status']}, it needs to be reconciled by hand")
+        response = {"status": "COMPLETED", "details": TransferSuccess(amount=amount)}
+    elif decision.route == "escalate":
+        approval = ApprovalRequest(
+            amount=amount, reason=f"Refund of ${amount} is over the ${AUTO_APPROVE_LIMIT:g} limit: {user_reason}"
+        )
+        job_id = str(uuid.uuid4())
+        # Same kind of frozen history as the agent's, so /manager-review resumes it the same way
+        await db.asave_job(job_id, escalation_history(SYSTEM_PROMPT, prompt, approval.reason))
+        response = {"status": "APPROVAL_REQUESTED", "job_id": job_id, "details": approval}
+    else:
+        response = await run_refund_agent(prompt, transfer_key)
+
+    latency_ms = route_stats.record(decision.route, started)
+    await audit_log.arecord(
+        decision.route, amount, user_reason, response["status"], decision.reason, latency_ms, response.get("job_id")
+    )
+    return response
+
+
+async def run_refund_agent(prompt: str, transfer_key: str) -> dict:
+    # 1. Run the agent
+    result = await refund_agent.run(prompt, deps=RefundDeps(transfer_key))
     
     # 2. Check the result type
     # We use result.output to get the structured response
@@ -58,7 +195,7 @@ async def request_refund(user_reason: str, amount: float):
 
         # KEY STEP: Serialize the entire conversation history
         # result.all_messages() contains User Prompt + Agent Thought + Tool Calls
-        db.save_job(job_id, result.all_messages())
+        await db.asave_job(job_id, result.all_messages())
 
         # Return the job ID to the user
         return {
@@ -80,12 +217,44 @@ async def request_refund(user_reason: str, amount: float):
 # ==== END POINT 2 - MANAGER APPROVES ====
 
 @app.post("/manager-review")
-async def manager_review(decision: ManagerDecision):
+async def manager_review(decision: ManagerDecision, idempotency_key: Optional[str] = Header(None)):
+    async def review() -> tuple[int, dict]:
+        return 200, await review_job(decision)
+
+    return await idempotent("manager-review", idempotency_key, fingerprint(decision.model_dump()), review)
+
+
+async def review_job(decision: ManagerDecision) -> dict:
+    """
+    Resumes a job at most once: reviews of a job that is already being resumed
+    (a retry, a second manager, the same job in a batch) get that resume's outcome.
+    A completed job is then deleted, so later reviews find nothing to resume, and its
+    transfer is in the ledger, so even a review after a failed resume cannot pay it again.
+    """
+    async def resume() -> tuple[int, dict]:
+        return 200, jsonable_encoder(await resume_job(decision))
+
+    _, outcome, _ = await idempotency.coalesce("resume-job", decision.job_id, resume)
+    return outcome
+
+
+async def resume_job(decision: ManagerDecision) -> dict:
     # 1. Retrieve the Frozen Memory
-    history = db.get_job(decision.job_id)
+    history = await db.aget_job(decision.job_id)
     if not history:
+        # Unknown, already reviewed, or expired (JOB_TTL_HOURS)
         return {"error": "Job not found"}
 
+    # An earlier resume got as far as the transfer, then failed (so the job was not deleted):
+    # answer from the ledger instead of running the agent again
+    transfer_key = f"job:{decision.job_id}"
+    earlier = await transfers.aget(transfer_key)
+    if earlier is not None:
+        await db.adelete_job(decision.job_id)
+        if earlier["status"] == "DONE":
+            return {"status": "COMPLETED", "details": TransferSuccess(amount=earlier["amount"])}
+        return {"error": f"The transfer for this job is {earlier['status']}, it needs to be reconciled by hand"}
+
     # 2. Construct the "Resume Signal"
     # We pretend the Manager is a "User" speaking to the Agent
     resume_prompt = (
@@ -99,17 +268,137 @@ async def manager_review(decision: ManagerDecision):
     # We pass 'message_history=history'. The Agent "remembers" everything!
     result = await refund_agent.run(
         resume_prompt, 
-        message_history=history
+        message_history=history,
+        # The transfer is recorded under the job, so whichever review resumes it, it is paid once
+        deps=RefundDeps(transfer_key),
     )
     
+    if isinstance(result.output, ApprovalRequest):
+        # If it asks for approval again (maybe manager denied, or agent is confused)
+        # Keep the job, with the new history, for the next review
+        await db.asave_job(decision.job_id, result.all_messages())
+        return {"status": "APPROVAL_REQUESTED", "job_id": decision.job_id, "details": result.output}
+
+    # The job is done: its history is no longer needed
+    await db.adelete_job(decision.job_id)
     if isinstance(result.output, TransferSuccess):
         return {"status": "COMPLETED", "details": result.output}
-    elif isinstance(result.output, ApprovalRequest):
-        # If it asks for approval again (maybe manager denied, or agent is confused)
-        return {"status": "APPROVAL_REQUESTED", "details": result.output}
     
     return {"status": "FINALIZED", "result": str(result.output)}
 
 
+# ==== END POINT 3 - MANY MANAGER DECISIONS AT ONCE ====
+
+async def review_batch_item(decision: ManagerDecision, duplicate: bool) -> str:
+    """ One NDJSON result line. A failing job becomes a FAILED line instead of aborting the batch """
+    line: dict = {"job_id": decision.job_id}
+    try:
+        if duplicate:
+            # Resuming the same job twice could pay the refund twice
+            raise ValueError("job_id appears more than once in this batch")
+        outcome = await review_job(decision)
+        if "error" in outcome:
+            raise LookupError(outcome["error"])
+        line.update(outcome)
+    except Exception as e:
+        line.update(status="FAILED", error=str(e))
+    return json.dumps(line) + "\n"
+
+
+def stream_reviews(decisions: list[ManagerDecision]) -> AsyncIterator[str]:
+    """
+    Resumes the jobs with at most REVIEW_CONCURRENCY agents running
+    and yields each outcome as soon as it finishes.
+    If the manager goes away, the remaining work is cancelled.
+    """
+    seen = set()
+    items = []
+    for decision in decisions:
+        items.append((decision, decision.job_id in seen))
+        seen.add(decision.job_id)
+    return map_as_completed(items, lambda pair: review_batch_item(*pair), REVIEW_CONCURRENCY)
+
+
+@app.post("/manager-review/batch")
+async def manager_review_batch(batch: BatchReview):
+    """
+    Response: NDJSON, one line per decision in completion order, with its job_id and
+    status COMPLETED / APPROVAL_REQUESTED / FINALIZED, or FAILED with an error.
+    """
+    if len(batch.decisions) > MAX_REVIEW_BATCH:
+        raise HTTPException(status_code=413, detail=f"Batch too large, the limit is {MAX_REVIEW_BATCH} decisions")
+    return StreamingResponse(stream_reviews(batch.decisions), media_type=NDJSON_MEDIA_TYPE)
+
+
+# ==== END POINT 4 - STATUS OF ASYNC REFUND RUNS ====
+
+@app.get("/refund-runs/stats")
+async def refund_run_stats():
+    """ Runs per status and busy workers """
+    # Counts the runs: a query, so off the event loop
+    return await asyncio.to_thread(worker_pool.snapshot)
+
+
+@app.get("/refund-runs/{run_id}")
+async def get_refund_run(run_id: str):
+    """ Poll: QUEUED / RUNNING / DONE (with the usual /request-refund response in `result`) / FAILED """
+    run = await run_queue.aget(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
+
+@app.get("/refund-runs/{run_id}/events")
+async def refund_run_events(run_id: str):
+    """ SSE: a `status` event now and on every change, until the run is DONE or FAILED """
+    if await run_queue.aget(run_id) is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+
+    async def events():
+        updates = run_queue.subscribe(run_id)
+        try:
+            # Subscribed first, so no change between this read and the loop is missed
+            run = await run_queue.aget(run_id)
+            while True:
+                yield f"event: status\ndata: {json.dumps(run)}\n\n"
+                if run["status"] in TERMINAL_STATUSES:
+                    return
+                while True:
+                    try:
+                        run = await asyncio.wait_for(updates.get(), SSE_KEEPALIVE_SECONDS)
+                        break
+                    except asyncio.TimeoutError:
+                        yield ": keep-alive\n\n"
+        finally:
+            run_queue.unsubscribe(run_id, updates)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/idempotency/stats")
+async def idempotency_stats():
+    """ Duplicates served from a stored response or attached to a run in flight """
+    return await asyncio.to_thread(idempotency.snapshot)
+
+
+@app.get("/transfers/stats")
+async def transfer_stats():
+    """ Transfers per status (STARTED or FAILED ones need reconciling), and duplicates skipped """
+    return await asyncio.to_thread(transfers.snapshot)
+
+
+@app.get("/router/stats")
+async def router_stats():
+    """ Share of refunds decided without a model call, and the latency of each path """
+    return route_stats.snapshot()
+
+
+@app.get("/job-store/stats")
+async def job_store_stats():
+    """ Pending jobs, hot-cache usage, expiries and compression """
+    # Counts the stored jobs: a query, so off the event loop
+    return await asyncio.to_thread(db.snapshot)
+
+
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
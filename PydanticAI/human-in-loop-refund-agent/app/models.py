@@ -1,9 +1,15 @@
 """
 The Database Model (State Storage) and Data Models
 """
-from typing import List, Optional
+import os
+from typing import List
 from pydantic import BaseModel 
-from pydantic_ai.messages import ModelMessage
+
+from app.audit import AuditLog
+from app.idempotency import IdempotencyStore
+from app.job_queue import RunQueue
+from app.job_store import JobStore, MemoryBackend, SQLiteBackend
+from app.transfers import TransferLedger
 
 # 1. The "Pause" object
 class ApprovalRequest(BaseModel):
@@ -22,16 +28,37 @@ class ManagerDecision(BaseModel):
     approved: bool
     manager_comment: str
 
-# In memory "Database" for this tutorial
-# In production, use PostgreSQL, Redis, or any other database
-class JobStore:
-    def __init__(self):
-        self.jobs = {}
+# 4. Many decisions at once (a manager clearing the approval queue)
+class BatchReview(BaseModel):
+    decisions: List[ManagerDecision]
+
+# Paused jobs, waiting for a manager (see app/job_store.py)
+# JOB_STORE=sqlite keeps them on disk across restarts, JOB_STORE=memory only in this process
+JOB_STORE = os.getenv("JOB_STORE", "sqlite")
+JOB_DB_FILE = os.getenv("JOB_DB_FILE", "refund_jobs.db")
+JOB_CACHE_SIZE = int(os.getenv("JOB_CACHE_SIZE", "1000"))  # Histories kept deserialized in memory
+JOB_TTL_HOURS = float(os.getenv("JOB_TTL_HOURS", "72"))  # Approvals nobody reviewed by then are dropped
+
+db = JobStore(
+    SQLiteBackend(JOB_DB_FILE) if JOB_STORE == "sqlite" else MemoryBackend(),
+    hot_jobs=JOB_CACHE_SIZE,
+    ttl=JOB_TTL_HOURS * 3600,
+)
+
+# Every refund decision (pre-router or agent), see app/audit.py
+AUDIT_DB_FILE = os.getenv("AUDIT_DB_FILE", "refund_audit.db")
+audit_log = AuditLog(AUDIT_DB_FILE)
 
-    def save_job(self, job_id: str, messages: List[ModelMessage]):
-        self.jobs[job_id] = messages
+# Queued refund runs (/request-refund?mode=async), see app/job_queue.py
+RUN_DB_FILE = os.getenv("RUN_DB_FILE", "refund_runs.db")
+RUN_MAX_ATTEMPTS = int(os.getenv("RUN_MAX_ATTEMPTS", "3"))  # Including retries after a worker crash
+run_queue = RunQueue(RUN_DB_FILE, max_attempts=RUN_MAX_ATTEMPTS)
 
-    def get_job(self, job_id: str) -> Optional[List[ModelMessage]]:
-        return self.jobs.get(job_id)
+# Every bank transfer, recorded before the bank is called so a refund is never paid twice, see app/transfers.py
+TRANSFER_DB_FILE = os.getenv("TRANSFER_DB_FILE", "refund_transfers.db")
+transfers = TransferLedger(TRANSFER_DB_FILE)
 
-db = JobStore()
\ No newline at end of file
+# Responses stored by Idempotency-Key, see app/idempotency.py
+IDEMPOTENCY_DB_FILE = os.getenv("IDEMPOTENCY_DB_FILE", "refund_idempotency.db")
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))  # How long a retry gets the stored response
+idempotency = IdempotencyStore(IDEMPOTENCY_DB_FILE, ttl=IDEMPOTENCY_TTL_HOURS * 3600)
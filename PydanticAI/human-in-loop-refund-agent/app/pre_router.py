@@ -0,0 +1,103 @@
+"""
+Rule-based fast path in front of the refund agent.
+
+The agent's policy is numeric: under $50 it calls `final_transfer`, over $50
+it asks a manager. For those clear-cut cases we don't need a model call:
+- "auto_approve": small amount, plain reason -> transfer right away
+- "escalate": above the limit -> an ApprovalRequest job, straight to a manager
+- "agent": anything ambiguous (exactly the limit, amounts that are not a
+  positive number of whole cents, reasons that need reading) still goes
+  through the LLM
+"""
+
+import math
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import List, Literal
+
+from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, SystemPromptPart, TextPart, UserPromptPart
+
+Route = Literal["auto_approve", "escalate", "agent"]
+
+# Reasons that may change the outcome or the amount: a human-like reading is needed
+DEFAULT_AMBIGUOUS_KEYWORDS = (
+    "fraud", "chargeback", "dispute", "lawyer", "legal", "partial", "multiple", "several",
+    "split", "instead", "ignore", "override", "approve", "urgent", "exception",
+)
+
+
+@dataclass
+class RouteDecision:
+    route: Route
+    reason: str
+
+
+def pre_route(user_reason: str, amount: float, limit: float = 50.0,
+              ambiguous_keywords: tuple[str, ...] = DEFAULT_AMBIGUOUS_KEYWORDS) -> RouteDecision:
+    if not math.isfinite(amount) or amount <= 0:
+        return RouteDecision("agent", "amount is not a positive number")
+    cents = round(amount * 100)
+    if cents < 1 or not math.isclose(amount * 100, cents, abs_tol=1e-6):
+        # $12.345 cannot be paid as is: what to round to is the agent's call
+        return RouteDecision("agent", f"${amount:g} is not a whole number of cents")
+    if amount == limit:
+        # The policy says "< $50" and "> $50": exactly $50 is the agent's call
+        return RouteDecision("agent", f"amount is exactly the ${limit:g} limit")
+
+    reason = user_reason.lower()
+    flagged = [keyword for keyword in ambiguous_keywords if keyword in reason]
+    if flagged:
+        return RouteDecision("agent", f"reason mentions {', '.join(flagged)}")
+
+    if amount < limit:
+        return RouteDecision("auto_approve", f"${amount:g} is under the ${limit:g} limit")
+    return RouteDecision("escalate", f"${amount:g} is over the ${limit:g} limit")
+
+
+def escalation_history(system_prompt: str, prompt: str, approval_reason: str) -> List[ModelMessage]:
+    """
+    The history the agent would have left behind when asking for approval,
+    so `/manager-review` can resume a fast-path job like any other.
+    """
+    return [
+        ModelRequest(parts=[SystemPromptPart(content=system_prompt), UserPromptPart(content=prompt)]),
+        ModelResponse(parts=[TextPart(content=f"ApprovalRequest: {approval_reason}")], model_name="pre-router"),
+    ]
+
+
+class RouteStats:
+    """ How many requests each path served, and how long they took """
+
+    def __init__(self, window: int = 1000):
+        self.counts: dict[str, int] = defaultdict(int)
+        self._latencies_ms: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, route: Route, started: float) -> float:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.counts[route] += 1
+        self._latencies_ms[route].append(elapsed_ms)
+        return elapsed_ms
+
+    def snapshot(self) -> dict:
+        total = sum(self.counts.values())
+
+        def percentile(values: list[float], p: float) -> float:
+            return round(values[min(len(values) - 1, int(p * len(values)))], 2)
+
+        routes = {}
+        for route, count in self.counts.items():
+            # .get(): indexing the defaultdicts would add empty routes
+            latencies = sorted(self._latencies_ms.get(route, ()))
+            if not latencies:
+                continue
+            routes[route] = {
+                "requests": count,
+                "latency_ms_p50": percentile(latencies, 0.5),
+                "latency_ms_p99": percentile(latencies, 0.99),
+            }
+        return {
+            "requests": total,
+            "served_without_model": round((total - self.counts.get("agent", 0)) / total, 3) if total else None,
+            "routes": routes,
+        }
@@ -0,0 +1,110 @@
+"""
+Ledger of bank transfers, so that a refund is never paid twice.
+
+The same refund can run more than once: a queued run is retried after an error
+or claimed again after a crash, and a paused job can be resumed again after a
+failed review. Each transfer is recorded under a key of the refund it pays
+(`run:<run_id>`, `job:<job_id>`) BEFORE the bank is called:
+- a new key: the transfer goes ahead, then is marked DONE (or FAILED if the call raised)
+- a key already in the ledger: the transfer is skipped
+
+A STARTED transfer (cut short by a crash) or a FAILED one may or may not have
+reached the bank, so it is never retried automatically: it is left for a person
+to reconcile.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transfers (
+    transfer_key TEXT PRIMARY KEY, -- run:<run_id> / job:<job_id> / refund:<uuid>
+    amount REAL NOT NULL,
+    status TEXT NOT NULL,          -- STARTED / DONE / FAILED
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class TransferLedger:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Default synchronous=FULL: a recorded transfer must survive a power loss
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+        # Metrics
+        self.skipped = 0
+
+    def begin(self, transfer_key: str, amount: float) -> Optional[dict]:
+        """ Records the transfer as STARTED. Returns None if the key is new, else the transfer already recorded """
+        now = time.time()
+        with self._lock, self._conn:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO transfers (transfer_key, amount, status, created_at, updated_at) "
+                "VALUES (?, ?, 'STARTED', ?, ?)",
+                (transfer_key, amount, now, now),
+            ).rowcount
+        return None if inserted else self.get(transfer_key)
+
+    def finish(self, transfer_key: str, status: str, error: str | None = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE transfers SET status = ?, error = ?, updated_at = ? WHERE transfer_key = ?",
+                (status, error, time.time(), transfer_key),
+            )
+
+    def get(self, transfer_key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT amount, status, error, created_at, updated_at FROM transfers WHERE transfer_key = ?",
+                (transfer_key,),
+            ).fetchone()
+        if row is None:
+            return None
+        amount, status, error, created_at, updated_at = row
+        return {
+            "transfer_key": transfer_key,
+            "amount": amount,
+            "status": status,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    async def aget(self, transfer_key: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.get, transfer_key)
+
+    async def transfer_once(
+        self, transfer_key: str, amount: float, transfer: Callable[[float], Awaitable[Any]]
+    ) -> Optional[dict]:
+        """
+        Runs `transfer(amount)` unless a transfer is already recorded under `transfer_key`.
+        Returns None if it ran, or the earlier transfer if it was skipped.
+        """
+        earlier = await asyncio.to_thread(self.begin, transfer_key, amount)
+        if earlier is not None:
+            self.skipped += 1
+            return earlier
+        try:
+            await transfer(amount)
+        except Exception as e:
+            await asyncio.to_thread(self.finish, transfer_key, "FAILED", str(e))
+            raise
+        await asyncio.to_thread(self.finish, transfer_key, "DONE")
+        return None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM transfers GROUP BY status").fetchall()
+        return {"transfers": dict(rows), "duplicates_skipped": self.skipped}
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,107 @@
+"""
+Benchmark: memory and lookup time with many pending approvals.
+
+Saves `--jobs` paused refund histories (shaped like the agent's real ones:
+system prompt, user prompt, ApprovalRequest output call and its return) in:
+- the old plain dict of message lists
+- `JobStore` on SQLite, with `--hot-jobs` histories cached in memory
+
+and reports the Python memory held (tracemalloc), the size on disk and the
+time to look a job up (hot: in the LRU, cold: read from SQLite).
+
+Run (from this folder): python benchmark_job_store.py --jobs 100000
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from pydantic_ai.messages import (
+    ModelRequest, ModelResponse, SystemPromptPart, ToolCallPart, ToolReturnPart, UserPromptPart,
+)
+
+from app.job_store import JobStore, SQLiteBackend
+
+SYSTEM_PROMPT = (
+    "You are a refund processor. "
+    "If refund > $50, you cannot process it yourself. You must return an ApprovalRequest with the reason. "
+    "If refund < $50, you can approve it. Call the final_transfer tool and return TransferSuccess."
+)
+REASONS = ["broken item", "arrived late", "wrong size", "never delivered", "double charged", "damaged box"]
+
+
+def make_history(rng: random.Random) -> list:
+    amount = round(rng.uniform(50, 5000), 2)
+    reason = rng.choice(REASONS)
+    call_id = uuid.uuid4().hex
+    return [
+        ModelRequest(parts=[
+            SystemPromptPart(content=SYSTEM_PROMPT),
+            UserPromptPart(content=f"User wants refund of ${amount} for reason: {reason}"),
+        ]),
+        ModelResponse(parts=[ToolCallPart(
+            tool_name="final_result_ApprovalRequest",
+            args={"amount": amount, "reason": f"Refund of ${amount} exceeds $50: {reason}"},
+            tool_call_id=call_id,
+        )], model_name="gemini-2.5-flash"),
+        ModelRequest(parts=[ToolReturnPart(
+            tool_name="final_result_ApprovalRequest", content="Final result processed.", tool_call_id=call_id,
+        )]),
+    ]
+
+
+def measure(label: str, save, jobs: int, seed: int) -> tuple[list[str], float]:
+    rng = random.Random(seed)
+    job_ids = [str(uuid.uuid4()) for _ in range(jobs)]
+    tracemalloc.start()
+    start = time.perf_counter()
+    for job_id in job_ids:
+        save(job_id, make_history(rng))
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<22} {current / 1024 / 1024:>8.1f} MB in memory  {jobs / elapsed:>9.0f} saves/s")
+    return job_ids, current
+
+
+def time_lookups(label: str, get, job_ids: list[str]) -> None:
+    latencies = []
+    for job_id in job_ids:
+        start = time.perf_counter()
+        assert get(job_id) is not None
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    print(f"{label:<22} p50 {latencies[len(latencies) // 2]:.3f} ms  "
+          f"p99 {latencies[int(len(latencies) * 0.99)]:.3f} ms")
+
+
+def main(args) -> None:
+    plain: dict = {}
+    measure("plain dict", plain.__setitem__, args.jobs, args.seed)
+    plain.clear()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "jobs.db")
+        store = JobStore(SQLiteBackend(path), hot_jobs=args.hot_jobs)
+        job_ids, _ = measure(f"JobStore (hot {args.hot_jobs})", store.save_job, args.jobs, args.seed)
+
+        stats = store.snapshot()
+        print(f"on disk: {os.path.getsize(path) / 1024 / 1024:.1f} MB for {stats['stored_jobs']} jobs "
+              f"(compression {stats['compression_ratio']}x)")
+
+        sample = random.Random(args.seed).sample(job_ids[:-args.hot_jobs], min(1000, len(job_ids) - args.hot_jobs))
+        time_lookups("lookup (cold)", store.get_job, sample)
+        time_lookups("lookup (hot)", store.get_job, sample)
+        store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=100_000, help="Pending approvals")
+    parser.add_argument("--hot-jobs", type=int, default=1000, help="JobStore in-memory LRU size")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,123 @@
+"""
+A persistent, content-addressed cache of finished analyses.
+
+Lawyers paste the same boilerplate clauses over and over. The key is a hash
+of the normalized clause, the system prompt and the model, so a hit is only
+served when the agent would have been asked the exact same thing.
+
+Storage is a local SQLite file, bounded in size: when it grows past
+`max_bytes` the least recently used analyses are evicted.
+"""
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    key TEXT PRIMARY KEY,
+    analysis TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_last_used ON analyses (last_used);
+"""
+
+
+def normalize_clause(clause: str) -> str:
+    """ Whitespace-insensitive form of the clause (case is kept, it can matter in legal text) """
+    return " ".join(clause.split())
+
+
+def cache_key(clause: str, system_prompt: str, model_name: str) -> str:
+    digest = hashlib.sha256()
+    for part in (normalize_clause(clause), system_prompt, model_name):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Stores the final analysis JSON by key. The blocking SQLite calls run in a
+    worker thread (`aget` / `aput`) so the event loop keeps streaming.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM analyses").fetchone()
+        self.total_bytes = total
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT analysis FROM analyses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE analyses SET hits = hits + 1, last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, analysis_json: str) -> None:
+        size = len(analysis_json.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM analyses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, analysis, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, analysis_json, size, now, now),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        # Drop the least recently used entries until we are back under budget
+        while self.total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM analyses ORDER BY last_used LIMIT 64"
+            ).fetchall()
+            for key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.evictions += 1
+
+    async def aget(self, key: str) -> str | None:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, analysis_json: str) -> None:
+        await asyncio.to_thread(self.put, key, analysis_json)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()
+        return {
+            "entries": entries,
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,103 @@
+"""
+Benchmark: near-duplicate lookups in the `SimilarityIndex`.
+
+Indexes `--clauses` synthetic clauses (a legal template plus random filler
+words, with random party names, amounts and dates), then times lookups for:
+- near-duplicates: an indexed clause with other parties, amounts and dates
+- new clauses: never indexed, should not match
+
+Run: python benchmark_similarity.py --clauses 1000000
+"""
+
+import argparse
+import random
+import time
+
+from similarity import SimilarityIndex
+
+TEMPLATES = [
+    "{a} shall indemnify and hold harmless {b} from any claims arising before {date}, up to {amount}",
+    "{a} may terminate this agreement on {days} days written notice to {b} without penalty",
+    "{a} shall keep confidential all information disclosed by {b} for {days} years after {date}",
+    "the total liability of {a} to {b} shall not exceed {amount} in any contract year",
+    "{a} grants {b} a non-exclusive licence to use the software until {date} for a fee of {amount}",
+    "{a} shall pay {b} the sum of {amount} within {days} days of each invoice dated after {date}",
+]
+NAMES = ["Acme", "Globex", "Initech", "Umbrella", "Hooli", "Stark", "Wayne", "Wonka", "Tyrell", "Cyberdyne"]
+SUFFIXES = ["Inc.", "LLC", "Ltd", "Corp.", "GmbH"]
+
+
+def make_vocabulary(size: int, rng: random.Random) -> list[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(size)]
+
+
+def party(rng: random.Random) -> str:
+    return f"{rng.choice(NAMES)} {rng.choice(NAMES)} {rng.choice(SUFFIXES)}"
+
+
+def make_clause(template: str, filler: list[str], rng: random.Random) -> str:
+    body = template.format(
+        a=party(rng), b=party(rng), date=f"{rng.randint(1, 12)}/{rng.randint(1, 28)}/{rng.randint(2020, 2030)}",
+        amount=f"${rng.randint(1, 999)},{rng.randint(0, 999):03d}", days=rng.randint(5, 90),
+    )
+    return f"{body}, {' '.join(filler)}."
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def main(args) -> None:
+    rng = random.Random(42)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    specs = [(rng.choice(TEMPLATES), rng.sample(vocabulary, args.filler_words)) for _ in range(args.clauses)]
+
+    index = SimilarityIndex(capacity=args.clauses)
+    start = time.perf_counter()
+    for offset in range(0, args.clauses, 50_000):
+        index.add_many((make_clause(template, filler, rng), i) for i, (template, filler) in
+                       enumerate(specs[offset:offset + 50_000], start=offset))
+    build_s = time.perf_counter() - start
+    print(f"indexed {len(index):,} clauses in {build_s:.1f} s "
+          f"({index.snapshot()['index_bytes'] / 1024 / 1024:.0f} MB of index)")
+
+    # A few hundred single adds on top, as the server does after each analysis
+    for template, filler in specs[:200]:
+        index.add(make_clause(template, filler, rng))
+
+    def run(label: str, queries: list[tuple[str, int | None]]) -> list[float]:
+        latencies, found = [], 0
+        for clause, expected in queries:
+            started = time.perf_counter()
+            match = index.query(clause, min_score=args.threshold)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if match is not None and (expected is None or match.payload == expected):
+                found += 1
+        print(f"{label:<16} {len(queries)} lookups  p50 {percentile(latencies, 0.5):.3f} ms  "
+              f"p99 {percentile(latencies, 0.99):.3f} ms  max {max(latencies):.3f} ms  "
+              f"matched {found / len(queries):.1%}")
+        return latencies
+
+    picks = rng.sample(range(args.clauses), args.queries)
+    near = [(make_clause(*specs[i], rng), i) for i in picks]
+    new = [(make_clause(rng.choice(TEMPLATES), rng.sample(vocabulary, args.filler_words), rng), None)
+           for _ in range(args.queries)]
+
+    latencies = run("near-duplicates", near) + run("new clauses", new)
+    print(f"avg candidates scored per lookup: {index.snapshot()['avg_candidates']}")
+
+    p99 = percentile(latencies, 0.99)
+    print(f"p99 {p99:.3f} ms vs target {args.target_ms} ms: {'OK' if p99 <= args.target_ms else 'TOO SLOW'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clauses", type=int, default=1_000_000, help="Clauses in the index")
+    parser.add_argument("--queries", type=int, default=2000, help="Lookups per kind")
+    parser.add_argument("--threshold", type=float, default=0.9, help="Minimum similarity to count as a match")
+    parser.add_argument("--vocabulary", type=int, default=20_000, help="Distinct filler words")
+    parser.add_argument("--filler-words", type=int, default=25, help="Filler words per clause")
+    parser.add_argument("--target-ms", type=float, default=5.0)
+    main(parser.parse_args())
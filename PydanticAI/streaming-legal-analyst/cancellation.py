@@ -0,0 +1,92 @@
+"""
+Stop spending model tokens on clients that have already left.
+
+`cancel_on_disconnect` wraps an SSE generator and polls the request for a
+disconnect. When the client is gone it cancels the generator wherever it
+is awaiting (model stream, queue for a free analysis slot...), which closes
+the upstream model stream via `run_stream`'s context manager.
+
+Token savings are estimates: ~4 characters per token of output, and a
+cancelled stream "saves" what an average completed stream would still
+have generated.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import AsyncGenerator, AsyncIterator
+
+from fastapi import Request
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+@dataclass
+class CancellationStats:
+    completed_streams: int = 0
+    cancelled_streams: int = 0  # Client left while the model was generating
+    dropped_before_start: int = 0  # Client left while waiting for a free slot
+    estimated_tokens_saved: int = 0
+    _completed_tokens: int = 0
+
+    @property
+    def avg_completed_tokens(self) -> float:
+        return self._completed_tokens / self.completed_streams if self.completed_streams else 0.0
+
+    def record_completed(self, output_json: str) -> None:
+        self.completed_streams += 1
+        self._completed_tokens += estimate_tokens(output_json)
+
+    def record_cancelled(self, partial_json: str | None) -> None:
+        self.cancelled_streams += 1
+        generated = estimate_tokens(partial_json) if partial_json else 0
+        self.estimated_tokens_saved += max(0, round(self.avg_completed_tokens) - generated)
+
+    def record_dropped(self) -> None:
+        self.dropped_before_start += 1
+        self.estimated_tokens_saved += round(self.avg_completed_tokens)
+
+    def snapshot(self) -> dict:
+        return {
+            "completed_streams": self.completed_streams,
+            "cancelled_streams": self.cancelled_streams,
+            "dropped_before_start": self.dropped_before_start,
+            "estimated_tokens_saved": self.estimated_tokens_saved,
+            "avg_completed_tokens": round(self.avg_completed_tokens),
+        }
+
+
+async def _wait_for_disconnect(request: Request, poll_interval: float) -> None:
+    while not await request.is_disconnected():
+        await asyncio.sleep(poll_interval)
+
+
+async def cancel_on_disconnect(
+    request: Request, stream: AsyncGenerator[str, None], poll_interval: float = 0.5
+) -> AsyncIterator[str]:
+    """ Yields from `stream` until it ends or the client disconnects, whichever comes first """
+    watcher = asyncio.create_task(_wait_for_disconnect(request, poll_interval))
+    next_chunk: asyncio.Future | None = None
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(stream.__anext__())
+            await asyncio.wait({next_chunk, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_chunk.done():
+                # The client is gone: cancel the stream wherever it is waiting
+                return
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                return
+            next_chunk = None
+            yield chunk
+    finally:
+        watcher.cancel()
+        if next_chunk is not None and not next_chunk.done():
+            next_chunk.cancel()
+            # Let the generator unwind (closing the model stream) before we close it
+            await asyncio.gather(next_chunk, return_exceptions=True)
+        await stream.aclose()
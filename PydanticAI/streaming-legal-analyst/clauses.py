@@ -0,0 +1,82 @@
+"""
+Clause-level fan-out for long contracts.
+
+Instead of sending the whole contract as one giant prompt, we split it into
+clauses, analyze them concurrently and merge the per-clause results into a
+single ContractAnalysis at the end.
+"""
+
+import re
+from typing import Iterable, TypeVar
+
+from pydantic import BaseModel
+
+# A new clause starts at a numbered heading: "1.", "2.3", "(a)", "Section 4", "Article IV"...
+CLAUSE_HEADING = re.compile(
+    r"^\s*(?:\d+(?:\.\d+)*[.)]|\([a-zA-Z0-9]+\)|(?:Section|Article|Clause)\s+[\dIVXLC]+)\s",
+    re.IGNORECASE,
+)
+
+# Fragments shorter than this are glued onto the previous clause (e.g. a lone heading)
+MIN_CLAUSE_CHARS = 40
+
+AnalysisT = TypeVar("AnalysisT", bound=BaseModel)
+
+
+def split_into_clauses(contract: str) -> list[str]:
+    """
+    Splits on blank lines and on numbered headings.
+    A contract without any structure comes back as a single clause.
+    """
+    clauses: list[str] = []
+    current: list[str] = []
+
+    def flush():
+        text = "\n".join(current).strip()
+        current.clear()
+        if not text:
+            return
+        if clauses and len(text) < MIN_CLAUSE_CHARS:
+            clauses[-1] = f"{clauses[-1]}\n{text}"
+        elif clauses and len(clauses[-1]) < MIN_CLAUSE_CHARS:
+            clauses[-1] = f"{clauses[-1]}\n{text}"
+        else:
+            clauses.append(text)
+
+    for line in contract.splitlines():
+        if not line.strip() or CLAUSE_HEADING.match(line):
+            flush()
+        current.append(line)
+    flush()
+
+    return clauses or [contract]
+
+
+def dedupe(items: Iterable[str]) -> list[str]:
+    """ Keeps the first occurrence, comparing case and whitespace insensitively """
+    seen = set()
+    unique = []
+    for item in items:
+        key = " ".join(item.lower().split())
+        if key not in seen:
+            seen.add(key)
+            unique.append(item)
+    return unique
+
+
+def merge_analyses(
+    results: list[tuple[int, AnalysisT]], analysis_type: type[AnalysisT], failed: Iterable[int] = ()
+) -> AnalysisT:
+    """
+    One aggregate analysis from the (clause index, analysis) pairs:
+    per-clause summaries in contract order, the max risk score and the deduped flagged items.
+    The `failed` clause indexes keep their place in the summary, marked as not analyzed.
+    """
+    results = sorted(results, key=lambda pair: pair[0])
+    summaries = {index: analysis.summary for index, analysis in results}
+    summaries.update((index, "not analyzed (the analysis failed)") for index in failed)
+    return analysis_type(
+        summary="\n".join(f"Clause {index + 1}: {summaries[index]}" for index in sorted(summaries)),
+        risk_score=max((analysis.risk_score for _, analysis in results), default=0),
+        flagged_items=dedupe(item for _, analysis in results for item in analysis.flagged_items),
+    )
@@ -0,0 +1,120 @@
+"""
+Checks that client disconnects stop the model stream.
+
+A slow stand-in model streams `--tokens` tokens at `--token-rate` tokens/s
+and counts how many it actually produced. With MAX_CONCURRENT_ANALYSES
+set to `--slots`, `--clients` clients connect and all leave after
+`--disconnect-after` seconds:
+- the clients that got a slot have their model stream cancelled mid-way
+- the clients still waiting for a slot are dropped before any model call
+
+The app is driven in-process as a raw ASGI app, so no server or API key is needed.
+
+Run: python disconnect_test.py
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-stand-in")
+_tmp = tempfile.mkdtemp()
+os.environ["DB_FILE"] = os.path.join(_tmp, "analyses.db")
+os.environ["ANALYSIS_CACHE_ENABLED"] = "false"
+os.environ["SIMILARITY_INDEX_ENABLED"] = "false"
+
+from pydantic_ai.models.function import AgentInfo, DeltaToolCall, FunctionModel
+
+import main
+
+tokens_generated = 0
+
+
+def make_slow_model(tokens: int, token_rate: float) -> FunctionModel:
+    async def stream(messages, info: AgentInfo):
+        global tokens_generated
+        words = " ".join(["risk"] * tokens)
+        args = json.dumps({"summary": words, "risk_score": 5, "flagged_items": ["Indemnity"]})
+        # Roughly one token per 4 characters of output
+        for i in range(0, len(args), 4):
+            await asyncio.sleep(1 / token_rate)
+            tokens_generated += 1
+            yield {0: DeltaToolCall(name=info.output_tools[0].name if i == 0 else None, json_args=args[i:i + 4])}
+
+    return FunctionModel(stream_function=stream)
+
+
+async def call(clause: str, disconnect_after: float | None) -> int:
+    """ Posts to /analyze-stream like a client that may hang up. Returns the number of SSE bytes received """
+    body = json.dumps({"contract_clause": clause}).encode()
+    disconnected = asyncio.Event()
+    body_sent = False
+    received = 0
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal received
+        if message["type"] == "http.response.body":
+            received += len(message.get("body", b""))
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/analyze-stream", "raw_path": b"/analyze-stream",
+        "query_string": b"", "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234), "server": ("test", 80),
+    }
+    app_task = asyncio.create_task(main.app(scope, receive, send))
+    if disconnect_after is not None:
+        await asyncio.sleep(disconnect_after)
+        disconnected.set()
+    await app_task
+    return received
+
+
+async def main_async(args) -> None:
+    global tokens_generated
+    main.DISCONNECT_POLL_MS = 50
+    main.analysis_slots = asyncio.Semaphore(args.slots)
+    # Cancel as soon as the last client leaves, without waiting for a reconnect
+    main.replay_registry.grace = 0
+
+    with main.legal_analyst_agent.override(model=make_slow_model(args.tokens, args.token_rate)):
+        # One complete run, so we know what a whole analysis costs
+        await call("Warm-up clause", disconnect_after=None)
+        full_run_tokens = tokens_generated
+        tokens_generated = 0
+
+        await asyncio.gather(*[call(f"Clause {i}", args.disconnect_after) for i in range(args.clients)])
+        await asyncio.sleep(0.2)
+
+    await main.db.close()
+    stats = main.cancellation_stats.snapshot()
+    print(f"tokens for one full analysis:      {full_run_tokens}")
+    print(f"tokens generated for {args.clients} clients:    {tokens_generated} "
+          f"(vs {full_run_tokens * args.clients} without cancellation)")
+    print(f"cancelled streams:                 {stats['cancelled_streams']}")
+    print(f"dropped before start:              {stats['dropped_before_start']}")
+    print(f"estimated tokens saved:            {stats['estimated_tokens_saved']}")
+
+    assert stats["cancelled_streams"] == args.slots
+    assert stats["dropped_before_start"] == args.clients - args.slots
+    assert tokens_generated < full_run_tokens * args.slots
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=200, help="Words in the stand-in summary")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="Tokens per second")
+    parser.add_argument("--clients", type=int, default=6)
+    parser.add_argument("--slots", type=int, default=2, help="MAX_CONCURRENT_ANALYSES")
+    parser.add_argument("--disconnect-after", type=float, default=0.5, help="Seconds before the clients leave")
+    asyncio.run(main_async(parser.parse_args()))
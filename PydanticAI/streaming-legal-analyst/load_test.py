@@ -0,0 +1,203 @@
+"""
+Offline load test for `/analyze-stream`, without spending Gemini quota.
+
+The agent's model is swapped for a deterministic stand-in that streams a
+fixed analysis (derived from the clause) at `--token-rate` tokens/s, with
+`--jitter` random variation on each token gap. `--clients` concurrent SSE
+clients then call `/analyze-stream` of `main.py` and of `main_no_backend.py`.
+
+Reported per app, as JSON (stdout or `--output`):
+- time to first event, inter-event latency (p50 / p95 / p99, ms)
+- events/s and bytes/s over the whole run
+- server CPU per stream (process CPU time / streams)
+
+The apps are driven in-process as raw ASGI apps, so chunks are timed as the
+server sends them and the CPU time is the server's (plus the stand-in model).
+The analysis cache and the similarity index are turned off: every stream runs
+the model. `--baseline previous.json` prints the change of every metric.
+
+Run: python load_test.py --clients 50 --output results.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-stand-in")
+_tmp = tempfile.mkdtemp()
+os.environ["DB_FILE"] = os.path.join(_tmp, "analyses.db")
+os.environ["ANALYSIS_CACHE_ENABLED"] = "false"
+os.environ["SIMILARITY_INDEX_ENABLED"] = "false"
+
+from pydantic_ai.models.function import AgentInfo, DeltaToolCall, FunctionModel
+
+APPS = ["main", "main_no_backend"]
+CHARS_PER_TOKEN = 4
+WORDS = ["indemnify", "liability", "termination", "breach", "notice", "warranty", "party", "damages",
+         "confidential", "obligation", "remedy", "waiver", "assignment", "jurisdiction", "consent"]
+
+
+def make_stand_in_model(token_rate: float, jitter: float, tokens: int, seed: int) -> FunctionModel:
+    """ Streams the same analysis for the same clause, one token (~4 characters) at a time """
+
+    async def stream(messages, info: AgentInfo):
+        prompt = str(messages[-1].parts[-1].content)
+        rng = random.Random(zlib.crc32(prompt.encode()) ^ seed)
+        words = " ".join(rng.choice(WORDS) for _ in range(tokens * CHARS_PER_TOKEN // 10))
+        args = json.dumps({
+            "summary": words, "risk_score": rng.randint(0, 10), "flagged_items": rng.sample(WORDS, 3),
+        })
+        for i in range(0, len(args), CHARS_PER_TOKEN):
+            await asyncio.sleep(max(0.0, (1 + jitter * rng.uniform(-1, 1)) / token_rate))
+            yield {0: DeltaToolCall(name=info.output_tools[0].name if i == 0 else None,
+                                    json_args=args[i:i + CHARS_PER_TOKEN])}
+
+    return FunctionModel(stream_function=stream)
+
+
+async def sse_client(app, payload: dict) -> dict:
+    """ One POST /analyze-stream. Returns when each body chunk was sent and its size """
+    body = json.dumps(payload).encode()
+    body_sent = False
+    never = asyncio.Event()
+    chunks: list[tuple[float, int, int]] = []  # (time, bytes, events)
+    status = None
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await never.wait()  # The client stays connected
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            chunk = message["body"]
+            chunks.append((time.perf_counter(), len(chunk), chunk.count(b"\n\n")))
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/analyze-stream", "raw_path": b"/analyze-stream",
+        "query_string": b"", "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234), "server": ("load-test", 80),
+    }
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    return {"started": started, "status": status, "chunks": chunks}
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    values = sorted(values)
+
+    def pick(p: float) -> float:
+        return round(values[min(len(values) - 1, int(p * len(values)))], 3)
+
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+async def run_app(name: str, args) -> dict:
+    module = importlib.import_module(name)
+    model = make_stand_in_model(args.token_rate, args.jitter, args.tokens, args.seed)
+    payload = {"stream_mode": args.stream_mode} if name == "main" else {}
+
+    # The apps log every stream and save; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()), module.legal_analyst_agent.override(model=model):
+        async with module.app.router.lifespan_context(module.app):
+            await sse_client(module.app, {"contract_clause": "Warm-up clause for the load test.", **payload})
+
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            clients = [
+                sse_client(module.app, {"contract_clause": f"Clause {i}: the Supplier shall indemnify the Buyer.",
+                                        **payload})
+                for i in range(args.clients)
+            ]
+            streams = await asyncio.gather(*clients)
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+
+    ok = [s for s in streams if s["status"] == 200 and s["chunks"]]
+    ttfe = [(s["chunks"][0][0] - s["started"]) * 1000 for s in ok]
+    gaps = [(later[0] - earlier[0]) * 1000 for s in ok for earlier, later in zip(s["chunks"], s["chunks"][1:])]
+    total_bytes = sum(size for s in ok for _, size, _ in s["chunks"])
+    total_events = sum(events for s in ok for _, _, events in s["chunks"])
+
+    return {
+        "streams": len(streams),
+        # main.py queues analyses beyond this limit, which shows in the time to first event
+        "max_concurrent_analyses": getattr(module, "MAX_CONCURRENT_ANALYSES", None),
+        "failed": len(streams) - len(ok),
+        "wall_s": round(wall, 3),
+        "time_to_first_event_ms": percentiles(ttfe),
+        "inter_event_ms": percentiles(gaps),
+        "events_per_second": round(total_events / wall, 2),
+        "bytes_per_second": round(total_bytes / wall, 1),
+        "events_per_stream": round(total_events / len(ok), 2) if ok else 0,
+        "bytes_per_stream": round(total_bytes / len(ok)) if ok else 0,
+        "server_cpu_ms_per_stream": round(cpu * 1000 / len(streams), 3),
+    }
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """ Prints every metric next to the baseline run, with the relative change """
+    old, new = flatten(baseline["results"]), flatten(results["results"])
+    for key in sorted(new):
+        if key in old:
+            change = f"{(new[key] - old[key]) / old[key]:+.1%}" if old[key] else "n/a"
+            print(f"{key:<55} {old[key]:>12} -> {new[key]:>12}  {change}", file=sys.stderr)
+
+
+async def main_async(args) -> None:
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "baseline")}
+    results = {"config": config, "results": {}}
+    for name in args.apps:
+        results["results"][name] = await run_app(name, args)
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=20, help="Concurrent SSE clients")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Stand-in model tokens per second")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Random variation of each token gap (0.2 = ±20%%)")
+    parser.add_argument("--tokens", type=int, default=150, help="Approximate tokens in each analysis")
+    parser.add_argument("--stream-mode", choices=["snapshot", "delta"], default="snapshot", help="main.py only")
+    parser.add_argument("--apps", nargs="+", choices=APPS, default=APPS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="A previous JSON report to compare against")
+    asyncio.run(main_async(parser.parse_args()))
@@ -1,7 +1,9 @@
 import os
 import asyncio
 import json
-from fastapi import FastAPI
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
@@ -12,10 +14,57 @@ from pydantic_ai.models.google import GoogleModel
 
 import uvicorn
 from dotenv import load_dotenv
-from typing import List
+from typing import List, Literal
+
+from analysis_cache import AnalysisCache, cache_key
+from cancellation import CancellationStats, cancel_on_disconnect
+from clauses import merge_analyses, split_into_clauses
+from persistence import Database
+from replay import ReplayRegistry, StreamBuffer
+from similarity import SimilarityIndex, SimilarMatch, same_masked_text
+from sse_delta import DeltaEncoder, StreamStats
 
 load_dotenv()
 
+# Streaming settings
+# Coalescing window: partials arriving within this window are merged into one event (0 = send every partial)
+COALESCE_MS = int(os.getenv("COALESCE_MS", "0"))
+# In delta mode, send a full snapshot every N events so clients can re-sync
+SNAPSHOT_EVERY = int(os.getenv("SNAPSHOT_EVERY", "20"))
+
+# Analysis cache settings (set ANALYSIS_CACHE_ENABLED=false to always run the agent)
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+ANALYSIS_CACHE_FILE = os.getenv("ANALYSIS_CACHE_FILE", "analysis_cache.db")
+ANALYSIS_CACHE_MAX_MB = float(os.getenv("ANALYSIS_CACHE_MAX_MB", "64"))
+
+# Near-duplicate clauses (same text up to party names, dates and amounts) reuse earlier analyses
+SIMILARITY_INDEX_ENABLED = os.getenv("SIMILARITY_INDEX_ENABLED", "true").lower() == "true"
+SIMILARITY_INDEX_MAX = int(os.getenv("SIMILARITY_INDEX_MAX", "200000"))  # Clauses kept in the in-memory index
+# Off by default: near-duplicates are only given to the agent as context. When on, a stored analysis is
+# returned as is only if the score is high enough AND the clauses differ in nothing but parties and numbers
+SIMILAR_REUSE_ENABLED = os.getenv("SIMILAR_REUSE_ENABLED", "false").lower() == "true"
+SIMILAR_REUSE_THRESHOLD = float(os.getenv("SIMILAR_REUSE_THRESHOLD", "0.9"))
+SIMILAR_CONTEXT_THRESHOLD = float(os.getenv("SIMILAR_CONTEXT_THRESHOLD", "0.6"))  # Give it to the agent as context
+
+# Clause fan-out: how many clauses of one contract are analyzed at once
+CLAUSE_CONCURRENCY = int(os.getenv("CLAUSE_CONCURRENCY", "8"))
+
+# Case management database (write-behind: saves are queued and flushed in batches)
+DB_FILE = os.getenv("DB_FILE", "legal_analyses.db")
+SAVE_QUEUE_MAX = int(os.getenv("SAVE_QUEUE_MAX", "1000"))  # save_analysis waits when this many are queued
+SAVE_BATCH_SIZE = int(os.getenv("SAVE_BATCH_SIZE", "100"))
+SAVE_FLUSH_INTERVAL_MS = int(os.getenv("SAVE_FLUSH_INTERVAL_MS", "500"))
+
+# Server-wide limit on analyses running at once; the rest wait for a slot
+MAX_CONCURRENT_ANALYSES = int(os.getenv("MAX_CONCURRENT_ANALYSES", "16"))
+# How often we check whether the client has gone away
+DISCONNECT_POLL_MS = int(os.getenv("DISCONNECT_POLL_MS", "250"))
+
+# Resumable streams: events are buffered so a reconnect (Last-Event-ID) continues the same analysis
+REPLAY_BUFFER_MAX_MB = float(os.getenv("REPLAY_BUFFER_MAX_MB", "32"))
+REPLAY_TTL_SECONDS = float(os.getenv("REPLAY_TTL_SECONDS", "300"))  # How long finished streams stay replayable
+RESUME_GRACE_MS = int(os.getenv("RESUME_GRACE_MS", "10000"))  # How long an abandoned analysis waits for a reconnect
+
 # --- 2. FIXED: Setup the Google Model ---
 api_key = os.getenv('GOOGLE_API_KEY')
 if not api_key:
@@ -31,16 +80,34 @@ class ContractAnalysis(BaseModel):
     flagged_items: List[str]
 
 # --- 4. Define the Agent ---
+SYSTEM_PROMPT = (
+    "You are an expert legal analyst. Analyze the user's contract clause. "
+    "Explain the risks clearly."
+)
+
 legal_analyst_agent = Agent(
     model=model,                  
     output_type=ContractAnalysis, 
-    system_prompt=(
-        "You are an expert legal analyst. Analyze the user's contract clause. "
-        "Explain the risks clearly."
-    )
+    system_prompt=SYSTEM_PROMPT
 )
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if similarity_index is not None:
+        # Warm the index with what we analyzed before the restart
+        rows = await asyncio.to_thread(db.load_analyses, SIMILARITY_INDEX_MAX)
+        await asyncio.to_thread(
+            similarity_index.add_many, [(clause, (clause, json.dumps(analysis))) for clause, analysis in rows]
+        )
+        print(f"🔎 SIMILARITY: Indexed {len(similarity_index)} previously analyzed clauses")
+    db.start()
+    yield
+    # Drain the pending saves before the process exits
+    await db.close()
+    if analysis_cache is not None:
+        analysis_cache.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -50,53 +117,334 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# --- 5. Mock Database ---
-class Database:
-    async def save_analysis(self, clause: str, analysis: ContractAnalysis):
-        print(f"💾 DATABASE: Saved analysis | Risk Score: {analysis.risk_score}")
-        return True
+# --- 5. Database ---
+# save_analysis() only enqueues; a background task writes batches to SQLite (persistence.py)
+db = Database(
+    DB_FILE, max_queue=SAVE_QUEUE_MAX, batch_size=SAVE_BATCH_SIZE, flush_interval=SAVE_FLUSH_INTERVAL_MS / 1000
+)
+
+# Finished analyses by hash of (normalized clause, system prompt, model)
+analysis_cache = (
+    AnalysisCache(ANALYSIS_CACHE_FILE, max_bytes=int(ANALYSIS_CACHE_MAX_MB * 1024 * 1024))
+    if ANALYSIS_CACHE_ENABLED else None
+)
+
+# (clause, analysis JSON) of finished analyses, searchable by near-duplicate clause
+similarity_index = SimilarityIndex(capacity=SIMILARITY_INDEX_MAX) if SIMILARITY_INDEX_ENABLED else None
+similarity_outcomes: Counter[str] = Counter()  # "reused" / "context"
+
+# Per-stream bytes / events of the most recent streams, to compare the modes
+recent_stream_stats: deque[dict] = deque(maxlen=100)
 
-db = Database()
+# Agent runs in progress are limited server-wide; cancelled / dropped streams are counted
+analysis_slots = asyncio.Semaphore(MAX_CONCURRENT_ANALYSES)
+cancellation_stats = CancellationStats()
+
+replay_registry = ReplayRegistry(
+    max_bytes=int(REPLAY_BUFFER_MAX_MB * 1024 * 1024), ttl=REPLAY_TTL_SECONDS, grace=RESUME_GRACE_MS / 1000
+)
 
 # --- 6. The Streaming Logic ---
-async def stream_contract_analysis(contract_clause: str):
+def find_similar(clause: str) -> SimilarMatch | None:
+    if similarity_index is None:
+        return None
+    return similarity_index.query(clause, min_score=SIMILAR_CONTEXT_THRESHOLD)
+
+
+def can_reuse(clause: str, match: SimilarMatch | None) -> bool:
+    """ Whether the similar clause's analysis may be returned without running the agent """
+    return (
+        SIMILAR_REUSE_ENABLED
+        and match is not None
+        and match.score >= SIMILAR_REUSE_THRESHOLD
+        and same_masked_text(clause, match.payload[0])
+    )
+
+
+def remember_analysis(clause: str, analysis_json: str) -> None:
+    if similarity_index is not None:
+        similarity_index.add(clause, (clause, analysis_json))
+
+
+def prompt_with_prior(clause: str, match: SimilarMatch | None) -> str:
+    """ The clause, plus the analysis of a similar earlier clause for the agent to build on """
+    if match is None:
+        return clause
+    prior_clause, prior_analysis = match.payload
+    return (
+        f"{clause}\n\n"
+        f"For reference, a similar clause ({match.score:.0%} alike) was analyzed before. "
+        "Reuse what still applies, but analyze the clause above on its own terms:\n"
+        f"Similar clause: {prior_clause}\n"
+        f"Its analysis: {prior_analysis}"
+    )
+
+
+async def stream_contract_analysis(
+    contract_clause: str, stream_mode: str = "snapshot", key: str | None = None, prior: SimilarMatch | None = None
+):
     
-    # We use run_stream to keep the connection open
-    async with legal_analyst_agent.run_stream(contract_clause) as result_stream:
-        
-        final_result = None
-
-        # A. Stream Partial Data (The "Thinking" Process)
-        # debounce_by=None will yield every partial result with increased frequency as it arrives
-        async for partial_result in result_stream.stream_output(debounce_by=None):
-            final_result = partial_result
-            # Dump the partial model to JSON so the frontend can read it live
-            chunk_data = partial_result.model_dump(mode='json', exclude_unset=True)
-            yield f"event: partial\ndata: {json.dumps(chunk_data)}\n\n"
-
-        # B. Get Final Validated Data
-        # If you streamed to completion, `final_result` is already the final validated object.
-        # But for safety (in case nothing was yielded), fall back to get_output().
-        if final_result is None:
-            final_result = await result_stream.get_output()
-
-        # C. Save to Database
-        await db.save_analysis(contract_clause, final_result)
-
-        # D. Send Final Event
-        yield f"event: final_result\ndata: {final_result.model_dump_json()}\n\n"
+    stats = StreamStats(mode=stream_mode)
+    # Only used in delta mode: turns each partial into a patch against the previous one
+    encoder = DeltaEncoder(snapshot_every=SNAPSHOT_EVERY) if stream_mode == "delta" else None
+
+    def sse(event: str, data: str) -> str:
+        return stats.record(f"event: {event}\ndata: {data}\n\n")
+
+    final_result = None
+    started = False
+    try:
+        # Wait for a free slot; if the client leaves meanwhile we are cancelled here, before any model call
+        async with analysis_slots:
+            started = True
+
+            # We use run_stream to keep the connection open
+            async with legal_analyst_agent.run_stream(prompt_with_prior(contract_clause, prior)) as result_stream:
+
+                # A. Stream Partial Data (The "Thinking" Process)
+                # debounce_by=None will yield every partial result with increased frequency as it arrives,
+                # a coalescing window merges the partials that arrive within it into one event
+                async for partial_result in result_stream.stream_output(debounce_by=COALESCE_MS / 1000 or None):
+                    final_result = partial_result
+                    # Dump the partial model to JSON so the frontend can read it live
+                    chunk_data = partial_result.model_dump(mode='json', exclude_unset=True)
+                    if encoder is None:
+                        yield sse("partial", json.dumps(chunk_data))
+                        continue
+
+                    # Delta mode: only what changed (plus a periodic full snapshot)
+                    encoded = encoder.encode(chunk_data)
+                    if encoded is not None:
+                        event, payload = encoded
+                        yield sse(event, json.dumps(payload))
+
+                # B. Get Final Validated Data
+                # If you streamed to completion, `final_result` is already the final validated object.
+                # But for safety (in case nothing was yielded), fall back to get_output().
+                if final_result is None:
+                    final_result = await result_stream.get_output()
+
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client disconnected: leaving the `async with` blocks closed the model stream
+        if not started:
+            cancellation_stats.record_dropped()
+        else:
+            cancellation_stats.record_cancelled(final_result.model_dump_json() if final_result else None)
+        raise
+
+    # C. Save to Database
+    await db.save_analysis(contract_clause, final_result)
+
+    # D. Send Final Event
+    final_json = final_result.model_dump_json()
+    cancellation_stats.record_completed(final_json)
+    yield sse("final_result", final_json)
+
+    # E. Remember the analysis for the next identical (or nearly identical) clause
+    if analysis_cache is not None and key is not None:
+        await analysis_cache.aput(key, final_json)
+    remember_analysis(contract_clause, final_json)
+
+    record_stream_stats(stats)
+
+
+async def replay_cached_analysis(contract_clause: str, stream_mode: str, analysis_json: str, save: bool = True):
+    """
+    A cache hit: no agent run, the stored analysis is sent as final_result right away.
+    `save=False` for a similar clause's analysis: saved under this clause, it would be
+    indexed at the next startup as if it had been analyzed.
+    """
+    stats = StreamStats(mode=stream_mode, cache_hit=True)
+    if save:
+        await db.save_analysis(contract_clause, ContractAnalysis.model_validate_json(analysis_json))
+    yield stats.record(f"event: final_result\ndata: {analysis_json}\n\n")
+    record_stream_stats(stats)
+
+
+async def analyze_single_clause(clause: str) -> tuple[ContractAnalysis, bool]:
+    """ Analyzes one clause (no streaming), using the analysis cache and similar clauses. Returns (analysis, reused) """
+    key = None
+    if analysis_cache is not None:
+        key = cache_key(clause, SYSTEM_PROMPT, model.model_name)
+        cached = await analysis_cache.aget(key)
+        if cached:
+            return ContractAnalysis.model_validate_json(cached), True
+
+    match = find_similar(clause)
+    if can_reuse(clause, match):
+        similarity_outcomes["reused"] += 1
+        return ContractAnalysis.model_validate_json(match.payload[1]), True
+    if match is not None:
+        similarity_outcomes["context"] += 1
+
+    result = await legal_analyst_agent.run(prompt_with_prior(clause, match))
+    output_json = result.output.model_dump_json()
+    if key is not None:
+        await analysis_cache.aput(key, output_json)
+    remember_analysis(clause, output_json)
+    return result.output, False
+
+
+async def stream_clause_fan_out(contract: str):
+    """
+    Splits the contract into clauses and analyzes them concurrently (at most CLAUSE_CONCURRENCY at once).
+    Each clause is sent as a `clause_result` event as soon as it finishes, then the merged `final_result`.
+    """
+    stats = StreamStats(mode="clauses")
+    clauses = split_into_clauses(contract)
+    semaphore = asyncio.Semaphore(CLAUSE_CONCURRENCY)
+
+    async def analyze(index: int, clause: str) -> dict:
+        async with semaphore:
+            try:
+                analysis, cache_hit = await analyze_single_clause(clause)
+                return {"clause_index": index, "analysis": analysis, "cache_hit": cache_hit}
+            except Exception as e:
+                # One bad clause should not sink the whole contract
+                return {"clause_index": index, "error": str(e)}
+
+    yield stats.record(f"event: clauses\ndata: {json.dumps({'count': len(clauses)})}\n\n")
+
+    # The whole contract counts as one analysis against the server-wide limit
+    try:
+        await analysis_slots.acquire()
+    except asyncio.CancelledError:
+        cancellation_stats.record_dropped()
+        raise
+
+    tasks = [asyncio.create_task(analyze(index, clause)) for index, clause in enumerate(clauses)]
+    results: list[tuple[int, ContractAnalysis]] = []
+    failed: list[int] = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            outcome = await next_done
+            if "error" in outcome:
+                failed.append(outcome["clause_index"])
+                yield stats.record(f"event: clause_error\ndata: {json.dumps(outcome)}\n\n")
+                continue
+
+            results.append((outcome["clause_index"], outcome["analysis"]))
+            payload = {**outcome, "analysis": outcome["analysis"].model_dump(mode="json")}
+            yield stats.record(f"event: clause_result\ndata: {json.dumps(payload)}\n\n")
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client disconnected: counted like a single stream, with the clauses finished so far as the output
+        done = merge_analyses(results, ContractAnalysis).model_dump_json() if results else None
+        cancellation_stats.record_cancelled(done)
+        raise
+    finally:
+        analysis_slots.release()
+        # If the client went away, stop the clauses that have not finished yet
+        for task in tasks:
+            task.cancel()
+
+    failed.sort()
+    if not results:
+        # Nothing to merge: an empty analysis with a risk score of 0 would read as "no risk"
+        error = {"error": "Every clause failed to analyze", "failed_clauses": failed}
+        yield stats.record(f"event: error\ndata: {json.dumps(error)}\n\n")
+        record_stream_stats(stats)
+        return
+
+    # Max risk score, deduped flagged items, summaries in contract order
+    final_result = merge_analyses(results, ContractAnalysis, failed)
+    await db.save_analysis(contract, final_result)
+    # The client must not mistake a partial analysis for the whole contract
+    payload = {**final_result.model_dump(mode="json"), "partial": bool(failed), "failed_clauses": failed}
+    cancellation_stats.record_completed(final_result.model_dump_json())
+    yield stats.record(f"event: final_result\ndata: {json.dumps(payload)}\n\n")
+    record_stream_stats(stats)
+
+
+def record_stream_stats(stats: StreamStats):
+    summary = stats.finish()
+    recent_stream_stats.append(summary)
+    print(f"📊 STREAM: {summary['mode']} | cache hit: {summary['cache_hit']} | {summary['bytes_sent']} bytes | "
+          f"{summary['events']} events | {summary['events_per_second']} events/s")
 
 # --- 7. The Endpoint ---
 class AnalysisRequest(BaseModel):
     contract_clause: str
+    # "snapshot": every partial is the full analysis so far
+    # "delta": JSON-Patch style changes plus a periodic full snapshot
+    stream_mode: Literal["snapshot", "delta"] = "snapshot"
+    # Split a long contract into clauses and analyze them in parallel
+    split_clauses: bool = False
 
 @app.post("/analyze-stream")
-async def analyze_clause(request: AnalysisRequest):
-    return StreamingResponse(
-        stream_contract_analysis(request.contract_clause),
-        media_type="text/event-stream",
-        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} #To reduce buffering issues
-    )
+async def analyze_clause(request: AnalysisRequest, http_request: Request):
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} #To reduce buffering issues
+
+    def respond(buffer: StreamBuffer, after: int = 0) -> StreamingResponse:
+        # The client reads the buffer; its disconnect only stops the agent if it does not come back in time
+        headers["X-Stream-Id"] = buffer.stream_id
+        return StreamingResponse(
+            cancel_on_disconnect(http_request, replay_registry.attach(buffer, after), DISCONNECT_POLL_MS / 1000),
+            media_type="text/event-stream",
+            headers=headers
+        )
+
+    # A reconnect: continue the analysis we already have instead of starting a new one
+    last_event_id = http_request.headers.get("last-event-id")
+    if last_event_id:
+        resumed = replay_registry.resume(last_event_id)
+        if resumed is not None:
+            headers["X-Stream-Resumed"] = "true"
+            return respond(*resumed)
+
+    if request.split_clauses:
+        # Each clause uses the analysis cache on its own
+        return respond(replay_registry.start(stream_clause_fan_out(request.contract_clause)))
+
+    key = None
+    if analysis_cache is not None:
+        key = cache_key(request.contract_clause, SYSTEM_PROMPT, model.model_name)
+        cached = await analysis_cache.aget(key)
+        # Tell the client (and any proxy logs) whether this response came from the cache
+        headers["X-Analysis-Cache"] = "HIT" if cached else "MISS"
+        if cached:
+            return respond(replay_registry.start(
+                replay_cached_analysis(request.contract_clause, request.stream_mode, cached)
+            ))
+
+    # Not the same clause, but maybe the same clause with other parties, dates or amounts
+    match = find_similar(request.contract_clause)
+    if match is not None:
+        headers["X-Similarity"] = f"{match.score:.2f}"
+        if can_reuse(request.contract_clause, match):
+            similarity_outcomes["reused"] += 1
+            headers["X-Analysis-Cache"] = "SIMILAR"
+            return respond(replay_registry.start(
+                replay_cached_analysis(request.contract_clause, request.stream_mode, match.payload[1], save=False)
+            ))
+        similarity_outcomes["context"] += 1
+
+    return respond(replay_registry.start(
+        stream_contract_analysis(request.contract_clause, request.stream_mode, key, prior=match)
+    ))
+
+@app.get("/stream-stats")
+async def stream_stats():
+    """ Bytes sent and events/sec per stream (averaged per mode), cache usage and the save queue """
+    per_mode = {}
+    for mode in ("snapshot", "delta"):
+        streams = [s for s in recent_stream_stats if s["mode"] == mode and not s["cache_hit"]]
+        if streams:
+            per_mode[mode] = {
+                "streams": len(streams),
+                "avg_bytes_sent": round(sum(s["bytes_sent"] for s in streams) / len(streams)),
+                "avg_events_per_second": round(sum(s["events_per_second"] for s in streams) / len(streams), 2),
+            }
+    return {
+        "per_mode": per_mode,
+        "cache": analysis_cache.snapshot() if analysis_cache is not None else None,
+        "database": db.snapshot(),
+        "cancellation": cancellation_stats.snapshot(),
+        "replay": replay_registry.snapshot(),
+        "similarity": (
+            {**similarity_index.snapshot(), **similarity_outcomes} if similarity_index is not None else None
+        ),
+        "recent": list(recent_stream_stats),
+    }
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
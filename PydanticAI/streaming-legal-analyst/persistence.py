@@ -0,0 +1,161 @@
+"""
+Write-behind persistence for finished analyses.
+
+`save_analysis` only puts the analysis on an in-memory queue, so the SSE
+stream never waits on disk I/O. A background flusher writes the queue to
+SQLite in batched transactions, when `batch_size` analyses are waiting or
+`flush_interval` seconds have passed, whichever comes first.
+- Backpressure: when the queue is full, `save_analysis` waits for room
+- Shutdown: `close()` stops the flusher only after the queue is drained
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from contextlib import closing
+
+from pydantic import BaseModel
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS saved_analyses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    clause TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    risk_score INTEGER NOT NULL,
+    flagged_items TEXT NOT NULL, -- JSON list
+    created_at REAL NOT NULL
+);
+"""
+
+INSERT_ANALYSIS = (
+    "INSERT INTO saved_analyses (clause, summary, risk_score, flagged_items, created_at) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+
+# The latest analysis of each distinct clause, newest first
+SELECT_LATEST_ANALYSES = (
+    "SELECT clause, summary, risk_score, flagged_items FROM saved_analyses "
+    "WHERE id IN (SELECT MAX(id) FROM saved_analyses GROUP BY clause) ORDER BY id DESC LIMIT ?"
+)
+
+
+class Database:
+    """ SQLite case-management store behind a write-behind queue """
+
+    def __init__(self, path: str, max_queue: int = 1000, batch_size: int = 100, flush_interval: float = 0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue[tuple] = asyncio.Queue(maxsize=max_queue)
+        self._flusher: asyncio.Task | None = None
+        self._closing = False
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+        # Metrics
+        self.enqueued = 0
+        self.flushed = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_queue_depth_seen = 0
+        self.backpressure_waits = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def start(self) -> None:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def save_analysis(self, clause: str, analysis: BaseModel) -> bool:
+        """ Queues the analysis for the next batch. Only waits if the queue is full """
+        if self._closing:
+            raise RuntimeError("Database is shutting down")
+        self.start()
+
+        row = (clause, analysis.summary, analysis.risk_score, json.dumps(analysis.flagged_items), time.time())
+        if self._queue.full():
+            self.backpressure_waits += 1
+        await self._queue.put(row)
+
+        self.enqueued += 1
+        self.max_queue_depth_seen = max(self.max_queue_depth_seen, self._queue.qsize())
+        return True
+
+    async def _flush_loop(self) -> None:
+        while True:
+            # Wait for the first row, then give the batch `flush_interval` to fill up
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                self.failed += len(batch)
+                print(f"💾 DATABASE: Failed to save {len(batch)} analyses: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: list[tuple]) -> None:
+        started = time.perf_counter()
+        with self._conn:  # One transaction per batch
+            self._conn.executemany(INSERT_ANALYSIS, batch)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        self.flushed += len(batch)
+        self.batches += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+        print(f"💾 DATABASE: Saved {len(batch)} analyses in {elapsed_ms:.1f} ms")
+
+    def load_analyses(self, limit: int) -> list[tuple[str, dict]]:
+        """ (clause, analysis fields) of the latest `limit` distinct clauses. Reads on its own connection """
+        with closing(sqlite3.connect(self.path)) as conn:
+            rows = conn.execute(SELECT_LATEST_ANALYSES, (limit,)).fetchall()
+        return [
+            (clause, {"summary": summary, "risk_score": risk_score, "flagged_items": json.loads(flagged_items)})
+            for clause, summary, risk_score, flagged_items in rows
+        ]
+
+    async def close(self) -> None:
+        """ Drains the queue, then stops the flusher """
+        self._closing = True
+        if self._flusher is not None:
+            await self._queue.join()
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        self._conn.close()
+
+    def snapshot(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            # Queued or in the batch being written
+            "pending": self.enqueued - self.flushed - self.failed,
+            "max_queue_depth_seen": self.max_queue_depth_seen,
+            "queue_capacity": self._queue.maxsize,
+            "backpressure_waits": self.backpressure_waits,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self._total_flush_ms / self.batches, 2) if self.batches else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
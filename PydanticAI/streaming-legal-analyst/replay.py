@@ -0,0 +1,163 @@
+"""
+Resumable SSE streams.
+
+Each analysis runs in a background task that writes its events into a
+`StreamBuffer`, numbered as `id: <stream_id>:<n>`. Clients read from the
+buffer rather than from the agent directly, so a client that reconnects with
+`Last-Event-ID: <stream_id>:<n>` gets events n+1... of the SAME analysis
+(still running or already finished) without the agent being invoked again.
+
+- Finished buffers are kept for `ttl` seconds
+- The buffers together stay under `max_bytes`: the oldest finished ones are evicted first
+- A running analysis nobody is listening to is cancelled after `grace` seconds,
+  long enough for a flaky mobile client to come back
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncGenerator
+
+
+class StreamBuffer:
+    """ The numbered events of one analysis """
+
+    def __init__(self, stream_id: str):
+        self.stream_id = stream_id
+        self.events: list[str] = []
+        self.size_bytes = 0
+        self.done = False
+        self.finished_at: float | None = None
+        self.subscribers = 0
+        self.producer: asyncio.Task | None = None
+        self.pending_cancel: asyncio.TimerHandle | None = None
+        self._changed = asyncio.Event()
+
+    def append(self, chunk: str) -> None:
+        framed = f"id: {self.stream_id}:{len(self.events) + 1}\n{chunk}"
+        self.events.append(framed)
+        self.size_bytes += len(framed)
+        self._notify()
+
+    def finish(self) -> None:
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self) -> None:
+        # Wake every waiting subscriber, then arm a fresh event for the next change
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def read(self, after: int) -> AsyncGenerator[str, None]:
+        """ Events numbered > `after`, then live events until the analysis is done """
+        position = after
+        while True:
+            while position < len(self.events):
+                position += 1
+                yield self.events[position - 1]
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+class ReplayRegistry:
+    def __init__(self, max_bytes: int, ttl: float, grace: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.grace = grace
+        self._buffers: OrderedDict[str, StreamBuffer] = OrderedDict()
+
+        self.streams_started = 0
+        self.reconnects_served = 0
+        self.events_replayed = 0
+        self.evictions = 0
+
+    def start(self, source: AsyncGenerator[str, None]) -> StreamBuffer:
+        """ Runs `source` in the background, recording its events in a new buffer """
+        self._enforce_limits()
+        buffer = StreamBuffer(uuid.uuid4().hex)
+        buffer.producer = asyncio.create_task(self._produce(buffer, source))
+        self._buffers[buffer.stream_id] = buffer
+        self.streams_started += 1
+        return buffer
+
+    async def _produce(self, buffer: StreamBuffer, source: AsyncGenerator[str, None]) -> None:
+        try:
+            async for chunk in source:
+                buffer.append(chunk)
+        except Exception as e:
+            # The agent failed: tell the client instead of silently cutting the stream
+            buffer.append(f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n")
+        finally:
+            await source.aclose()
+            buffer.finish()
+            self._enforce_limits()
+
+    def resume(self, last_event_id: str) -> tuple[StreamBuffer, int] | None:
+        """ Parses `<stream_id>:<n>`. Returns the buffer and n, or None if the stream is unknown / gone """
+        stream_id, _, number = last_event_id.strip().rpartition(":")
+        if not number.isdigit():
+            return None
+        self._enforce_limits()
+        buffer = self._buffers.get(stream_id)
+        if buffer is None:
+            return None
+
+        after = min(int(number), len(buffer.events))
+        self.reconnects_served += 1
+        self.events_replayed += len(buffer.events) - after
+        return buffer, after
+
+    async def attach(self, buffer: StreamBuffer, after: int = 0) -> AsyncGenerator[str, None]:
+        """ One client reading the buffer. When the last client leaves, the analysis gets `grace` seconds """
+        if buffer.pending_cancel is not None:
+            buffer.pending_cancel.cancel()
+            buffer.pending_cancel = None
+        buffer.subscribers += 1
+        try:
+            async for event in buffer.read(after):
+                yield event
+        finally:
+            buffer.subscribers -= 1
+            if buffer.subscribers == 0 and not buffer.done and buffer.producer is not None:
+                if self.grace > 0:
+                    loop = asyncio.get_running_loop()
+                    buffer.pending_cancel = loop.call_later(self.grace, self._cancel_if_abandoned, buffer)
+                else:
+                    buffer.producer.cancel()
+
+    def _cancel_if_abandoned(self, buffer: StreamBuffer) -> None:
+        buffer.pending_cancel = None
+        if buffer.subscribers == 0 and buffer.producer is not None:
+            buffer.producer.cancel()
+
+    def _enforce_limits(self) -> None:
+        now = time.monotonic()
+        for stream_id, buffer in list(self._buffers.items()):
+            if buffer.done and now - buffer.finished_at > self.ttl:
+                del self._buffers[stream_id]
+
+        # Over the memory cap: drop finished streams, oldest first (running ones are never evicted)
+        total = sum(buffer.size_bytes for buffer in self._buffers.values())
+        for stream_id, buffer in list(self._buffers.items()):
+            if total <= self.max_bytes:
+                break
+            if buffer.done:
+                del self._buffers[stream_id]
+                total -= buffer.size_bytes
+                self.evictions += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "buffered_streams": len(self._buffers),
+            "running_streams": sum(1 for buffer in self._buffers.values() if not buffer.done),
+            "buffered_bytes": sum(buffer.size_bytes for buffer in self._buffers.values()),
+            "max_bytes": self.max_bytes,
+            "streams_started": self.streams_started,
+            "reconnects_served": self.reconnects_served,
+            "events_replayed": self.events_replayed,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,232 @@
+"""
+Near-duplicate clause index.
+
+Many clauses differ from one we already analyzed only in the party names,
+dates or amounts. We mask those, cut the clause into word shingles and keep a
+MinHash signature per clause. Locality-sensitive hashing (banding) finds the
+candidates: a clause lands in the same bucket as any indexed clause that
+agrees with it on all the rows of at least one band. Only the candidates are
+scored, so a lookup stays in the milliseconds at 1M indexed clauses.
+
+Everything lives in NumPy arrays in memory:
+- signatures: one row of `num_perm` uint16 per clause (the low bits of each MinHash)
+- buckets: the (band key, clause id) pairs, sorted by key, searched with `searchsorted`
+  New clauses go into a small dict first and are merged into the sorted arrays in batches.
+"""
+
+import re
+import time
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+import numpy as np
+
+MERSENNE_PRIME = (1 << 31) - 1
+
+# "Acme Holdings Inc.", "Globex LLC"... (before lowercasing, so we can see the capitals)
+PARTY = re.compile(
+    r"\b(?:[A-Z][\w&'-]*\s+){1,4}(?:Inc|LLC|LLP|Ltd|Limited|Corp|Corporation|Co|GmbH|plc|S\.A|N\.V)\b\.?"
+)
+# Amounts, dates, percentages, section numbers: "$1,250,000", "12/31/2025", "30"
+NUMBER = re.compile(r"\d[\d,./-]*")
+WORD = re.compile(r"[a-z#@]+")
+
+# A bucket shared by many clauses (boilerplate) is only scanned this far
+MAX_BUCKET_SCAN = 256
+
+
+def masked_words(clause: str) -> list[str]:
+    """ The clause's words, lowercased, with party names replaced by "@" and numbers by "#" """
+    return WORD.findall(NUMBER.sub(" # ", PARTY.sub(" @ ", clause)).lower())
+
+
+def same_masked_text(clause: str, other: str) -> bool:
+    """
+    Whether the two clauses differ only in party names and numbers. A high similarity
+    score is not enough to reuse an analysis: "shall" vs "shall not" is one word.
+    """
+    return masked_words(clause) == masked_words(other)
+
+
+def shingles(clause: str, size: int = 3) -> np.ndarray:
+    """ Hashes of the word `size`-grams, with party names and numbers masked """
+    words = masked_words(clause)
+    if len(words) < size:
+        return np.empty(0, dtype=np.uint64)
+    grams = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(gram.encode()) & MERSENNE_PRIME for gram in grams), dtype=np.uint64)
+
+
+@dataclass
+class SimilarMatch:
+    score: float  # Estimated Jaccard similarity of the masked shingles, 0..1
+    clause_id: int
+    payload: Any
+
+
+class SimilarityIndex:
+    def __init__(self, num_perm: int = 64, bands: int = 16, shingle_size: int = 3, capacity: int = 1_000_000):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.capacity = capacity
+
+        # Fixed seed: the same clause always gets the same signature
+        rng = np.random.default_rng(1)
+        self._a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self._row_mix = rng.integers(1, 1 << 63, self.rows, dtype=np.uint64) | np.uint64(1)
+        self._band_salt = rng.integers(0, 1 << 63, bands, dtype=np.uint64)
+
+        self._signatures = np.empty((0, num_perm), dtype=np.uint16)
+        self._payloads: list[Any] = []
+        self._size = 0
+
+        # Sorted buckets, plus the ones added since the last merge
+        self._keys = np.empty(0, dtype=np.uint64)
+        self._ids = np.empty(0, dtype=np.int32)
+        self._pending: dict[int, list[int]] = {}
+        self._pending_pairs = 0
+
+        # Metrics
+        self.queries = 0
+        self.matches = 0
+        self.skipped = 0  # Not indexed: too short, or the index is full
+        self._latencies_ms: deque[float] = deque(maxlen=1000)
+        self._candidates: deque[int] = deque(maxlen=1000)
+
+    def __len__(self) -> int:
+        return self._size
+
+    # --- Signatures ---
+    def signature(self, clause: str) -> np.ndarray | None:
+        """ The full 31-bit MinHash signature, or None if the clause is too short to compare """
+        hashes = shingles(clause, self.shingle_size)
+        if not hashes.size:
+            return None
+        return ((hashes[:, None] * self._a + self._b) % MERSENNE_PRIME).min(axis=0)
+
+    def _band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """ (n, num_perm) signatures -> (n, bands) bucket keys """
+        rows = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        # Wrapping uint64 arithmetic is the point here
+        with np.errstate(over="ignore"):
+            return (rows * self._row_mix).sum(axis=2) ^ self._band_salt
+
+    # --- Writes ---
+    def add(self, clause: str, payload: Any = None) -> int | None:
+        return self.add_many([(clause, payload)])[0]
+
+    def add_many(self, items: Iterable[tuple[str, Any]]) -> list[int | None]:
+        """ Indexes (clause, payload) pairs. Returns the clause ids (None when not indexed) """
+        signatures, payloads, ids = [], [], []
+        for clause, payload in items:
+            signature = self.signature(clause)
+            if signature is None or self._size + len(signatures) >= self.capacity:
+                self.skipped += 1
+                ids.append(None)
+                continue
+            ids.append(self._size + len(signatures))
+            signatures.append(signature)
+            payloads.append(payload)
+        if signatures:
+            self._append(np.stack(signatures), payloads)
+        return ids
+
+    def _append(self, signatures: np.ndarray, payloads: list[Any]) -> None:
+        first_id = self._size
+        count = len(signatures)
+        if first_id + count > len(self._signatures):
+            grown = np.empty((max(first_id + count, 2 * len(self._signatures), 1024), self.num_perm), np.uint16)
+            grown[:first_id] = self._signatures[:first_id]
+            self._signatures = grown
+        self._signatures[first_id:first_id + count] = signatures & 0xFFFF
+        self._payloads.extend(payloads)
+        self._size += count
+
+        keys = self._band_keys(signatures)
+        if count > 1024:
+            # Bulk load: straight into the sorted arrays
+            self._merge(keys.ravel(), np.repeat(np.arange(first_id, first_id + count, dtype=np.int32), self.bands))
+            return
+
+        for offset, row in enumerate(keys.tolist()):
+            for key in row:
+                self._pending.setdefault(key, []).append(first_id + offset)
+        self._pending_pairs += keys.size
+        # Merging costs O(index size), so wait until the pending part is a fair share of it
+        if self._pending_pairs > max(4096, len(self._keys) // 16):
+            self._flush_pending()
+
+    def _flush_pending(self) -> None:
+        keys = np.fromiter((key for key, ids in self._pending.items() for _ in ids), dtype=np.uint64)
+        ids = np.fromiter((clause_id for ids in self._pending.values() for clause_id in ids), dtype=np.int32)
+        self._pending.clear()
+        self._pending_pairs = 0
+        self._merge(keys, ids)
+
+    def _merge(self, keys: np.ndarray, ids: np.ndarray) -> None:
+        order = np.argsort(keys, kind="stable")
+        keys, ids = keys[order], ids[order]
+        positions = np.searchsorted(self._keys, keys, side="right")
+        self._keys = np.insert(self._keys, positions, keys)
+        self._ids = np.insert(self._ids, positions, ids)
+
+    # --- Reads ---
+    def query(self, clause: str, min_score: float = 0.0) -> SimilarMatch | None:
+        """ The most similar indexed clause, if its estimated similarity is at least `min_score` """
+        started = time.perf_counter()
+        self.queries += 1
+        match = None
+        signature = self.signature(clause)
+        if signature is not None and self._size:
+            match = self._best_match(signature, min_score)
+        self._latencies_ms.append((time.perf_counter() - started) * 1000)
+        if match is not None:
+            self.matches += 1
+        return match
+
+    def _best_match(self, signature: np.ndarray, min_score: float) -> SimilarMatch | None:
+        keys = self._band_keys(signature[None, :])[0]
+        starts = np.searchsorted(self._keys, keys, side="left")
+        ends = np.minimum(np.searchsorted(self._keys, keys, side="right"), starts + MAX_BUCKET_SCAN)
+        found = [self._ids[start:end] for start, end in zip(starts, ends) if end > start]
+        for key in keys.tolist():
+            if key in self._pending:
+                found.append(np.asarray(self._pending[key][:MAX_BUCKET_SCAN], dtype=np.int32))
+        if not found:
+            self._candidates.append(0)
+            return None
+
+        candidates = np.unique(np.concatenate(found))
+        self._candidates.append(len(candidates))
+        # Fraction of equal MinHash values estimates the Jaccard similarity
+        scores = (self._signatures[candidates] == (signature & 0xFFFF).astype(np.uint16)).mean(axis=1)
+        best = int(np.argmax(scores))
+        if scores[best] < min_score:
+            return None
+        clause_id = int(candidates[best])
+        return SimilarMatch(score=float(scores[best]), clause_id=clause_id, payload=self._payloads[clause_id])
+
+    def snapshot(self) -> dict:
+        latencies = sorted(self._latencies_ms)
+
+        def percentile(p: float) -> float:
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3) if latencies else 0.0
+
+        return {
+            "indexed": self._size,
+            "capacity": self.capacity,
+            "skipped": self.skipped,
+            "queries": self.queries,
+            "matches": self.matches,
+            "lookup_ms_p50": percentile(0.5),
+            "lookup_ms_p99": percentile(0.99),
+            "avg_candidates": round(sum(self._candidates) / len(self._candidates), 1) if self._candidates else 0.0,
+            "index_bytes": self._signatures[:self._size].nbytes + self._keys.nbytes + self._ids.nbytes,
+        }
@@ -0,0 +1,109 @@
+"""
+Delta encoding for the partial results of the SSE stream.
+
+In "snapshot" mode every partial re-sends the whole ContractAnalysis, so a
+long analysis costs quadratic bytes. In "delta" mode we only send what
+changed since the previous event, as JSON-Patch style operations:
+- {"op": "append", "path": "/summary", "value": " more text"}   (text grew)
+- {"op": "add", "path": "/flagged_items/-", "value": "..."}      (list grew)
+- {"op": "add" | "replace" | "remove", "path": "/risk_score", "value": 7}
+"append" is our own op (not in RFC 6902): append `value` to the string at `path`.
+
+Every `snapshot_every` events a full snapshot is sent instead, so a client
+that missed or misapplied a patch re-syncs quickly.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+
+def _pointer(path: str, key: str | int) -> str:
+    # RFC 6901 escaping of a JSON pointer token
+    return f"{path}/{str(key).replace('~', '~0').replace('/', '~1')}"
+
+
+def diff(prev: Any, cur: Any, path: str = "") -> list[dict]:
+    """ The operations that turn `prev` into `cur` """
+    if prev == cur:
+        return []
+
+    if isinstance(prev, str) and isinstance(cur, str) and cur.startswith(prev):
+        return [{"op": "append", "path": path, "value": cur[len(prev):]}]
+
+    if isinstance(prev, dict) and isinstance(cur, dict):
+        ops = []
+        for key, value in cur.items():
+            if key not in prev:
+                ops.append({"op": "add", "path": _pointer(path, key), "value": value})
+            else:
+                ops.extend(diff(prev[key], value, _pointer(path, key)))
+        for key in prev:
+            if key not in cur:
+                ops.append({"op": "remove", "path": _pointer(path, key)})
+        return ops
+
+    if isinstance(prev, list) and isinstance(cur, list) and len(cur) >= len(prev):
+        ops = []
+        for index, (old, new) in enumerate(zip(prev, cur)):
+            if old == new:
+                continue
+            # Only the last item may still be growing; anything else means the list was rewritten
+            if index != len(prev) - 1 or not (isinstance(old, str) and isinstance(new, str) and new.startswith(old)):
+                return [{"op": "replace", "path": path, "value": cur}]
+            ops.append({"op": "append", "path": _pointer(path, index), "value": new[len(old):]})
+        ops.extend({"op": "add", "path": f"{path}/-", "value": value} for value in cur[len(prev):])
+        return ops
+
+    return [{"op": "replace", "path": path, "value": cur}]
+
+
+class DeltaEncoder:
+    """ Turns successive partial results into "snapshot" / "patch" events """
+
+    def __init__(self, snapshot_every: int = 20):
+        self.snapshot_every = snapshot_every
+        self._previous: dict | None = None
+        self._events_since_snapshot = 0
+
+    def encode(self, current: dict) -> tuple[str, Any] | None:
+        """ Returns (event name, payload), or None if nothing changed """
+        if self._previous is None or self._events_since_snapshot >= self.snapshot_every:
+            self._previous = current
+            self._events_since_snapshot = 1
+            return "snapshot", current
+
+        ops = diff(self._previous, current)
+        if not ops:
+            return None
+        self._previous = current
+        self._events_since_snapshot += 1
+        return "patch", ops
+
+
+@dataclass
+class StreamStats:
+    """ Bytes and events sent on one SSE stream """
+    mode: str
+    cache_hit: bool = False
+    started: float = field(default_factory=time.perf_counter)
+    bytes_sent: int = 0
+    events: int = 0
+    finished: float | None = None
+
+    def record(self, chunk: str) -> str:
+        self.bytes_sent += len(chunk.encode("utf-8"))
+        self.events += 1
+        return chunk
+
+    def finish(self) -> dict:
+        self.finished = time.perf_counter()
+        duration = self.finished - self.started
+        return {
+            "mode": self.mode,
+            "cache_hit": self.cache_hit,
+            "bytes_sent": self.bytes_sent,
+            "events": self.events,
+            "duration_seconds": round(duration, 3),
+            "events_per_second": round(self.events / duration, 2) if duration > 0 else 0.0,
+        }
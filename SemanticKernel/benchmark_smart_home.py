@@ -0,0 +1,142 @@
+"""
+Benchmark: wall-clock time of multi-step smart home requests, blocking vs async device actions.
+
+- "blocking": the first version of the plugin, with each action a blocking IoT call
+  (time.sleep), so the Kernel runs the model's function calls one after another
+- "async": `SmartHomePlugin` from smart-home-bot.py, on the simulated-latency `DeviceBackend`:
+  the calls of one model response are sent in a single hub call, and commands that
+  would not change a device (per the plugin's state shadow) are not sent at all.
+  One plugin serves all the scenarios, so its shadow carries over from one to the next
+
+The model is an offline stand-in that answers the request with the scenario's function
+calls (all in one response), then with a final message. Everything else is the real
+Kernel auto function calling path.
+
+Run: python benchmark_smart_home.py --latency 0.3
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import time
+from pathlib import Path
+
+from semantic_kernel import Kernel
+from semantic_kernel.connectors.ai.function_choice_behavior import FunctionChoiceBehavior
+from semantic_kernel.connectors.ai.google.google_ai.google_ai_prompt_execution_settings import GoogleAIPromptExecutionSettings
+from semantic_kernel.connectors.ai.google.google_ai.services.google_ai_chat_completion import GoogleAIChatCompletion
+from semantic_kernel.contents import AuthorRole, ChatHistory, ChatMessageContent, FunctionCallContent
+from semantic_kernel.functions import kernel_function
+
+# smart-home-bot.py is a script (hyphenated name): load it by path
+spec = importlib.util.spec_from_file_location("smart_home_bot", Path(__file__).with_name("smart-home-bot.py"))
+smart_home_bot = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(smart_home_bot)
+
+SCENARIOS = {
+    # "I'm going to bed. Make the bedroom 20 degrees, lights off everywhere."
+    "bedtime (4 devices)": [
+        ("set_temperature", {"room_name": "bedroom", "degrees": 20}),
+        ("turn_off_lights", {"room_name": "bedroom"}),
+        ("turn_off_lights", {"room_name": "living room"}),
+        ("turn_off_lights", {"room_name": "kitchen"}),
+    ],
+    # Two commands for the kitchen lights in one response: only the last one matters
+    "kitchen (2 devices)": [
+        ("turn_on_lights", {"room_name": "kitchen"}),
+        ("turn_off_lights", {"room_name": "kitchen"}),
+        ("set_temperature", {"room_name": "kitchen", "degrees": 18}),
+    ],
+    # The same again: every device is already in that state
+    "bedtime, repeated": [
+        ("set_temperature", {"room_name": "bedroom", "degrees": 20}),
+        ("turn_off_lights", {"room_name": "bedroom"}),
+        ("turn_off_lights", {"room_name": "living room"}),
+        ("turn_off_lights", {"room_name": "kitchen"}),
+    ],
+}
+
+
+class BlockingSmartHomePlugin:
+    """ The previous plugin, with each action a blocking IoT call """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    @kernel_function(description="Turns on the lights in a specific room", name="turn_on_lights")
+    def turn_on_light(self, room_name: str) -> str:
+        time.sleep(self.latency)
+        return f"Turned on the lights in {room_name}"
+
+    @kernel_function(description="Turns off the lights in a specific room", name="turn_off_lights")
+    def turn_off_light(self, room_name: str) -> str:
+        time.sleep(self.latency)
+        return f"Turned off the lights in {room_name}"
+
+    @kernel_function(description="Sets the thermostat temperature", name="set_temperature")
+    def set_temperature(self, room_name: str, degrees: int) -> str:
+        time.sleep(self.latency)
+        return f"Set the temperature to {degrees} degrees Celsius in {room_name}"
+
+
+class RecordingBackend(smart_home_bot.DeviceBackend):
+    """ Keeps the hub calls """
+
+    def __init__(self, latency: float):
+        super().__init__(latency)
+        self.log: list[dict] = []
+
+    async def send_batch(self, commands: dict) -> None:
+        await super().send_batch(commands)
+        self.log.append(commands)
+
+
+class ScriptedModel(GoogleAIChatCompletion):
+    """ Asks for all the scenario's function calls at once, then answers """
+
+    calls: list = []
+
+    async def _inner_get_chat_message_contents(self, chat_history, settings):
+        if chat_history.messages[-1].role == AuthorRole.USER:
+            items = [
+                FunctionCallContent(id=f"call_{i}", plugin_name="SmartHome", function_name=name, arguments=arguments)
+                for i, (name, arguments) in enumerate(self.calls)
+            ]
+            return [ChatMessageContent(role=AuthorRole.ASSISTANT, items=items)]
+        return [ChatMessageContent(role=AuthorRole.ASSISTANT, content="All done.")]
+
+
+async def run_request(plugin, calls) -> float:
+    kernel = Kernel()
+    service = ScriptedModel(service_id="gemini-chat", gemini_model_id="stand-in", api_key="offline")
+    service.calls = calls
+    kernel.add_service(service)
+    kernel.add_plugin(plugin, plugin_name="SmartHome")
+    settings = GoogleAIPromptExecutionSettings(
+        service_id="gemini-chat", function_choice_behavior=FunctionChoiceBehavior.Auto()
+    )
+    history = ChatHistory()
+    history.add_user_message("Please do it")
+
+    start = time.perf_counter()
+    await service.get_chat_message_content(chat_history=history, settings=settings, kernel=kernel)
+    return time.perf_counter() - start
+
+
+async def main_async(args) -> None:
+    backend = RecordingBackend(args.latency)
+    plugin = smart_home_bot.SmartHomePlugin(backend)
+    for label, calls in SCENARIOS.items():
+        blocking = await run_request(BlockingSmartHomePlugin(args.latency), calls)
+        hub_calls = len(backend.log)
+        concurrent = await run_request(plugin, calls)
+        print(f"{label:<20} {len(calls)} calls  blocking {blocking * 1000:6.0f} ms  async {concurrent * 1000:6.0f} ms  "
+              f"({blocking / concurrent:.1f}x)  hub calls: {backend.log[hub_calls:] or 'none'}")
+    print(f"async plugin: {plugin.stats}")
+    print(plugin.get_device_state())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds per device command")
+    asyncio.run(main_async(parser.parse_args()))
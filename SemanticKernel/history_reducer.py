@@ -0,0 +1,223 @@
+"""
+Token-budgeted chat history, shared by the Semantic Kernel samples.
+
+A plain `ChatHistory` grows forever, and every turn resends all of it. This one
+keeps the system message and the most recent turns within `max_tokens`:
+
+- once the history is over budget, the oldest turns are removed until it is
+  down to `reduce_to` of the budget (so the next few turns need no reduction)
+- a turn is a user message and everything after it up to the next user message
+  (function calls, their results, the answer), so a function call is never
+  separated from its result
+- with a `service`, the removed turns are folded into a rolling summary, kept in
+  the system message (Gemini accepts a single system message); without one they
+  are simply dropped
+
+Tokens are estimated locally (no API call): about 4 characters per token, plus a
+few tokens per message. Pass `token_counter` to use a real tokenizer instead.
+
+Usage:
+    history = TokenBudgetChatHistory(max_tokens=2000, service=gemini_service)
+    history.add_system_message("...")
+    history.add_user_message(user_input)
+    await history.reduce()
+    print(history.last_report)
+"""
+
+import logging
+import math
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from pydantic import Field, PrivateAttr
+from semantic_kernel.connectors.ai.chat_completion_client_base import ChatCompletionClientBase
+from semantic_kernel.contents import AuthorRole, ChatHistory, ChatMessageContent
+from semantic_kernel.contents.function_call_content import FunctionCallContent
+from semantic_kernel.contents.function_result_content import FunctionResultContent
+from semantic_kernel.contents.history_reducer.chat_history_reducer import ChatHistoryReducer
+from semantic_kernel.contents.history_reducer.chat_history_reducer_utils import SUMMARY_METADATA_KEY
+
+logger = logging.getLogger(__name__)
+
+# Kept in the system message's metadata once a summary was appended to it:
+# its own text, and the summary alone
+BASE_CONTENT_METADATA_KEY = "base_content"
+SUMMARY_TEXT_METADATA_KEY = "summary"
+
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators
+
+SUMMARIZATION_INSTRUCTIONS = """
+Summarize the conversation below for the assistant that will continue it, in at most {max_words} words.
+Merge in the earlier summary, if there is one. Keep names, amounts, decisions, actions taken and open
+questions; leave out greetings and small talk. Do not add anything that was not said.
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """ ~4 characters per token: close enough for English text, with no tokenizer to load """
+    return math.ceil(len(text) / 4)
+
+
+def message_text(message: ChatMessageContent) -> str:
+    """ The text of a message, including function calls and results """
+    parts = []
+    for item in message.items:
+        if isinstance(item, FunctionCallContent):
+            parts.append(f"[called {item.name}({item.arguments})]")
+        elif isinstance(item, FunctionResultContent):
+            parts.append(f"[result of {item.name}: {item.result}]")
+        elif getattr(item, "text", None):
+            parts.append(item.text)
+    return " ".join(parts)
+
+
+@dataclass
+class ReductionReport:
+    """ What the last `reduce()` call sent vs the full transcript """
+    tokens_full: int           # The whole conversation so far, as a plain ChatHistory would send it
+    tokens_sent: int           # What is left in the history
+    turns_removed: int = 0     # By this call
+    summarized: bool = False   # Whether this call updated the summary
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_full - self.tokens_sent
+
+    def __str__(self) -> str:
+        return f"{self.tokens_sent} tokens sent, {self.tokens_saved} saved (full transcript: {self.tokens_full})"
+
+
+class TokenBudgetChatHistory(ChatHistoryReducer):
+    """
+    A ChatHistory that reduces itself to a token budget, usable wherever a ChatHistory is expected.
+    `target_count` is the number of recent turns always kept, however large.
+    """
+
+    max_tokens: int = Field(default=4000, gt=0, description="Token budget for the whole history.")
+    reduce_to: float = Field(default=0.6, gt=0, le=1, description="Share of the budget to reduce down to.")
+    target_count: int = Field(default=1, gt=0, description="Recent turns always kept.")
+    service: ChatCompletionClientBase | None = Field(default=None, description="Summarizes the removed turns.")
+    summary_max_tokens: int = Field(default=250, gt=0, description="Size limit of the rolling summary.")
+    token_counter: Callable[[str], int] = Field(default=estimate_tokens, exclude=True)
+
+    last_report: ReductionReport | None = Field(default=None, exclude=True)
+    tokens_saved_total: int = Field(default=0, exclude=True)  # Summed over every reduce() call
+
+    # Tokens of the turns removed so far, to report what the full transcript would cost
+    _removed_tokens: int = PrivateAttr(default=0)
+
+    def count_tokens(self, message: ChatMessageContent) -> int:
+        return self.token_counter(message_text(message)) + MESSAGE_OVERHEAD_TOKENS
+
+    def total_tokens(self) -> int:
+        return sum(self.count_tokens(message) for message in self.messages)
+
+    async def reduce(self) -> "TokenBudgetChatHistory | None":
+        """
+        Reduces the history if it is over budget; returns self if it changed, None otherwise.
+        Call it once per turn, after adding the user message: it also fills `last_report`.
+        """
+        system, turns = self._split()
+        summary_tokens = self._summary_tokens(system)
+        before = self.total_tokens()
+
+        removed: list[ChatMessageContent] = []
+        if before > self.max_tokens:
+            target = self.max_tokens * self.reduce_to
+            if self.service is not None:
+                # Room for the summary the removed turns turn into
+                target -= max(self.summary_max_tokens - summary_tokens, 0)
+            size = before
+            while len(turns) > self.target_count and size > target:
+                turn = turns.pop(0)
+                removed.extend(turn)
+                size -= sum(self.count_tokens(message) for message in turn)
+
+        summarized = False
+        if removed:
+            self._removed_tokens += sum(self.count_tokens(message) for message in removed)
+            if self.service is not None:
+                system, summarized = await self._fold_into_summary(system, removed)
+            self.messages = ([system] if system is not None else []) + [m for turn in turns for m in turn]
+            logger.info("History reduced from %d to %d tokens", before, self.total_tokens())
+
+        sent = self.total_tokens()
+        full = sent - self._summary_tokens(system) + self._removed_tokens
+        self.last_report = ReductionReport(
+            tokens_full=full, tokens_sent=sent, turns_removed=self._count_turns(removed), summarized=summarized
+        )
+        self.tokens_saved_total += self.last_report.tokens_saved
+        return self if removed else None
+
+    # --- Helpers ---
+    def _split(self) -> tuple[ChatMessageContent | None, list[list[ChatMessageContent]]]:
+        """ (system message, the other messages grouped into turns) """
+        system = None
+        turns: list[list[ChatMessageContent]] = []
+        for message in self.messages:
+            if message.role in (AuthorRole.SYSTEM, AuthorRole.DEVELOPER) and system is None:
+                system = message
+            elif message.role == AuthorRole.USER or not turns:
+                turns.append([message])
+            else:
+                turns[-1].append(message)
+        return system, turns
+
+    @staticmethod
+    def _count_turns(messages: list[ChatMessageContent]) -> int:
+        return sum(1 for message in messages if message.role == AuthorRole.USER)
+
+    def _summary_tokens(self, system: ChatMessageContent | None) -> int:
+        """ The part of the system message that is the summary """
+        if system is None or not system.metadata.get(SUMMARY_METADATA_KEY):
+            return 0
+        return self.count_tokens(system) - self.token_counter(system.metadata[BASE_CONTENT_METADATA_KEY])
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """ The longest run of leading words of `text` that `token_counter` puts within `max_tokens` """
+        if self.token_counter(text) <= max_tokens:
+            return text
+        words = text.split(" ")
+        # Binary search on the number of words kept (the count grows with the text)
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.token_counter(" ".join(words[:middle])) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return " ".join(words[:low])
+
+    async def _fold_into_summary(
+        self, system: ChatMessageContent | None, removed: list[ChatMessageContent]
+    ) -> tuple[ChatMessageContent | None, bool]:
+        """ The system message with the removed turns merged into its summary (unchanged on failure) """
+        base = ""
+        previous_summary = ""
+        if system is not None:
+            base = system.metadata.get(BASE_CONTENT_METADATA_KEY, system.content)
+            previous_summary = system.metadata.get(SUMMARY_TEXT_METADATA_KEY, "")
+
+        transcript = "\n".join(f"{message.role.value}: {message_text(message)}" for message in removed)
+        request = ChatHistory()
+        request.add_system_message(SUMMARIZATION_INSTRUCTIONS.format(max_words=int(self.summary_max_tokens * 0.7)))
+        request.add_user_message(
+            (f"Earlier summary:\n{previous_summary}\n\n" if previous_summary else "") + f"Conversation:\n{transcript}"
+        )
+        try:
+            settings = self.service.get_prompt_execution_settings_class()()
+            response = await self.service.get_chat_message_content(chat_history=request, settings=settings)
+            summary = str(response).strip()
+        except Exception as e:
+            # The removed turns are lost, but the conversation goes on
+            logger.warning("History summarization failed: %s", e)
+            return system, False
+
+        # Keep the summary within its limit, whatever the model answered
+        summary = self._truncate(summary, self.summary_max_tokens)
+        content = f"{base.strip()}\n\nSummary of the earlier conversation:\n{summary}".strip()
+        return ChatMessageContent(
+            role=AuthorRole.SYSTEM,
+            content=content,
+            metadata={SUMMARY_METADATA_KEY: True, BASE_CONTENT_METADATA_KEY: base, SUMMARY_TEXT_METADATA_KEY: summary},
+        ), True
@@ -1,29 +1,63 @@
-import asyncio 
+import sys
+import threading
+from dataclasses import dataclass
+from pathlib import Path
 
+from google import genai
 from semantic_kernel import Kernel
+from semantic_kernel.connectors.ai.chat_completion_client_base import ChatCompletionClientBase
 from semantic_kernel.connectors.ai.google.google_ai.services.google_ai_chat_completion import GoogleAIChatCompletion
 from semantic_kernel.connectors.ai.google.google_ai.google_ai_prompt_execution_settings import GoogleAIPromptExecutionSettings
 from semantic_kernel.connectors.ai.function_choice_behavior import FunctionChoiceBehavior
 from semantic_kernel.contents import ChatHistory
+from semantic_kernel.contents.history_reducer.chat_history_reducer import ChatHistoryReducer
 
 # import Modules
 import config
 from plugins.refund_plugin import RefundPlugin
 
-async def get_response_from_agent(user_input: str, chat_history: ChatHistory):
+# The history reducer is shared with the other Semantic Kernel samples, one folder up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from history_reducer import TokenBudgetChatHistory
+
+SYSTEM_PROMPT = (
+    "You are a helpful customer service agent. You can process refunds. "
+    "Always ask for the reason and the amount if not provided."
+)
+
+@dataclass(frozen=True)
+class AgentRuntime:
+    """ Everything a chat turn needs besides the chat history """
+    kernel: Kernel
+    settings: GoogleAIPromptExecutionSettings
+
+
+def build_client() -> genai.Client:
     """
-    Initializes the kernel and processes the user input
+    The Gemini client. Without one, the connector opens a new client (and new connections)
+    for every request; a shared client keeps its HTTP session, per event loop, across turns.
+    """
+    http_options = {"base_url": config.GEMINI_BASE_URL} if config.GEMINI_BASE_URL else None
+    return genai.Client(api_key=config.GOOGLE_API_KEY, http_options=http_options)
+
+
+def build_runtime(service: ChatCompletionClientBase | None = None) -> AgentRuntime:
+    """
+    Builds the Kernel, the AI service (with its own Gemini client), the plugin and the execution settings.
+    This is the costly part (client setup, plugin reflection): do it once, not per message.
     """
 
     # 1. Initialize the Kernel
     kernel = Kernel()
     
     # 2. Add the AI Service
-    service = GoogleAIChatCompletion(
-        service_id = config.SERVICE_ID,
-        gemini_model_id = config.AI_MODEL_ID,
-        api_key = config.GOOGLE_API_KEY
-    )
+    if service is None:
+        service = GoogleAIChatCompletion(
+            service_id = config.SERVICE_ID,
+            gemini_model_id = config.AI_MODEL_ID,
+            api_key = config.GOOGLE_API_KEY,
+            client = build_client()
+        )
     
     kernel.add_service(service)
 
@@ -36,14 +70,58 @@ async def get_response_from_agent(user_input: str, chat_history: ChatHistory):
         function_choice_behavior = FunctionChoiceBehavior.Auto()
     )
 
+    return AgentRuntime(kernel=kernel, settings=settings)
+
+
+_runtime: AgentRuntime | None = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime() -> AgentRuntime:
+    """
+    The process-wide runtime, built on first use.
+    The module outlives Streamlit reruns, so every rerun and every session reuses it.
+    Sessions run in their own threads, hence the lock. Sharing is safe: the chat history
+    is passed per call, and Semantic Kernel copies the settings on each request.
+    """
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                _runtime = build_runtime()
+    return _runtime
+
+
+def new_chat_history(runtime: AgentRuntime | None = None) -> TokenBudgetChatHistory:
+    """
+    A chat history kept within HISTORY_TOKEN_BUDGET: older turns are folded into a summary
+    (written by the agent's own service), so a long session does not resend its whole transcript
+    """
+    runtime = runtime or get_runtime()
+    history = TokenBudgetChatHistory(
+        max_tokens = config.HISTORY_TOKEN_BUDGET,
+        service = runtime.kernel.get_service(config.SERVICE_ID) if config.HISTORY_SUMMARIZE else None
+    )
+    history.add_system_message(SYSTEM_PROMPT)
+    return history
+
+
+async def get_response_from_agent(user_input: str, chat_history: ChatHistory, runtime: AgentRuntime | None = None):
+    """
+    Processes the user input with the shared kernel (or `runtime`, if given)
+    """
+    runtime = runtime or get_runtime()
+
     # 5. Process Chat
     chat_history.add_user_message(user_input)
+    if isinstance(chat_history, ChatHistoryReducer):
+        await chat_history.reduce()
 
     try:
-        response = await kernel.get_service(config.SERVICE_ID).get_chat_message_content(
+        response = await runtime.kernel.get_service(config.SERVICE_ID).get_chat_message_content(
             chat_history = chat_history,
-            settings = settings,
-            kernel = kernel
+            settings = runtime.settings,
+            kernel = runtime.kernel
         )
 
         chat_history.add_assistant_message(str(response))
@@ -51,10 +129,3 @@ async def get_response_from_agent(user_input: str, chat_history: ChatHistory):
 
     except Exception as e:
         return f"Error invoking agent: {str(e)}"
-
-
-
-
-
-    
-
@@ -1,12 +1,10 @@
 import streamlit as st
-import asyncio
-import pandas as pd
-from semantic_kernel.contents import ChatHistory
 
 # --- Local Imports (Refactored Structure) ---
 import database
 import config
-from agent import get_response_from_agent
+from agent import get_response_from_agent, new_chat_history
+from background_loop import get_loop
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -25,12 +23,8 @@ if "db_init" not in st.session_state:
 
 # 2. Initialize Chat History for Semantic Kernel
 if "history" not in st.session_state:
-    st.session_state.history = ChatHistory()
-    # System prompt to guide behavior
-    st.session_state.history.add_system_message(
-        "You are a helpful customer service agent. You can process refunds. "
-        "Always ask for the reason and the amount if not provided."
-    )
+    # Starts with the system prompt, and stays within the token budget (see agent.py)
+    st.session_state.history = new_chat_history()
 
 # 3. Initialize Message Log for UI rendering
 if "messages" not in st.session_state:
@@ -55,6 +49,10 @@ with col_chat:
             with st.chat_message(msg["role"]):
                 st.markdown(msg["content"])
 
+    # Size of the history sent with the last message
+    if st.session_state.history.last_report:
+        st.caption(f"🧾 History: {st.session_state.history.last_report}")
+
     # Chat Input
     if prompt := st.chat_input("I need a refund..."):
         # 1. Render User Message immediately
@@ -63,11 +61,16 @@ with col_chat:
             with st.chat_message("user"):
                 st.markdown(prompt)
 
-        # 2. Get Agent Response (Async call to agent.py)
+        # 2. Get Agent Response (Async call to agent.py, on the app's long-lived event loop,
+        #    so the Gemini connections are reused from one turn to the next)
         with st.spinner("Agent is thinking..."):
-            response_text = asyncio.run(
-                get_response_from_agent(prompt, st.session_state.history)
-            )
+            try:
+                response_text = get_loop().run(
+                    get_response_from_agent(prompt, st.session_state.history),
+                    timeout=config.AGENT_TURN_TIMEOUT
+                )
+            except TimeoutError:
+                response_text = f"Error invoking agent: no answer after {config.AGENT_TURN_TIMEOUT:.0f} seconds"
 
         # 3. Render Agent Message
         st.session_state.messages.append({"role": "assistant", "content": response_text})
@@ -87,16 +90,22 @@ with col_admin:
     
     st.divider()
     
-    # Fetch Pending Requests from Database
-    pending_df = database.get_pending_approvals()
+    # Pending Requests: loaded once per session, then only what changed since the last render
+    if "pending" not in st.session_state:
+        st.session_state.pending = database.PendingApprovals()
+    else:
+        st.session_state.pending.refresh()
+    pending = st.session_state.pending
     
-    if pending_df.empty:
+    if len(pending) == 0:
         st.success("✅ All clear! No pending approvals.")
     else:
-        st.warning(f"⚠️ {len(pending_df)} Request(s) Pending Action")
+        st.warning(f"⚠️ {len(pending)} Request(s) Pending Action")
+        if len(pending) > config.PENDING_CARDS_SHOWN:
+            st.caption(f"Showing the {config.PENDING_CARDS_SHOWN} oldest.")
         
         # Iterate through pending requests
-        for index, row in pending_df.iterrows():
+        for row in pending.oldest(config.PENDING_CARDS_SHOWN):
             # Create a card-like container for each request
             with st.container(border=True):
                 c1, c2 = st.columns([3, 1])
@@ -125,8 +134,20 @@ with col_admin:
 
     # --- Debug View (Optional) ---
     with st.expander("🔍 View All Database Records"):
-        import sqlite3
-        conn = sqlite3.connect(database.DB_FILE)
-        all_data = pd.read_sql_query("SELECT * FROM refund_requests ORDER BY id DESC", conn)
-        st.dataframe(all_data, use_container_width=True)
-        conn.close()
\ No newline at end of file
+        # Keyset pagination: the stack holds the `before_id` of each page visited (None = newest)
+        if "records_cursors" not in st.session_state:
+            st.session_state.records_cursors = [None]
+        cursors = st.session_state.records_cursors
+
+        page = database.get_refund_requests_page(cursors[-1], config.RECORDS_PAGE_SIZE)
+        st.dataframe(page, use_container_width=True)
+
+        p_col1, p_col2 = st.columns(2)
+        with p_col1:
+            if st.button("⬅️ Newer", disabled=len(cursors) == 1, use_container_width=True):
+                cursors.pop()
+                st.rerun()
+        with p_col2:
+            if st.button("Older ➡️", disabled=len(page) < config.RECORDS_PAGE_SIZE, use_container_width=True):
+                cursors.append(int(page["id"].iloc[-1]))
+                st.rerun()
@@ -0,0 +1,66 @@
+"""
+A long-lived event loop in a background thread.
+
+Streamlit runs the script synchronously, so each chat turn used to go through
+`asyncio.run`, which creates and closes an event loop every time. The Gemini
+client's HTTP session belongs to the loop it was opened on, so each turn then
+set up its connections (TCP + TLS) again. With one loop for the whole process,
+the session and its connections are reused by every turn, rerun and session.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Coroutine, TypeVar
+
+T = TypeVar("T")
+
+
+class BackgroundLoop:
+    """ An event loop running forever in a daemon thread; coroutines are submitted from any thread """
+
+    def __init__(self, name: str = "agent-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Coroutine[Any, Any, T]) -> concurrent.futures.Future[T]:
+        """ Schedules `coro` on the loop, returns right away """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+        """ Schedules `coro` on the loop and blocks the calling thread until it is done """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # The builtin TimeoutError (the two are only the same class from Python 3.11)
+            future.cancel()
+            raise TimeoutError(f"No result after {timeout} seconds") from None
+
+    def stop(self) -> None:
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+_loop: BackgroundLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> BackgroundLoop:
+    """
+    The process-wide loop, started on first use (it outlives Streamlit reruns, like the agent runtime)
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                _loop = BackgroundLoop()
+    return _loop
@@ -0,0 +1,93 @@
+"""
+Benchmark: the manager dashboard's database work per rerun, as the table grows.
+
+- "full reload": the old behaviour, every pending row plus the whole table for the
+  "View All Database Records" expander, read into DataFrames on every rerun
+- "change feed": `PendingApprovals.refresh()` (only what changed since the last
+  render) plus one keyset page of the table
+
+Between renders a few refunds are created and one pending request is approved,
+as happens when a manager clicks through the dashboard.
+
+Run: python benchmark_dashboard.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+import config
+import database
+
+STATUSES = ["APPROVED", "REJECTED"]
+
+
+def random_row(rng: random.Random, pending_share: float) -> tuple[str, str, float, str]:
+    status = "PENDING APPROVAL" if rng.random() < pending_share else rng.choice(STATUSES)
+    return f"user_{rng.randint(1, 50_000)}", "Item arrived damaged", round(rng.uniform(1, 500), 2), status
+
+
+def grow_table(rng: random.Random, rows: int, pending_share: float, batch_size: int = 10_000) -> None:
+    while rows > 0:
+        batch = [random_row(rng, pending_share) for _ in range(min(batch_size, rows))]
+        database.create_refund_requests(batch)
+        rows -= len(batch)
+
+
+def full_reload_render() -> None:
+    conn = database.get_connection()
+    pd.read_sql_query("SELECT * FROM refund_requests WHERE status = 'PENDING APPROVAL'", conn)
+    pd.read_sql_query("SELECT * FROM refund_requests ORDER BY id DESC", conn)
+
+
+def change_feed_render(pending: database.PendingApprovals) -> None:
+    pending.refresh()
+    pending.oldest(config.PENDING_CARDS_SHOWN)
+    database.get_refund_requests_page(None, config.RECORDS_PAGE_SIZE)
+
+
+def measure(render, rng: random.Random, renders: int, pending_share: float) -> float:
+    """ Mean ms per render, with a few writes before each one """
+    total = 0.0
+    for _ in range(renders):
+        for _ in range(3):
+            database.create_refund_request(*random_row(rng, pending_share))
+        pending_ids = database.get_pending_approvals()["id"]
+        if len(pending_ids):
+            database.update_refund_status(int(pending_ids.iloc[0]), "APPROVED")
+
+        start = time.perf_counter()
+        render()
+        total += time.perf_counter() - start
+    return total / renders * 1000
+
+
+def main(args) -> None:
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, "refunds.db")
+        database.init_db()
+
+        print(f"{'rows':>10}  {'full reload':>14}  {'change feed':>14}")
+        size = 0
+        for target in sorted(args.sizes):
+            grow_table(rng, target - size, args.pending_share)
+            size = target
+
+            pending = database.PendingApprovals()
+            full = measure(full_reload_render, rng, args.renders, args.pending_share)
+            feed = measure(lambda: change_feed_render(pending), rng, args.renders, args.pending_share)
+            print(f"{size:>10,}  {full:>11.2f} ms  {feed:>11.2f} ms")
+        database.close_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--pending-share", type=float, default=0.001, help="Share of rows pending approval")
+    parser.add_argument("--renders", type=int, default=10, help="Reruns measured per size and strategy")
+    main(parser.parse_args())
@@ -0,0 +1,124 @@
+"""
+Benchmark: the database layer at 1M refund requests.
+
+- inserts/sec: one connection per insert (the old way) vs the reused
+  connection vs `create_refund_requests` (executemany, one transaction per batch)
+- pending-approvals latency on a table of `--rows` rows (`--pending-share` of them
+  pending), with and without the index on `status`
+- async inserts through `acreate_refund_request`, while a ticker measures how
+  long the event loop was blocked
+
+Run: python benchmark_database.py --rows 1000000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import pandas as pd
+
+import database
+
+PENDING_QUERY = "SELECT * FROM refund_requests WHERE status = 'PENDING APPROVAL' ORDER BY id"
+STATUSES = ["APPROVED", "REJECTED"]
+
+
+def old_create_refund_request(user_id: str, reason: str, amount: float, status: str) -> None:
+    """ The old behaviour: a brand new connection for every insert """
+    conn = sqlite3.connect(database.DB_FILE)
+    conn.execute(
+        "INSERT INTO refund_requests (user_id, reason, amount, status) VALUES (?, ?, ?, ?)",
+        (user_id, reason, amount, status),
+    )
+    conn.commit()
+    conn.close()
+
+
+def random_row(rng: random.Random, pending_share: float) -> tuple[str, str, float, str]:
+    status = "PENDING APPROVAL" if rng.random() < pending_share else rng.choice(STATUSES)
+    return f"user_{rng.randint(1, 50_000)}", "Item arrived damaged", round(rng.uniform(1, 500), 2), status
+
+
+def time_inserts(label: str, insert, rows: list[tuple]) -> None:
+    start = time.perf_counter()
+    for row in rows:
+        insert(*row)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {len(rows) / elapsed:>12,.0f} inserts/s")
+
+
+def time_pending(label: str, runs: int) -> None:
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        # The raw query: get_pending_approvals() would be served from the query cache
+        pending = pd.read_sql_query(PENDING_QUERY, database.get_connection())
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    print(f"{label:<32} {len(pending):>8} rows  p50 {latencies[len(latencies) // 2]:.1f} ms  "
+          f"max {latencies[-1]:.1f} ms")
+
+
+async def time_async_inserts(rows: list[tuple]) -> None:
+    """ Concurrent async inserts; the ticker notices when the loop is blocked """
+    worst_gap = 0.0
+
+    async def ticker():
+        nonlocal worst_gap
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            worst_gap = max(worst_gap, now - last)
+            last = now
+
+    tick = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*[database.acreate_refund_request(*row) for row in rows])
+    elapsed = time.perf_counter() - start
+    tick.cancel()
+    print(f"{'async (acreate_refund_request)':<32} {len(rows) / elapsed:>12,.0f} inserts/s  "
+          f"event loop blocked at most {worst_gap * 1000:.1f} ms")
+
+
+def main(args) -> None:
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, "refunds.db")
+        database.init_db()
+
+        sample = [random_row(rng, args.pending_share) for _ in range(args.single_inserts)]
+        time_inserts("new connection per insert", old_create_refund_request, sample)
+        time_inserts("reused connection", database.create_refund_request, sample)
+
+        start = time.perf_counter()
+        remaining = args.rows - database.get_connection().execute("SELECT COUNT(*) FROM refund_requests").fetchone()[0]
+        while remaining > 0:
+            batch = [random_row(rng, args.pending_share) for _ in range(min(args.batch_size, remaining))]
+            database.create_refund_requests(batch)
+            remaining -= len(batch)
+        elapsed = time.perf_counter() - start
+        print(f"{'executemany (batches of ' + str(args.batch_size) + ')':<32} "
+              f"{args.rows / elapsed:>12,.0f} inserts/s  ({args.rows:,} rows in {elapsed:.1f} s)")
+
+        asyncio.run(time_async_inserts(sample[:500]))
+
+        time_pending("pending, with status index", args.queries)
+        with database.transaction() as conn:
+            conn.execute("DROP INDEX idx_refund_requests_status")
+        time_pending("pending, full table scan", args.queries)
+        database.close_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--pending-share", type=float, default=0.001, help="Share of rows pending approval")
+    parser.add_argument("--single-inserts", type=int, default=2000, help="Rows for the one-by-one insert runs")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--queries", type=int, default=20, help="Pending-approval queries per run")
+    main(parser.parse_args())
@@ -0,0 +1,130 @@
+"""
+Benchmark: per-turn latency of the chat path, before and after the long-lived event loop.
+
+- "before": `asyncio.run(...)` per turn, and the connector's default of a new Gemini
+  client per request, so every turn opens a new connection
+- "after": one `BackgroundLoop` and one shared Gemini client (`agent.build_runtime()`),
+  so the connection is opened once and kept alive
+
+Both talk to a local stand-in for the Gemini REST API (plain HTTP on localhost).
+Localhost has no round trips to speak of, so the cost of opening a connection to
+the real endpoint (TCP + TLS handshakes) is simulated with `--handshake-ms`, paid
+by the server on every new connection. `--response-ms` is the model's answer time.
+
+Run: python benchmark_event_loop.py --turns 50 --handshake-ms 60 --response-ms 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("GEMINI_API_KEY", "offline")
+
+from semantic_kernel.connectors.ai.google.google_ai.services.google_ai_chat_completion import GoogleAIChatCompletion
+from semantic_kernel.contents import ChatHistory
+
+import agent
+import config
+from background_loop import BackgroundLoop
+
+ANSWER = {
+    "candidates": [{
+        "content": {"role": "model", "parts": [{"text": "Could you tell me the amount and the reason?"}]},
+        "finishReason": "STOP",
+        "index": 0,
+    }],
+    "usageMetadata": {"promptTokenCount": 40, "candidatesTokenCount": 10, "totalTokenCount": 50},
+}
+
+
+class StandInGemini(BaseHTTPRequestHandler):
+    """ Answers every generateContent call with the same message """
+    protocol_version = "HTTP/1.1"  # Keep-alive
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes
+    handshake_seconds = 0.0
+    response_seconds = 0.0
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        StandInGemini.connections += 1
+        time.sleep(self.handshake_seconds)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.response_seconds)
+        body = json.dumps(ANSWER).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PerRequestClientService(GoogleAIChatCompletion):
+    """ The connector without a client (a new one per request), pointed at the stand-in """
+
+    def _get_http_options(self):
+        return {"base_url": config.GEMINI_BASE_URL}
+
+
+def new_history() -> ChatHistory:
+    history = ChatHistory()
+    history.add_system_message("You are a helpful customer service agent. You can process refunds.")
+    return history
+
+
+def report(label: str, latencies: list[float], connections: int) -> None:
+    latencies.sort()
+    turns = len(latencies)
+    print(f"{label:<7} {turns} turns  mean {sum(latencies) / turns:.1f} ms  p50 {latencies[turns // 2]:.1f} ms  "
+          f"p99 {latencies[int(turns * 0.99)]:.1f} ms  connections opened: {connections}")
+
+
+def run_turns(label: str, turns: int, turn) -> None:
+    history = new_history()
+    StandInGemini.connections = 0
+    latencies = []
+    for i in range(turns):
+        start = time.perf_counter()
+        turn(f"I need a refund, message {i}", history)
+        latencies.append((time.perf_counter() - start) * 1000)
+        # Keep the history short, so both runs send the same request
+        del history.messages[1:]
+    report(label, latencies, StandInGemini.connections)
+
+
+def main(args) -> None:
+    StandInGemini.handshake_seconds = args.handshake_ms / 1000
+    StandInGemini.response_seconds = args.response_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInGemini)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    config.GEMINI_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}"
+
+    before = agent.build_runtime(PerRequestClientService(
+        service_id=config.SERVICE_ID, gemini_model_id=config.AI_MODEL_ID, api_key="offline"
+    ))
+    run_turns("before", args.turns,
+              lambda text, history: asyncio.run(agent.get_response_from_agent(text, history, runtime=before)))
+
+    after = agent.build_runtime()
+    loop = BackgroundLoop()
+    run_turns("after", args.turns,
+              lambda text, history: loop.run(agent.get_response_from_agent(text, history, runtime=after)))
+    loop.stop()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--handshake-ms", type=float, default=60, help="Simulated TCP + TLS setup per new connection")
+    parser.add_argument("--response-ms", type=float, default=20, help="Stand-in model latency per request")
+    main(parser.parse_args())
@@ -0,0 +1,86 @@
+"""
+Benchmark: history tokens sent per turn over a long session, plain ChatHistory vs
+the token-budgeted one (`agent.new_chat_history()`).
+
+Every turn is a refund request that triggers the `process_refund` function, so the
+history also holds function calls and results. The chat service is an offline stand-in
+(see benchmark_kernel.py) that calls the function once, then answers; it also writes
+the summaries.
+
+Run: python benchmark_history.py --turns 200 --budget 4000
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import ClassVar
+
+from semantic_kernel.contents import AuthorRole, ChatHistory, ChatMessageContent, FunctionCallContent
+
+import config
+import database
+from agent import SYSTEM_PROMPT, build_runtime, get_response_from_agent, new_chat_history
+from benchmark_kernel import StandInChatCompletion
+# ../history_reducer.py, on sys.path once agent is imported
+from history_reducer import MESSAGE_OVERHEAD_TOKENS, estimate_tokens, message_text
+
+
+class RefundingStandIn(StandInChatCompletion):
+    """ Asks for the refund function on each new user message, then confirms """
+
+    summaries: ClassVar[int] = 0
+
+    async def _inner_get_chat_message_contents(self, chat_history, settings):
+        last = chat_history.messages[-1]
+        if last.role == AuthorRole.USER and last.content.startswith(("Conversation:", "Earlier summary:")):
+            RefundingStandIn.summaries += 1
+            return [ChatMessageContent(role=AuthorRole.ASSISTANT, content="The customer asked for several small refunds; all were approved.")]
+        if last.role == AuthorRole.USER:
+            call = FunctionCallContent(id=f"call_{len(chat_history.messages)}", function_name="process_refund",
+                                       plugin_name="Refunds", arguments={"user_id": "u1", "reason": "broken", "amount": 20})
+            return [ChatMessageContent(role=AuthorRole.ASSISTANT, items=[call])]
+        return [ChatMessageContent(role=AuthorRole.ASSISTANT, content="Your refund of $20 for the broken item was approved.")]
+
+
+def history_tokens(history: ChatHistory) -> int:
+    return sum(estimate_tokens(message_text(message)) + MESSAGE_OVERHEAD_TOKENS for message in history.messages)
+
+
+async def run_session(label: str, turns: int, history: ChatHistory, runtime) -> None:
+    sent = []
+    start = time.perf_counter()
+    for i in range(turns):
+        await get_response_from_agent(f"Turn {i}: I need a refund of $20, the toaster I got is broken.", history, runtime=runtime)
+        # What the next request would carry
+        sent.append(history_tokens(history))
+    elapsed = time.perf_counter() - start
+    checkpoints = "  ".join(f"turn {n}: {sent[n - 1]}" for n in (10, turns // 2, turns) if n <= turns)
+    print(f"{label:<9} tokens per request  {checkpoints}  total {sum(sent):,}  ({elapsed:.1f} s)")
+
+
+async def main_async(args) -> None:
+    config.HISTORY_TOKEN_BUDGET = args.budget
+    runtime = build_runtime(RefundingStandIn(service_id=config.SERVICE_ID, gemini_model_id=config.AI_MODEL_ID, api_key="offline"))
+
+    plain = ChatHistory()
+    plain.add_system_message(SYSTEM_PROMPT)
+    await run_session("plain", args.turns, plain, runtime)
+
+    budgeted = new_chat_history(runtime)
+    await run_session("budgeted", args.turns, budgeted, runtime)
+    print(f"budgeted: {budgeted.tokens_saved_total:,} tokens saved over the session, "
+          f"{RefundingStandIn.summaries} summarization calls; last turn: {budgeted.last_report}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--budget", type=int, default=4000, help="HISTORY_TOKEN_BUDGET")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        # The refunds go to a throwaway database
+        database.DB_FILE = os.path.join(tmp, "refunds.db")
+        database.init_db()
+        asyncio.run(main_async(args))
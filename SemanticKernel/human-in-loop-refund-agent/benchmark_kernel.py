@@ -0,0 +1,65 @@
+"""
+Micro-benchmark: per-turn overhead of building the kernel vs reusing it.
+
+- "rebuild": the old behaviour, a new Kernel + AI service + RefundPlugin + settings per message
+- "reuse": one `AgentRuntime` built up front, shared by every message
+
+The chat service is an offline stand-in: Gemini's connector (so the function
+calling setup runs as usual) with the network call replaced by a canned
+answer. What is left is the per-turn overhead on our side.
+
+Run: python benchmark_kernel.py --turns 500
+"""
+
+import argparse
+import asyncio
+import time
+
+from semantic_kernel.contents import AuthorRole, ChatHistory, ChatMessageContent
+from semantic_kernel.connectors.ai.google.google_ai.services.google_ai_chat_completion import GoogleAIChatCompletion
+
+import config
+from agent import build_runtime, get_response_from_agent
+
+
+class StandInChatCompletion(GoogleAIChatCompletion):
+    """ The Gemini connector without the network call """
+
+    async def _inner_get_chat_message_contents(self, chat_history, settings):
+        return [ChatMessageContent(role=AuthorRole.ASSISTANT, content="Could you tell me the amount and the reason?")]
+
+
+def stand_in_service() -> StandInChatCompletion:
+    return StandInChatCompletion(service_id=config.SERVICE_ID, gemini_model_id=config.AI_MODEL_ID, api_key="offline")
+
+
+async def run_turns(label: str, turns: int, rebuild: bool) -> None:
+    history = ChatHistory()
+    history.add_system_message("You are a helpful customer service agent. You can process refunds.")
+    shared = None if rebuild else build_runtime(stand_in_service())
+
+    latencies = []
+    for i in range(turns):
+        start = time.perf_counter()
+        runtime = build_runtime(stand_in_service()) if rebuild else shared
+        await get_response_from_agent(f"I need a refund, message {i}", history, runtime=runtime)
+        latencies.append((time.perf_counter() - start) * 1000)
+        # Keep the history short, so both runs measure the same work per turn
+        del history.messages[1:]
+
+    latencies.sort()
+    print(f"{label:<8} {turns} turns  mean {sum(latencies) / turns:.3f} ms  "
+          f"p50 {latencies[turns // 2]:.3f} ms  p99 {latencies[int(turns * 0.99)]:.3f} ms")
+
+
+async def main_async(args) -> None:
+    # Warm up imports and caches first, so neither run pays for them
+    await run_turns("warm-up", 20, rebuild=True)
+    await run_turns("rebuild", args.turns, rebuild=True)
+    await run_turns("reuse", args.turns, rebuild=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=500)
+    asyncio.run(main_async(parser.parse_args()))
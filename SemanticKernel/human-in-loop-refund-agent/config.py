@@ -10,7 +10,15 @@ GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
 # AI_MODEL_ID = "gemini-3.0-flash-preview"
 AI_MODEL_ID = "gemini-2.5-flash-lite"
 SERVICE_ID = "gemini_chat"
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")  # Optional: a proxy or a local stand-in for the Gemini API
+AGENT_TURN_TIMEOUT = float(os.getenv("AGENT_TURN_TIMEOUT", "120"))  # Seconds a chat turn may take
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000"))  # Estimated tokens of chat history sent per turn
+HISTORY_SUMMARIZE = os.getenv("HISTORY_SUMMARIZE", "true").lower() == "true"  # Summarize older turns (else drop them)
 
 # Business Rules
 REFUND_AUTO_APPROVE_LIMIT = 50.0  # Threshold for human intervention
-CURRENCY_SYMBOL = "$"
\ No newline at end of file
+CURRENCY_SYMBOL = "$"
+
+# Dashboard
+PENDING_CARDS_SHOWN = 20  # Oldest pending requests shown as cards
+RECORDS_PAGE_SIZE = 50    # Rows per page in "View All Database Records"
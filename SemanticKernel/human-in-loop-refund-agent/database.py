@@ -1,31 +1,144 @@
+import asyncio
+import heapq
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from typing import Callable
 import pandas as pd
 
 # Database setup
 DB_FILE = "refunds.db"
 
+# One connection per thread (Streamlit runs each session in its own thread,
+# the async helpers below run in worker threads), reused across calls
+_local = threading.local()
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    The calling thread's connection to DB_FILE, opened on first use
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(DB_FILE)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, timeout=30)
+        # WAL: the dashboard can read while the agent writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[DB_FILE] = conn
+    return conn
+
+
+@contextmanager
+def transaction():
+    """
+    Commits on success, rolls back on error
+    """
+    conn = get_connection()
+    with conn:
+        yield conn
+
+
+def close_connection():
+    """
+    Closes the calling thread's connection (the next call opens a new one)
+    """
+    connections = getattr(_local, "connections", {})
+    conn = connections.pop(DB_FILE, None)
+    if conn is not None:
+        conn.close()
+
+
 def init_db():
     """
     Initializes the SQLite database with a refunds table
     """
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    with transaction() as conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS refund_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            reason TEXT NOT NULL,
+            amount REAL NOT NULL,
+            status TEXT NOT NULL, -- 'APPROVED', 'REJECTED', 'PENDING APPROVAL'
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        # Databases created before the change feed: add the column (existing rows get version 0)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(refund_requests)")]
+        if "version" not in columns:
+            conn.execute("ALTER TABLE refund_requests ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        # The dashboard only ever looks for one status
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_refund_requests_status ON refund_requests (status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_refund_requests_version ON refund_requests (version)")
+
+        # The change feed: one counter, bumped by every write and stamped on the rows it touched
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_feed (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        """)
+        conn.execute("INSERT OR IGNORE INTO change_feed (id, version) VALUES (1, 0)")
+
+# Change Feed
+
+def _next_version(conn: sqlite3.Connection) -> int:
+    """
+    Bumps the counter inside the caller's write transaction.
+    SQLite has one writer at a time, so versions become visible in increasing order.
+    """
+    return conn.execute("UPDATE change_feed SET version = version + 1 RETURNING version").fetchone()[0]
+
+def current_version() -> int:
+    """
+    The high-water mark: changes with a higher version have not been written yet
+    """
+    return get_connection().execute("SELECT version FROM change_feed").fetchone()[0]
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS refund_requests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        reason TEXT NOT NULL,
-        amount REAL NOT NULL,
-        status TEXT NOT NULL, -- 'APPROVED', 'REJECTED', 'PENDING APPROVAL'
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+def get_changes_since(version: int) -> tuple[int, pd.DataFrame]:
+    """
+    (new high-water mark, current state of every row written after `version`)
+    """
+    # Read the mark first: a write landing in between is returned now and again next time,
+    # which is harmless since callers apply rows by id
+    new_version = current_version()
+    if new_version == version:
+        return version, _empty_frame()
+    changes = pd.read_sql_query(
+        "SELECT * FROM refund_requests WHERE version > ? ORDER BY version", get_connection(), params=(version,)
     )
-    """)
+    return new_version, changes
 
-    conn.commit()
-    conn.close()
+# Query Cache
+# Results are keyed by the change feed version, so any write (from any thread or process)
+# invalidates them; a cached read costs one single-row query
+
+_cache: dict[tuple, tuple[int, pd.DataFrame]] = {}
+_cache_lock = threading.Lock()
+CACHE_MAX_ENTRIES = 256
+
+def _cached(key: tuple, load: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    version = current_version()
+    with _cache_lock:
+        hit = _cache.get((DB_FILE, *key))
+    if hit is not None and hit[0] == version:
+        return hit[1].copy()
+
+    result = load()
+    with _cache_lock:
+        if len(_cache) >= CACHE_MAX_ENTRIES:
+            _cache.clear()
+        _cache[(DB_FILE, *key)] = (version, result)
+    return result.copy()
+
+def _empty_frame() -> pd.DataFrame:
+    return pd.read_sql_query("SELECT * FROM refund_requests LIMIT 0", get_connection())
 
 # CRUD Operations
 
@@ -33,43 +146,108 @@ def create_refund_request(user_id: str, reason: str, amount: float, status: str)
     """
     Creates a new refund request
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-    INSERT INTO refund_requests (user_id, reason, amount, status)
-    VALUES (?, ?, ?, ?)
-    """, (user_id, reason, amount, status)
-    )
+    with transaction() as conn:
+        cursor = conn.execute("""
+        INSERT INTO refund_requests (user_id, reason, amount, status, version)
+        VALUES (?, ?, ?, ?, ?)
+        """, (user_id, reason, amount, status, _next_version(conn))
+        )
+    return cursor.lastrowid
 
-    conn.commit()
-    conn.close()
+def create_refund_requests(rows: list[tuple[str, str, float, str]]):
+    """
+    Bulk insert of (user_id, reason, amount, status) rows in one transaction
+    """
+    with transaction() as conn:
+        version = _next_version(conn)
+        conn.executemany("""
+        INSERT INTO refund_requests (user_id, reason, amount, status, version)
+        VALUES (?, ?, ?, ?, ?)
+        """, [(*row, version) for row in rows]
+        )
 
 def get_pending_approvals():
     """
     Retrieves all refund requests that are pending approval
     """
-    conn = sqlite3.connect(DB_FILE)
-    df = pd.read_sql_query("SELECT * FROM refund_requests WHERE status = 'PENDING APPROVAL'", conn)
-    conn.close()
-    return df
+    return _cached(("pending",), lambda: pd.read_sql_query(
+        "SELECT * FROM refund_requests WHERE status = 'PENDING APPROVAL' ORDER BY id", get_connection()
+    ))
+
+def get_refund_requests_page(before_id: int | None = None, limit: int = 50) -> pd.DataFrame:
+    """
+    One page of the full table, newest first. Keyset pagination: pass the last id of
+    the previous page as `before_id`, so every page is an index range scan, however deep
+    """
+    if before_id is None:
+        query, params = "SELECT * FROM refund_requests ORDER BY id DESC LIMIT ?", (limit,)
+    else:
+        query, params = "SELECT * FROM refund_requests WHERE id < ? ORDER BY id DESC LIMIT ?", (before_id, limit)
+    return _cached(("page", before_id, limit), lambda: pd.read_sql_query(query, get_connection(), params=params))
 
 def update_refund_status(request_id: int, new_status: str):
     """
     Updates the status of a refund request
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    with transaction() as conn:
+        conn.execute("""
+        UPDATE refund_requests SET status = ?, version = ? WHERE id = ?
+        """, (new_status, _next_version(conn), request_id)
+        )
 
-    cursor.execute("""
-    UPDATE refund_requests SET status = ? WHERE id = ?
-    """, (new_status, request_id)
-    )
+def update_refund_statuses(updates: list[tuple[int, str]]):
+    """
+    Bulk update of (request_id, new_status) pairs in one transaction
+    """
+    with transaction() as conn:
+        version = _next_version(conn)
+        conn.executemany("""
+        UPDATE refund_requests SET status = ?, version = ? WHERE id = ?
+        """, [(new_status, version, request_id) for request_id, new_status in updates]
+        )
+
+class PendingApprovals:
+    """
+    The dashboard's copy of the pending requests, kept up to date from the change feed.
+    A refresh with nothing new costs one single-row query; otherwise only the changed rows are read.
+    """
+
+    def __init__(self):
+        # Mark first, then the snapshot (see get_changes_since)
+        self.version = current_version()
+        self.rows = {row["id"]: row for row in get_pending_approvals().to_dict("records")}
+
+    def refresh(self) -> int:
+        """
+        Applies the changes since the last refresh, returns how many rows changed
+        """
+        self.version, changes = get_changes_since(self.version)
+        for row in changes.to_dict("records"):
+            if row["status"] == "PENDING APPROVAL":
+                self.rows[row["id"]] = row
+            else:
+                self.rows.pop(row["id"], None)
+        return len(changes)
+
+    def oldest(self, limit: int) -> list[dict]:
+        return [self.rows[request_id] for request_id in heapq.nsmallest(limit, self.rows)]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+# Async entry points: the blocking SQLite work runs in a worker thread,
+# so the event loop (e.g. the kernel's function calling) is not blocked
+
+async def acreate_refund_request(user_id: str, reason: str, amount: float, status: str) -> int:
+    return await asyncio.to_thread(create_refund_request, user_id, reason, amount, status)
+
+async def aget_pending_approvals():
+    return await asyncio.to_thread(get_pending_approvals)
 
-    conn.commit()
-    conn.close()
+async def aupdate_refund_status(request_id: int, new_status: str):
+    await asyncio.to_thread(update_refund_status, request_id, new_status)
 
 
 if __name__ == "__main__":
     init_db()
-    print("Database initialized successfully")
\ No newline at end of file
+    print("Database initialized successfully")
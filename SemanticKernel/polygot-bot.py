@@ -6,7 +6,8 @@ from dotenv import load_dotenv
 from semantic_kernel import Kernel
 from semantic_kernel.connectors.ai.google.google_ai.services.google_ai_chat_completion import GoogleAIChatCompletion
 from semantic_kernel.connectors.ai.google.google_ai.google_ai_prompt_execution_settings import GoogleAIPromptExecutionSettings
-from semantic_kernel.contents.chat_history import ChatHistory
+
+from history_reducer import TokenBudgetChatHistory
 
 load_dotenv() 
 
@@ -15,6 +16,9 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY_5")
 #model  = "gemini-2.5-flash"
 MODEL = "gemini-3-flash-preview"
 
+# Older turns are folded into a summary once the history grows past this many tokens
+HISTORY_TOKEN_BUDGET = 2000
+
 async def main():
     # The Kernel - Operating System for AI
     kernel = Kernel()
@@ -31,7 +35,7 @@ async def main():
 
     # The Context/ History
     # Initialize the chat history with a system persona
-    history = ChatHistory()
+    history = TokenBudgetChatHistory(max_tokens = HISTORY_TOKEN_BUDGET, service = gemini_service)
     history.add_system_message("""
     You are a helpful assistant that translates everything the user says into 
     17th century pirate speak. Arr !
@@ -51,6 +55,9 @@ async def main():
         # Add the user input to the chat history
         history.add_user_message(user_input)
 
+        # Keep the history within its token budget before sending it
+        await history.reduce()
+
         # Invoke the service
         # We ask the kernel to get a completion from the service
         try:
@@ -61,6 +68,7 @@ async def main():
 
             # Print the result and add it to the chat history
             print(f"Pirate Bot: {result}")
+            print(f"   (history: {history.last_report})")
             history.add_assistant_message(str(result))
 
         except Exception as e:
@@ -1,5 +1,7 @@
 import asyncio
 import os
+from dataclasses import dataclass
+from typing import Any
 from dotenv import load_dotenv
 
 from semantic_kernel import Kernel
@@ -7,7 +9,8 @@ from semantic_kernel.functions import kernel_function
 from semantic_kernel.connectors.ai.google.google_ai.services.google_ai_chat_completion import GoogleAIChatCompletion
 from semantic_kernel.connectors.ai.google.google_ai.google_ai_prompt_execution_settings import GoogleAIPromptExecutionSettings
 from semantic_kernel.connectors.ai.function_choice_behavior import FunctionChoiceBehavior
-from semantic_kernel.contents.chat_history import ChatHistory
+
+from history_reducer import TokenBudgetChatHistory
 
 load_dotenv() 
 
@@ -16,27 +19,196 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY_5")
 #model  = "gemini-2.5-flash"
 MODEL = "gemini-2.5-flash"
 
+# Older turns are folded into a summary once the history grows past this many tokens
+HISTORY_TOKEN_BUDGET = 2000
+
+# Simulated round trip of one hub call (hub / cloud API), whatever the number of commands in it
+DEVICE_LATENCY_SECONDS = float(os.getenv("DEVICE_LATENCY_SECONDS", "0.3"))
+# Commands issued within this window (one model response) go to the hub in a single call
+COMMAND_BATCH_WINDOW_SECONDS = 0.01
+
 # -- 1. Define the plugin (The Tools) --
+class DeviceBackend:
+    """
+    Stands in for the IoT hub: one call carries any number of device commands and takes
+    `latency` seconds, without blocking the event loop.
+    """
+    def __init__(self, latency: float = DEVICE_LATENCY_SECONDS):
+        self.latency = latency
+        self.calls = 0
+        self.commands_sent = 0
+
+    async def send_batch(self, commands: dict[str, Any]) -> None:
+        """ `commands`: the state to set, per device ("kitchen/lights": "on", "bedroom/thermostat": 20) """
+        # In real app, we would call an IOT API here
+        await asyncio.sleep(self.latency)
+        self.calls += 1
+        self.commands_sent += len(commands)
+
+
+@dataclass
+class CommandStats:
+    requested: int = 0   # Device actions the model asked for
+    suppressed: int = 0  # The device already was (or was about to be) in that state: nothing sent
+    coalesced: int = 0   # Replaced by a later command for the same device, in the same batch
+    batches: int = 0     # Hub calls
+    sent: int = 0        # Device commands in those calls
+
+    def __str__(self) -> str:
+        return (f"{self.requested} requested, {self.suppressed} suppressed, {self.coalesced} coalesced, "
+                f"{self.sent} sent in {self.batches} hub call(s)")
+
+
 class SmartHomePlugin:
     """
     A plugin for controlling smart home devices.
+    The plugin keeps a shadow of each device's state (as last confirmed by the hub), so a command
+    that would not change anything is not sent, and the model can read the state for free.
+    The actions are async: when the model asks for several in one response, the Kernel runs them
+    side by side and they are sent together, in one hub call. A batch waits for the earlier batches
+    of its own devices only, so the commands for a device reach it in the order they were given,
+    while batches for other devices are not held up.
+    An action answers once the hub confirmed the device's state, and reports that state: a command
+    replaced by a later one in the same batch (on, then off) says so instead of claiming success.
     """
+    def __init__(self, backend: DeviceBackend | None = None, batch_window: float = COMMAND_BATCH_WINDOW_SECONDS):
+        self.backend = backend or DeviceBackend()
+        self.batch_window = batch_window
+        self.stats = CommandStats()
+        self.shadow: dict[str, Any] = {}     # Last state confirmed by the hub, per device
+        self._expected: dict[str, Any] = {}  # The state once the queued commands are sent
+        self._pending: dict[str, Any] = {}   # The next batch
+        self._pending_sent: asyncio.Future | None = None
+        self._in_flight: dict[str, asyncio.Future] = {}  # The batch carrying each device's latest command
+        self._sending: dict[str, asyncio.Future] = {}    # The last batch sent (or waiting to be) per device
+        self._flushes: set[asyncio.Task] = set()
+
+    async def _set(self, room_name: str, device_type: str, state: Any) -> tuple[bool, Any]:
+        """
+        Brings a device to `state`. Returns (whether this call changed it, its state once applied),
+        which is not `state` if a later command for the device, in the same batch, replaced this one
+        """
+        device = f"{room_name.strip().lower()}/{device_type}"
+        self.stats.requested += 1
+        if self._expected.get(device, self.shadow.get(device)) == state:
+            self.stats.suppressed += 1
+            batch = self._in_flight.get(device)
+            if batch is None:
+                print(f"\n[SHADOW] {device} is already {state}, nothing sent")
+                return False, state
+            # That state is still on its way to the hub: answer once it is applied (or replaced)
+            states, _ = await asyncio.shield(batch)
+            return False, states[device]
+
+        if device in self._pending:
+            self.stats.coalesced += 1
+        self._pending[device] = state
+        self._expected[device] = state
+        if self._pending_sent is None:
+            pending, sent = self._pending, asyncio.get_running_loop().create_future()
+            self._pending_sent = sent
+            flush = asyncio.create_task(self._flush_after_window(pending, sent))
+            self._flushes.add(flush)
+            flush.add_done_callback(lambda task: self._flush_done(task, pending, sent))
+        batch = self._in_flight[device] = self._pending_sent
+        # Shielded: one caller being cancelled must not cancel the batch for the others
+        states, commands = await asyncio.shield(batch)
+        return commands.get(device) == state, states[device]
+
+    async def _flush_after_window(self, batch: dict[str, Any], sent: asyncio.Future) -> None:
+        # `batch` is still filled by the other actions of the model response until the window ends
+        await asyncio.sleep(self.batch_window)
+        self._pending, self._pending_sent = {}, None
+
+        # Wait for the earlier batches of these devices only: the others go out side by side
+        earlier = {self._sending[device] for device in batch if device in self._sending}
+        for device in batch:
+            self._sending[device] = sent
+        if earlier:
+            await asyncio.wait(earlier)
+
+        # E.g. "on" then "off" within the batch, for lights that were off
+        commands = {device: state for device, state in batch.items() if self.shadow.get(device) != state}
+        self.stats.suppressed += len(batch) - len(commands)
+        try:
+            if commands:
+                print(f"\n[HARDWARE ACTION] Hub call: {commands}")
+                await self.backend.send_batch(commands)
+        except Exception as e:
+            self._abandon(batch, sent)
+            sent.set_exception(e)
+            return
+        if commands:
+            self.stats.batches += 1
+            self.stats.sent += len(commands)
+        self.shadow.update(commands)
+        # The state of every device of the batch, and the commands actually sent
+        sent.set_result((batch, commands))
+
+    def _flush_done(self, flush: asyncio.Task, batch: dict[str, Any], sent: asyncio.Future) -> None:
+        self._flushes.discard(flush)
+        if not sent.done():
+            # The flush was cancelled (maybe before it even started): so are the actions
+            # waiting for the batch, instead of waiting forever
+            self._abandon(batch, sent)
+            sent.cancel()
+        for device in batch:
+            if self._in_flight.get(device) is sent:
+                del self._in_flight[device]
+            if self._sending.get(device) is sent:
+                del self._sending[device]
+
+    def _abandon(self, batch: dict[str, Any], sent: asyncio.Future) -> None:
+        """ The batch may or may not have reached the hub """
+        if self._pending_sent is sent:
+            # Cancelled within the window: later commands start a new batch
+            self._pending, self._pending_sent = {}, None
+        # Expect what the shadow says again, unless a newer command is queued
+        for device in batch:
+            if device not in self._pending:
+                self._expected.pop(device, None)
+
     @kernel_function(description="Turns on the lights in a specific room", name="turn_on_lights")
-    def turn_on_light(self, room_name: str) -> str:
-        # In real app, we would call an IOT API here
-        print(f"\n[HARDWARE ACTION] Turning on the lights in {room_name}")
-        return f"Turned on the lights in {room_name}"
+    async def turn_on_light(self, room_name: str) -> str:
+        changed, lights = await self._set(room_name, "lights", "on")
+        if lights != "on":
+            return f"The lights in {room_name} are {lights}: a later command turned them {lights} again"
+        return f"Turned on the lights in {room_name}" if changed else f"The lights in {room_name} were already on"
     
     @kernel_function(description="Turns off the lights in a specific room", name="turn_off_lights")
-    def turn_off_light(self, room_name: str) -> str:
-        print(f"\n[HARDWARE ACTION] Turning off the lights in {room_name}")
-        return f"Turned off the lights in {room_name}"
+    async def turn_off_light(self, room_name: str) -> str:
+        changed, lights = await self._set(room_name, "lights", "off")
+        if lights != "off":
+            return f"The lights in {room_name} are {lights}: a later command turned them {lights} again"
+        return f"Turned off the lights in {room_name}" if changed else f"The lights in {room_name} were already off"
     
     @kernel_function(description="Sets the thermostat temperature", name="set_temperature")
-    def set_temperature(self, room_name: str, degrees: int) -> str:
-        print(f"\n[HARDWARE ACTION] Setting the temperature to {degrees} degrees Celsius in {room_name}")
+    async def set_temperature(self, room_name: str, degrees: int) -> str:
+        changed, temperature = await self._set(room_name, "thermostat", degrees)
+        if temperature != degrees:
+            return f"The temperature in {room_name} is set to {temperature} degrees Celsius: a later command replaced this one"
+        if not changed:
+            return f"The temperature in {room_name} was already set to {degrees} degrees Celsius"
         return f"Set the temperature to {degrees} degrees Celsius in {room_name}"
 
+    @kernel_function(
+        description="Gets the current state of the lights and thermostat in a room, or in every room if no room is given",
+        name="get_device_state"
+    )
+    def get_device_state(self, room_name: str = "") -> str:
+        # Read from the shadow: no hardware call
+        room = room_name.strip().lower()
+        rooms = [room] if room else sorted({device.split("/")[0] for device in self.shadow})
+        if not rooms:
+            return "No device state known yet"
+        lines = []
+        for room in rooms:
+            lights = self.shadow.get(f"{room}/lights", "unknown")
+            thermostat = self.shadow.get(f"{room}/thermostat")
+            temperature = f"{thermostat} degrees Celsius" if thermostat is not None else "unknown"
+            lines.append(f"{room}: lights {lights}, thermostat {temperature}")
+        return "\n".join(lines)
+
 
 async def main():
 
@@ -53,7 +225,8 @@ async def main():
 
     # -- 3. Register the Plugin --
     # We import the class and create an instance of it
-    kernel.add_plugin(SmartHomePlugin(), plugin_name="SmartHome")
+    plugin = SmartHomePlugin()
+    kernel.add_plugin(plugin, plugin_name="SmartHome")
 
     # -- 4. Configure Auto Tool Calling --
     # This tells the LLM to automatically use tools when needed
@@ -62,7 +235,7 @@ async def main():
         function_choice_behavior = FunctionChoiceBehavior.Auto()
     )
 
-    history = ChatHistory()
+    history = TokenBudgetChatHistory(max_tokens = HISTORY_TOKEN_BUDGET, service = service)
     history.add_system_message("""
     You are a smart home assistant that controls smart home devices.
     """)
@@ -80,6 +253,9 @@ async def main():
 
         history.add_user_message(user_input)
 
+        # Keep the history within its token budget before sending it
+        await history.reduce()
+
         # -- 5. Invoke the Tools --
         # The Kernel will:
         # 1. Send your text to Gemini
@@ -96,6 +272,8 @@ async def main():
             )
 
             print(f"Smart Home Agent: {result}")
+            print(f"   (history: {history.last_report})")
+            print(f"   (devices: {plugin.stats})")
             history.add_assistant_message(str(result))
 
         except Exception as e:
@@ -119,7 +297,14 @@ if __name__ == "__main__":
 
     Multi-Step Command:
     User: "I'm going to bed in the bedroom. Make it 20 degrees and turn off the lights." 
-    Result: It should trigger two separate actions: set_temperature AND turn_off_light.
+    Result: It should trigger two separate actions: set_temperature AND turn_off_light,
+     sent together in a single hub call.
+
+    Repeated Command:
+    User: "Turn off the bedroom lights." (again) Result: [SHADOW] ... nothing sent
+
+    State Query:
+    User: "Is anything still on?" Result: answered from get_device_state, no [HARDWARE ACTION]
     """
     asyncio.run(main())
     
\ No newline at end of file